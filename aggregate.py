@@ -0,0 +1,269 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Online per-segment aggregates of traffic data.
+
+Each parsed snapshot updates running count, sum, min, max of speed and
+count of congested records of every segment in NumPy arrays for each
+window length (such as 15 minutes and an hour). Windows are aligned to
+local time. When a snapshot of a new window arrives, the finished window
+is appended to
+
+    <prefix>.<YYYYMMDD>.a<window>  AGGREGATE_DTYPE records of segments
+                                   with data. Records of a window are
+                                   sorted by id.
+    <prefix>.<YYYYMMDD>.i<window>  RUN_DTYPE records (start, offset,
+                                   count) of each window in .a file
+
+where YYYYMMDD is the local day of window start. Statistics of a period
+are read from these files instead of raw snapshots. A segment is found
+in each window by a binary search, so a query reads about one record per
+window.
+
+An unfinished window is also written by close(). Records of the same
+window and segment written before and after a restart are merged by
+read().
+"""
+
+import calendar
+import os
+import threading
+import time
+import numpy as np
+import speedstore as ss
+
+AGGREGATE_DTYPE = np.dtype([('start', '<i8'), ('id', '<u4'),
+                            ('count', '<u4'), ('sum', '<u8'),
+                            ('min', 'u1'), ('max', 'u1'),
+                            ('congested', '<u4')])
+RUN_DTYPE = np.dtype([('start', '<i8'), ('offset', '<i8'), ('count', '<u4')])
+# a record is congested if its color code is at least CONGESTED
+# (See render.COLORS)
+CONGESTED = 4
+
+
+def window_start(t, window):
+    """Start of window of a time. Windows are aligned to local time.
+
+    :param t: Seconds since epoch
+    :param window: Window length in seconds
+    :return: Seconds since epoch
+    :rtype: int
+    """
+    offset = calendar.timegm(time.localtime(t)) - int(t)
+    return int(t) - (int(t) + offset) % window
+
+
+class _Window(object):
+    """Running aggregates of a window length."""
+
+    def __init__(self, length):
+        self.length = length
+        self.start = None
+        self._resize(0)
+
+    def _resize(self, n):
+        self.count = np.zeros(n, dtype=np.uint32)
+        self.sum = np.zeros(n, dtype=np.uint64)
+        self.min = np.full(n, 255, dtype=np.uint8)
+        self.max = np.zeros(n, dtype=np.uint8)
+        self.congested = np.zeros(n, dtype=np.uint32)
+
+    def _grow(self, n):
+        old = (self.count, self.sum, self.min, self.max, self.congested)
+        self._resize(max(n, 2 * len(old[0])))
+        for a, b in zip((self.count, self.sum, self.min, self.max,
+                         self.congested), old):
+            a[:len(b)] = b
+
+    def add(self, ids, speeds, colors, congested):
+        """Add a snapshot. ids are unique."""
+        if len(ids) and ids.max() >= len(self.count):
+            self._grow(int(ids.max()) + 1)
+        self.count[ids] += 1
+        self.sum[ids] += speeds
+        self.min[ids] = np.minimum(self.min[ids], speeds)
+        self.max[ids] = np.maximum(self.max[ids], speeds)
+        self.congested[ids] += colors >= congested
+
+    def records(self):
+        """Aggregates of segments with data.
+
+        :rtype: np.ndarray of AGGREGATE_DTYPE
+        """
+        i = np.flatnonzero(self.count)
+        r = np.empty(len(i), dtype=AGGREGATE_DTYPE)
+        r['start'], r['id'] = self.start, i
+        r['count'], r['sum'] = self.count[i], self.sum[i]
+        r['min'], r['max'] = self.min[i], self.max[i]
+        r['congested'] = self.congested[i]
+        return r
+
+    def reset(self, start):
+        """Start a new window."""
+        self.start = start
+        for a, v in ((self.count, 0), (self.sum, 0), (self.min, 255),
+                     (self.max, 0), (self.congested, 0)):
+            a.fill(v)
+
+
+class Aggregator(object):
+    """Online aggregates of traffic data for several window lengths."""
+
+    def __init__(self, directory, windows=(900, 3600),
+                 prefix='TrafficDataNew', congested=CONGESTED):
+        """
+        :param directory: Directory of files
+        :param windows: Window lengths in seconds
+        :param prefix: File name prefix
+        :param congested: Minimum color code of a congested record
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.congested = congested
+        self.windows = dict((w, _Window(w)) for w in windows)
+        self._lock = threading.Lock()
+
+    def path(self, window, day, kind='a'):
+        """Full path to a file of a window length and day.
+
+        :param window: Window length in seconds
+        :param day: Day as 'YYYYMMDD'
+        :param kind: 'a' (aggregates) or 'i' (index of windows)
+        :rtype: str
+        """
+        return os.path.join(self.directory, '{0}.{1}.{2}{3:d}'.format(
+            self.prefix, day, kind, window))
+
+    def _write(self, w):
+        r = w.records()
+        if not len(r): return
+        day = time.strftime('%Y%m%d', time.localtime(w.start))
+        f = self.path(w.length, day)
+        run = np.zeros(1, dtype=RUN_DTYPE)
+        run['start'], run['count'] = w.start, len(r)
+        run['offset'] = os.path.getsize(f) // AGGREGATE_DTYPE.itemsize \
+            if os.path.exists(f) else 0
+        with open(f, 'ab') as fl:
+            fl.write(r.tostring())
+        with open(self.path(w.length, day, 'i'), 'ab') as fl:
+            fl.write(run.tostring())
+
+    def update(self, date, ids, speeds, colors):
+        """Add a snapshot.
+
+        Windows finished before date are written to disk. Snapshots must
+        arrive in time order.
+
+        :param date: Date of snapshot
+        :param ids: Unique segment ids
+        :param speeds: Speeds
+        :param colors: Color codes
+        :type date: datetime.datetime
+        """
+        t = ss.timestamp(date)
+        ids = np.asarray(ids, dtype=np.intp)
+        speeds = np.asarray(speeds, dtype=np.uint8)
+        colors = np.asarray(colors, dtype=np.uint8)
+        with self._lock:
+            for w in self.windows.values():
+                start = window_start(t, w.length)
+                if start != w.start:
+                    if w.start is not None: self._write(w)
+                    w.reset(start)
+                w.add(ids, speeds, colors, self.congested)
+
+    def close(self):
+        """Write unfinished windows. Next update starts them again."""
+        with self._lock:
+            for w in self.windows.values():
+                if w.start is not None: self._write(w)
+                w.start = None
+
+    def read(self, window, day):
+        """Read aggregates of a day.
+
+        :param window: Window length in seconds
+        :param day: Day as 'YYYYMMDD'
+        :return: Records sorted by (start, id)
+        :rtype: np.ndarray of AGGREGATE_DTYPE
+        """
+        r = np.fromfile(self.path(window, day), dtype=AGGREGATE_DTYPE) \
+            if os.path.exists(self.path(window, day)) else \
+            np.zeros(0, dtype=AGGREGATE_DTYPE)
+        return merge(r)
+
+    def segment(self, seg_id, window, start, end):
+        """Aggregates of a segment between two dates.
+
+        :param seg_id: Segment id
+        :param window: Window length in seconds
+        :param start: Start date (local time)
+        :param end: End date (local time)
+        :type start: datetime.datetime
+        :type end: datetime.datetime
+        :return: Records of windows overlapping [start, end)
+        :rtype: np.ndarray of AGGREGATE_DTYPE
+        """
+        t0 = window_start(ss.timestamp(start), window)
+        t1 = ss.timestamp(end)
+        days = sorted(set(time.strftime('%Y%m%d', time.localtime(t))
+                          for t in range(t0, t1, 86400)) |
+                      set([time.strftime('%Y%m%d', time.localtime(t1))]))
+        r = np.concatenate([self._find(seg_id, window, d) for d in days])
+        return merge(r[(r['start'] >= t0) & (r['start'] < t1)])
+
+    def _find(self, seg_id, window, day):
+        """Records of a segment in a day by binary search in each window."""
+        a = ss.memmap(self.path(window, day), AGGREGATE_DTYPE)
+        runs = ss.memmap(self.path(window, day, 'i'), RUN_DTYPE)
+        ids = a['id']
+        rows = []
+        for o, n in zip(runs['offset'].tolist(), runs['count'].tolist()):
+            i = o + int(np.searchsorted(ids[o:o + n], seg_id))
+            if i < o + n and ids[i] == seg_id: rows.append(i)
+        r = a[np.array(rows, dtype=np.int64)]
+        # records written without their index such as by a crash
+        end = int(runs['offset'][-1] + runs['count'][-1]) if len(runs) else 0
+        if end < len(a):
+            tail = np.asarray(a[end:])
+            r = np.concatenate([r, tail[tail['id'] == seg_id]])
+        return np.asarray(r)
+
+
+def merge(r):
+    """Merge records of the same window and segment and sort them.
+
+    :param r: Records of AGGREGATE_DTYPE
+    :rtype: np.ndarray of AGGREGATE_DTYPE
+    """
+    if not len(r): return r
+    key = np.lexsort((r['id'], r['start']))
+    r = r[key]
+    new = np.ones(len(r), dtype=bool)
+    new[1:] = (r['start'][1:] != r['start'][:-1]) | \
+        (r['id'][1:] != r['id'][:-1])
+    if new.all(): return r
+    i = np.flatnonzero(new)
+    m = r[i].copy()
+    for f in ('count', 'sum', 'congested'):
+        m[f] = np.add.reduceat(r[f], i)
+    m['min'] = np.minimum.reduceat(r['min'], i)
+    m['max'] = np.maximum.reduceat(r['max'], i)
+    return m
+
+
+def mean_speed(r):
+    """Mean speed of records.
+
+    :rtype: np.ndarray
+    """
+    return r['sum'] / np.maximum(r['count'], 1).astype(np.float64)
+
+
+def congestion_share(r):
+    """Share of congested records of each window.
+
+    :rtype: np.ndarray
+    """
+    return r['congested'] / np.maximum(r['count'], 1).astype(np.float64)
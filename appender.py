@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Long lived buffered appenders of data files for tkm.py
+
+An Appender keeps its file open and buffers written records. Buffer is
+written when flush_bytes bytes are collected or flush_interval seconds
+pass since last flush. File is synced and its modification time is set to
+the date of the last record once per flush.
+
+Appenders also flushes buffers of feeds which went quiet by a timer
+thread, so a record is not kept in buffer much longer than
+flush_interval without a next write.
+"""
+
+import os
+import threading
+import time
+
+
+class Appender(object):
+    """Buffered appender of a file."""
+
+    def __init__(self, f, flush_interval=300.0, flush_bytes=1 << 20,
+                 fsync=True):
+        """
+        :param f: Full path to file
+        :param flush_interval: Maximum seconds a record is kept in buffer
+        :param flush_bytes: Buffer size to flush
+        :param fsync: Sync file to disk on each flush
+        """
+        self.path = f
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+        self._buffer = []
+        self._size = 0
+        self._last_modified = None
+        self._flushed = time.time()
+        self._file = None
+
+    def write(self, data, last_modified):
+        """Append data.
+
+        :param data: Data to append
+        :param last_modified: Date of data. Modification time of file is set
+                              to this date on flush.
+        :type data: str
+        :type last_modified: datetime.datetime
+        """
+        self._buffer.append(data)
+        self._size += len(data)
+        self._last_modified = last_modified
+        if self._size >= self.flush_bytes or self.stale():
+            self.flush()
+
+    def stale(self):
+        """Return True if flush_interval passed since last flush.
+
+        :rtype: bool
+        """
+        return time.time() - self._flushed >= self.flush_interval
+
+    def flush(self):
+        """Write buffer to file."""
+        self._flushed = time.time()
+        if not self._buffer: return
+        if self._file is None: self._file = open(self.path, 'ab')
+        self._file.write(''.join(self._buffer))
+        self._file.flush()
+        if self.fsync: os.fsync(self._file.fileno())
+        self._buffer, self._size = [], 0
+        # change creation and last modified datetime of file.
+        os.utime(self.path, (self._flushed,
+                             time.mktime(self._last_modified.timetuple())))
+
+    def close(self):
+        """Flush and close file."""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Appenders(object):
+    """Registry of appenders by feed.
+
+    Each feed has one open file at a time. Writing to another file of a
+    feed (i.e. file of the next day) closes the previous one.
+    """
+
+    def __init__(self, flush_interval=300.0, flush_bytes=1 << 20,
+                 fsync=True):
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+        self._appenders = {}
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def _run(self, stop):
+        # checks 4 times per interval, so a quiet buffer is flushed at
+        # most 1.25 * flush_interval after last flush
+        while not stop.wait(max(self.flush_interval / 4.0, 0.05)):
+            self.flush_stale()
+
+    def _start(self):
+        if self._stop is not None: return
+        self._stop = threading.Event()
+        t = threading.Thread(target=self._run, args=(self._stop,),
+                             name='appenders')
+        t.daemon = True
+        t.start()
+
+    def write(self, f, data, last_modified, key=None):
+        """Append data to a file.
+
+        :param f: Full path to file
+        :param data: Data to append
+        :param last_modified: Date of data
+        :param key: Feed of file. Default is f.
+        """
+        key = f if key is None else key
+        with self._lock:
+            a = self._appenders.get(key)
+            if a is None or a.path != f:
+                if a is not None: a.close()  # roll over
+                a = self._appenders[key] = Appender(
+                    f, self.flush_interval, self.flush_bytes, self.fsync)
+            a.write(data, last_modified)
+            self._start()
+
+    def flush(self):
+        """Flush all appenders."""
+        with self._lock:
+            for a in self._appenders.values(): a.flush()
+
+    def flush_stale(self):
+        """Flush appenders not flushed for flush_interval seconds.
+
+        It is called by the timer thread started on first write.
+        """
+        with self._lock:
+            for a in self._appenders.values():
+                if a.stale(): a.flush()
+
+    def close(self):
+        """Close all appenders and the timer. Next write opens them."""
+        with self._lock:
+            for a in self._appenders.values(): a.close()
+            self._appenders.clear()
+            if self._stop is not None: self._stop.set()
+            self._stop = None
+
+    def paths(self):
+        """Full paths to open files.
+
+        :rtype: list
+        """
+        with self._lock:
+            return [a.path for a in self._appenders.values()]
@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Seekable compressed archives of data files.
+
+A data file ('date;data' lines) is compressed in independent blocks of
+lines into <file>.blk. Sidecar <file>.blk.idx holds an INDEX_DTYPE record
+per block with the date of its first line, so a snapshot can be read by
+decompressing only one block.
+"""
+
+import os
+import shutil
+import time
+from collections import namedtuple as nt
+import numpy as np
+import pylzma
+import delta
+from speedstore import timestamp
+
+INDEX_DTYPE = np.dtype([('date', '<i8'), ('offset', '<i8'),
+                        ('length', '<u4'), ('lines', '<u4')])
+SNAPSHOT = nt('Snapshot', 'date data')
+EXT = '.blk'
+_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def line_date(line):
+    """Date of a data line as seconds since epoch (local time).
+
+    :param line: 'YYYY-MM-DD HH:MM:SS;data' line
+    :rtype: int
+    """
+    return int(time.mktime(time.strptime(line[:19], _DATE_FORMAT)))
+
+
+class BlockWriter(object):
+    """Writes lines to a block archive.
+
+    Lines are buffered and compressed as a block when block_lines lines or
+    block_bytes bytes are collected. A delta encoded or SAME line (See
+    delta.py) which starts a block is written as full data, so every block
+    starts with a keyframe and can be decoded alone.
+    """
+
+    def __init__(self, f, block_lines=60, block_bytes=4 << 20):
+        """
+        :param f: Full path to archive (.blk is not added)
+        :param block_lines: Maximum number of lines in a block
+        :param block_bytes: Maximum uncompressed size of a block
+        """
+        self.path = f
+        self.block_lines = block_lines
+        self.block_bytes = block_bytes
+        self._lines = []
+        self._size = 0
+        self._data = open(f, 'wb')
+        self._index = open(f + '.idx', 'wb')
+
+    def write(self, line):
+        """Write a 'date;data' line. Line end is added if missing.
+
+        :type line: str
+        """
+        if not line.endswith('\n'): line += '\r\n'
+        if len(self._lines) >= self.block_lines or \
+                self._size >= self.block_bytes:
+            data = line[20:].rstrip('\r\n')
+            if delta.is_dependent(data):
+                data = self._expand(data)
+                if data is not None: line = line[:20] + data + '\r\n'
+            if data is not None: self.flush()
+        self._lines.append(line)
+        self._size += len(line)
+
+    def _expand(self, data):
+        """Full data of a dependent line following buffered lines.
+
+        :return: None if buffered lines cannot be decoded
+        :rtype: str
+        """
+        d = delta.DeltaDecoder()
+        try:
+            for l in self._lines: d.decode(l[20:].rstrip('\r\n'))
+            return d.decode(data)
+        except ValueError:
+            return None
+
+    def flush(self):
+        """Compress buffered lines as a block."""
+        if not self._lines: return
+        # pylint: disable=E1101
+        block = pylzma.compress(''.join(self._lines), dictionary=22)
+        rec = np.array([(line_date(self._lines[0]), self._data.tell(),
+                         len(block), len(self._lines))], dtype=INDEX_DTYPE)
+        self._data.write(block)
+        self._index.write(rec.tostring())
+        self._lines, self._size = [], 0
+
+    def close(self):
+        """Flush and close archive."""
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def build(f, block_lines=60, remove=False):
+    """Build a block archive of a data file.
+
+    :param f: Full path to data file
+    :param block_lines: Number of lines in a block
+    :param remove: Remove data file after archive is built
+    :return: Full path to archive
+    :rtype: str
+    """
+    fn = f + EXT
+    with open(f, 'rb') as fl, BlockWriter(fn, block_lines) as w:
+        for l in fl:
+            if l.strip(): w.write(l)
+    if remove: os.remove(f)
+    return fn
+
+
+def concat(parts, f, remove=False):
+    """Concatenate archives into an archive without recompression.
+
+    Blocks of parts are copied as they are and their index records are
+    shifted, so each part must start with a keyframe (See BlockWriter).
+
+    :param parts: Full paths to archives in order
+    :param f: Full path to new archive
+    :param remove: Remove parts after they are copied
+    :return: Full path to archive
+    :rtype: str
+    """
+    with open(f, 'wb') as data, open(f + '.idx', 'wb') as idx:
+        for p in parts:
+            index = read_index(p).copy()
+            index['offset'] += data.tell()
+            with open(p, 'rb') as fl: shutil.copyfileobj(fl, data, 1 << 20)
+            idx.write(index.tostring())
+            if remove:
+                os.remove(p)
+                os.remove(p + '.idx')
+    return f
+
+
+def read_index(f):
+    """Read index of an archive.
+
+    :param f: Full path to archive
+    :rtype: np.ndarray
+    """
+    return np.fromfile(f + '.idx', dtype=INDEX_DTYPE)
+
+
+def read_block(f, i, index=None):
+    """Read lines of block i of an archive.
+
+    :param f: Full path to archive
+    :param i: Block number
+    :param index: Index of archive if it is already read
+    :rtype: list
+    """
+    r = (read_index(f) if index is None else index)[i]
+    with open(f, 'rb') as fl:
+        fl.seek(int(r['offset']))
+        block = fl.read(int(r['length']))
+    # pylint: disable=E1101
+    return pylzma.decompress(block).splitlines()
+
+
+def read_lines(f):
+    """Read all lines of an archive block by block.
+
+    :param f: Full path to archive
+    :rtype: generator
+    """
+    index = read_index(f)
+    for i in range(len(index)):
+        for l in read_block(f, i, index): yield l
+
+
+def read_snapshot(f, date):
+    """Read the latest snapshot at or before date from an archive.
+
+    Delta encoded and SAME snapshots are returned as full data.
+
+    :param f: Full path to archive
+    :param date: datetime or seconds since epoch
+    :return: SNAPSHOT(date, data) or None if there is no such snapshot
+    :rtype: SNAPSHOT
+    """
+    t = date if isinstance(date, (int, long, float)) else timestamp(date)
+    index = read_index(f)
+    i = np.searchsorted(index['date'], t, side='right') - 1
+    if i < 0: return None
+    found, decoder = None, delta.DeltaDecoder()
+    for l in read_block(f, i, index):
+        if not l: continue
+        d = line_date(l)
+        if d > t: break
+        found = SNAPSHOT(d, decoder.decode(l[20:]))
+    return found
@@ -1,74 +1,107 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 # pylint: disable=C0103, C0321, W0212
-"""Compression utility for 7z and zip files. Optimized for csv files."""
+"""Compression utility for 7z, zip and xz files. Optimized for csv files.
+
+Data is streamed by BUFFER_SIZE chunks, so memory usage does not depend
+on file size. xz files need the lzma module (backports.lzma on Python 2,
+See README.md); other types work without it.
+"""
 
 import os
+import struct
 import zipfile as zipf
+from functools import partial
 import pylzma
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+BUFFER_SIZE = 1 << 20
+
+
+def _require_lzma():
+    if lzma is None:
+        raise ImportError("xz files require lzma module "
+                          "(backports.lzma on Python 2)")
+
 
+def _chunks(f, size):
+    """Iterate over chunks of a file like object which has read(size)."""
+    return iter(partial(f.read, size), b'')
 
-def compress(f, rename_to=None, big_data=False, f_type='7z'):
+
+def compress(f, rename_to=None, big_data=False, f_type='7z',
+             buffer_size=BUFFER_SIZE):
     """
     Compresses a file. Optimized for csv files.
 
+    Data is streamed from file to compressed file by buffer_size chunks, so
+    memory usage does not depend on file size.
+
     :param f: Full file path
-    :param big_data: If True, directly reads data from file, compress it and
-                     writes to new file. Uses less memory. Suitable for big
-                     data.
-    :param f_type: File type: 7z | zip
+    :param big_data: Not used. Kept for compatibility, data is always
+                     streamed.
+    :param f_type: File type: 7z | zip | xz
+    :param buffer_size: Size of read/write buffer in bytes
     :type f_type: str
     :type big_data: bool
     :type f: str
     """
-    f_types = ['7z', 'zip']
+    f_types = ['7z', 'zip', 'xz']
     if f_type not in f_types:
         raise ValueError("f_type must be one of %s" % f_types)
 
     fn = f if rename_to is None else rename_to
     fn = fn + '.' + f_type
     if f_type == f_types[0]:
-        import struct
-        with open(f, "rb") as f1:
+        with open(f, "rb") as f1, open(fn, 'wb') as f2:
             # pylint: disable=E1101
             c = pylzma.compressfile(f1, literalContextBits=4, eos=0,
                                     dictionary=24, fastBytes=255)
-            result = c.read(5) + struct.pack('<Q', os.path.getsize(f))
-            with open(fn, 'wb') as f2: f2.write(result)
-            with open(fn, 'ab') as f2:
-                if big_data:
-                    while True:
-                        tmp = c.read(1024)
-                        if not tmp: break
-                        f2.write(tmp)
-                else:
-                    f2.write(c.read())
+            f2.write(c.read(5) + struct.pack('<Q', os.path.getsize(f)))
+            for tmp in _chunks(c, buffer_size): f2.write(tmp)
     elif f_type == f_types[1]:
         # http://stackoverflow.com/questions/14568647/create-zip-in-python?rq=1
         with zipf.ZipFile(fn, 'w', zipf.ZIP_DEFLATED) as z:
             f2 = os.path.splitext(fn)[0] + os.path.splitext(f)[1]
             z.write(f, os.path.basename(f2))
+    elif f_type == f_types[2]:
+        _require_lzma()
+        with open(f, "rb") as f1, open(fn, 'wb') as f2:
+            c = lzma.LZMACompressor(preset=6)
+            for tmp in _chunks(f1, buffer_size): f2.write(c.compress(tmp))
+            f2.write(c.flush())
     return fn
 
 
-def decompress(f, rename_to=None):
+def decompress(f, rename_to=None, buffer_size=BUFFER_SIZE):
     """
     Decompress a compressed file by the extension.
-    Only supports .7z and .zip files.
+    Only supports .7z, .zip and .xz files.
 
     :type f: str
     :param f: Full path to file
+    :param buffer_size: Size of read buffer in bytes
     """
-    f_types = ['.7z', '.zip']
+    f_types = ['.7z', '.zip', '.xz']
     fn, ext = os.path.splitext(f)
     if ext not in f_types:
         raise ValueError("f extension must be one of %s" % f_types)
     fn = fn if rename_to is None else rename_to
     if ext == f_types[0]:
-        with open(f, "rb") as fl: cdata = fl.read()
-        with open(fn, 'wb') as fl:
+        with open(f, "rb") as f1, open(fn, 'wb') as f2:
+            props = f1.read(5)
+            size = struct.unpack('<Q', f1.read(8))[0]
             # pylint: disable=E1101
-            fl.write(pylzma.decompress_compat(cdata[0:5] + cdata[13:]))
+            d = pylzma.decompressobj(maxlength=size)
+            f2.write(d.decompress(props))
+            for tmp in _chunks(f1, buffer_size): f2.write(d.decompress(tmp))
+            f2.write(d.flush())
     elif ext == f_types[1]:
         with zipf.ZipFile(f) as z:
             p = os.path.dirname(f)
@@ -76,6 +109,11 @@ def decompress(f, rename_to=None):
             fn = z.namelist()
             fn = [os.path.join(p, i) for i in fn]
             if len(fn) == 1: fn = fn[0]
+    elif ext == f_types[2]:
+        _require_lzma()
+        with open(f, "rb") as f1, open(fn, 'wb') as f2:
+            d = lzma.LZMADecompressor()
+            for tmp in _chunks(f1, buffer_size): f2.write(d.decompress(tmp))
     return fn
 
 
@@ -93,6 +131,3 @@ def read_from_zip(f):
         if len(il) > 0:
             byts = z.read(il[0].filename)
     return byts.decode()
-
-
-
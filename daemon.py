@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321, W0212
+"""Collector daemon of tkm.py
+
+A single process runs instant data, static files and compression as jobs
+of one scheduler. A locked pidfile keeps a second daemon from starting,
+SIGHUP reloads the configuration file and reopens log and data files, and
+a unix control socket answers status requests.
+
+    daemon.py start | stop | reload | status | run [JOB] | foreground
+
+Configuration file is optional (default: tkm.conf next to tkm.py):
+
+    [tkm]
+    delta = 0
+    dedup = yes
+    aggregate = 900,3600
+    compress_type = 7z
+    overrun = skip
+
+    [jobs]
+    ; name = on interval action[,action...]
+    instant = 00 60 traffic_data,traffic_index,parking_data,...
+    static = 30:00 3600 static_files
+    compress = 00:10:00 86400 compress
+"""
+
+import ConfigParser
+import SocketServer
+import errno
+import fcntl
+import json
+import logging as log
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple as nt
+import tkm
+
+JOB = nt('JobSpec', 'name on interval action')
+# default jobs. on and interval are arguments of scheduler.
+JOBS = [JOB('instant', '00', 60, sorted(tkm._INSTANT)),
+        JOB('static', '30:00', 3600, 'static_files'),
+        JOB('compress', '00:10:00', 86400, 'compress')]
+# [tkm] options of configuration file -> (type, tkm.configure() parameter)
+OPTIONS = {'base_url': (str, 'base_url'),
+           'columnar': (bool, 'columnar'),
+           'compress_type': (str, 'compress_type'),
+           'delta': (int, 'delta'),
+           'dedup': (bool, 'dedup'),
+           'aggregate': (lambda v: [int(w) for w in v.split(',') if w],
+                         'aggregate'),
+           'flush_interval': (int, 'flush_interval'),
+           'metrics_json': (str, 'metrics_json'),
+           'metrics_port': (int, 'metrics_port')}  # read on start only
+CONFIG = os.path.join(tkm.DIR.cur, 'tkm.conf')
+PIDFILE = os.path.join(tkm.DIR.cur, 'tkm.pid')
+SOCKET = os.path.join(tkm.DIR.cur, 'tkm.sock')
+
+
+class AlreadyRunning(RuntimeError):
+    """Raised if pidfile is locked by another process."""
+    pass
+
+
+class PidFile(object):
+    """Pidfile locked while daemon runs.
+
+    Lock is released by the kernel when process exits, so a stale pidfile
+    does not keep daemon from starting.
+    """
+
+    def __init__(self, f):
+        self.path = f
+        self._file = None
+
+    def acquire(self):
+        """Lock pidfile and write pid.
+
+        :raise AlreadyRunning: if pidfile is locked
+        """
+        fl = open(self.path, 'a+')
+        try:
+            fcntl.flock(fl.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            fl.close()
+            if e.errno not in (errno.EAGAIN, errno.EACCES): raise
+            raise AlreadyRunning('%s is locked by pid %s' % (
+                self.path, read_pid(self.path)))
+        fl.truncate(0)
+        fl.write('%d\n' % os.getpid())
+        fl.flush()
+        self._file = fl
+        return self
+
+    def release(self):
+        """Remove pidfile and release lock."""
+        if self._file is None: return
+        os.remove(self.path)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def read_pid(f=PIDFILE):
+    """Pid of running daemon.
+
+    :param f: Pidfile
+    :return: Pid or None if daemon is not running
+    :rtype: int
+    """
+    try:
+        with open(f) as fl:
+            fcntl.flock(fl.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+        return None  # not locked
+    except IOError as e:
+        if e.errno == errno.ENOENT: return None
+        if e.errno not in (errno.EAGAIN, errno.EACCES): raise
+    with open(f) as fl:
+        pid = fl.read().strip()
+    return int(pid) if pid.isdigit() else None
+
+
+def read_config(f=CONFIG):
+    """Read configuration file.
+
+    :param f: Configuration file. Defaults are used if it does not exist.
+    :return: (settings for tkm.configure(), overrun policy, list of JOB)
+    :rtype: tuple
+    """
+    settings, overrun, jobs = {}, tkm.sc.SKIP, list(JOBS)
+    cp = ConfigParser.RawConfigParser()
+    if not cp.read(f): return settings, overrun, jobs
+    if cp.has_section('tkm'):
+        for k, v in cp.items('tkm'):
+            if k == 'overrun':
+                overrun = v
+                continue
+            if k not in OPTIONS:
+                raise ValueError('%s: unknown option %s' % (f, k))
+            typ, name = OPTIONS[k]
+            settings[name] = cp.getboolean('tkm', k) if typ is bool \
+                else typ(v)
+    if cp.has_section('jobs'):
+        jobs = []
+        for name, v in cp.items('jobs'):
+            on, interval, action = v.split()
+            action = action.split(',')
+            jobs.append(JOB(name, on, int(interval), action[0] if len(
+                action) == 1 and action[0] not in tkm._INSTANT else action))
+    return settings, overrun, jobs
+
+
+class _ControlHandler(SocketServer.StreamRequestHandler):
+    """Answers a command line by a JSON line."""
+
+    def handle(self):
+        cmd = self.rfile.readline().split()
+        try:
+            r = self.server.tkm_daemon.command(*cmd) if cmd else \
+                {'error': 'empty command'}
+        except (TypeError, ValueError) as e:
+            r = {'error': str(e)}
+        except Exception as e:  # pylint: disable=W0703
+            log.exception('control command %s', ' '.join(cmd))
+            r = {'error': str(e)}
+        self.wfile.write(json.dumps(r, sort_keys=True) + '\n')
+
+
+class _ControlServer(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon(object):
+    """Runs jobs of configuration by a scheduler until stopped."""
+
+    def __init__(self, config=CONFIG, control=SOCKET):
+        """
+        :param config: Configuration file
+        :param control: Path to control socket. None disables it.
+        """
+        self.config = config
+        self.control = control
+        self.started = None
+        self.reloads = 0
+        self.scheduler = None
+        self.jobs = []
+        self._stopping = False
+        self._reload = False
+        self._locks = {}  # job name -> lock of runs
+        self._server = None
+        self._defaults = None  # settings before configuration is applied
+
+    def _job(self, spec):
+        """Job function which never runs twice at the same time."""
+        func = tkm.job(spec.action)
+        lock = self._locks.setdefault(spec.name, threading.Lock())
+
+        def _run(planned):
+            if not lock.acquire(False):
+                log.warning('%s is already running. Skipped.', spec.name)
+                return
+            try:
+                func(planned)
+            finally:
+                lock.release()
+        return _run
+
+    def _schedule(self):
+        settings, overrun, jobs = read_config(self.config)
+        # an option removed from configuration gets its default again
+        if self._defaults is None: self._defaults = tkm.settings()
+        tkm.configure(**dict(self._defaults, **settings))
+        scheduler = tkm.sc.Scheduler()
+        for spec in jobs:
+            if isinstance(spec.action, list):  # instant data
+                # retries must not pass the next tick
+                tkm.configure(tick_budget=spec.interval * 0.8)
+            scheduler.add(spec.name, self._job(spec),
+                          tkm.sc.next_time(spec.on), spec.interval, overrun)
+        self.jobs = jobs
+        return scheduler
+
+    def run(self):
+        """Run jobs until stop() is called. reload() restarts scheduler
+        with configuration read again after running jobs finish."""
+        self.started = time.time()
+        if self.control:
+            if os.path.exists(self.control): os.remove(self.control)
+            self._server = _ControlServer(self.control, _ControlHandler)
+            self._server.tkm_daemon = self
+            os.chmod(self.control, 0o600)  # it can stop daemon
+            t = threading.Thread(target=self._server.serve_forever,
+                                 name='control')
+            t.daemon = True
+            t.start()
+        tkm.METRICS.collector(self._collect)
+        metrics = tkm.mt.serve(tkm.METRICS, tkm.METRICS_PORT) \
+            if tkm.METRICS_PORT > 0 else None
+        log.info('Daemon started. pid: %d', os.getpid())
+        try:
+            while not self._stopping:
+                self.scheduler = self._schedule()
+                if tkm.METRICS_JSON:
+                    self.scheduler.add(
+                        'metrics', lambda _: tkm.METRICS.dump(
+                            tkm.METRICS_JSON), None, tkm.METRICS_INTERVAL)
+                # stop() or reload() was called during _schedule()
+                if self._stopping or self._reload: self.scheduler.stop()
+                self.scheduler.run()
+                if self._reload:
+                    self._reload = False
+                    self.reloads += 1
+                    self._reopen()
+                    log.info('Daemon reloaded.')
+        finally:
+            tkm.close_files()
+            if self._server is not None:
+                self._server.shutdown()
+                self._server.server_close()
+                os.remove(self.control)
+            if metrics is not None: metrics.shutdown()
+            if tkm.METRICS_JSON: tkm.METRICS.dump(tkm.METRICS_JSON)
+            log.info('Daemon terminated gracefully.')
+
+    def _collect(self, m):
+        if self.scheduler is not None:
+            tkm._collect_metrics(self.scheduler)(m)
+
+    @staticmethod
+    def _reopen():
+        """Reopen log file and data files such as after log rotation."""
+        tkm.close_files()
+        for h in log.getLogger().handlers:
+            if isinstance(h, log.FileHandler): h.close()  # opened on emit
+
+    def stop(self):
+        """Stop after running jobs finish. Safe in a signal handler."""
+        self._stopping = True
+        if self.scheduler is not None: self.scheduler.stop()
+
+    def reload(self):
+        """Reload configuration after running jobs finish. Safe in a signal
+        handler."""
+        self._reload = True
+        if self.scheduler is not None: self.scheduler.stop()
+
+    def status(self):
+        """Status of daemon and its jobs.
+
+        :rtype: dict
+        """
+        jobs = []
+        s = self.scheduler
+        for j in (s.jobs if s is not None else []):
+            lock = self._locks.get(j.name)
+            jobs.append({'name': j.name, 'interval': j.interval,
+                         'runs': j.runs, 'dropped': j.dropped,
+                         'running': bool(lock and lock.locked()),
+                         'last_run': j.last_run, 'next_run': j.planned})
+        a = tkm._appenders
+        return {'pid': os.getpid(), 'started': self.started,
+                'reloads': self.reloads, 'base_url': tkm.BASE_URL,
+                'maxrss_kb': resource.getrusage(
+                    resource.RUSAGE_SELF).ru_maxrss,
+                'circuits': dict((tkm._feed(u), b.state)
+                                 for u, b in tkm.BREAKERS.items()),
+                'open_files': a.paths() if a is not None else [],
+                'jobs': jobs}
+
+    def command(self, cmd, *args):
+        """Run a control command.
+
+        :param cmd: status, reload, stop, flush or run
+        :param args: Job names of run. Default is all jobs.
+        :rtype: dict
+        """
+        if cmd == 'status': return self.status()
+        if cmd == 'reload':
+            self.reload()
+        elif cmd == 'stop':
+            self.stop()
+        elif cmd == 'flush':
+            tkm.flush_files()
+        elif cmd == 'run':
+            if self.scheduler is None: return {'error': 'not running'}
+            specs = dict((j.name, j) for j in self.jobs)
+            for name in args or [j.name for j in self.jobs]:
+                if name not in specs:
+                    raise ValueError('unknown job %s' % name)
+                # run now in its own thread, lock prevents overlapping
+                self.scheduler.add(name, self._job(specs[name]))
+        else:
+            raise ValueError('unknown command %s' % cmd)
+        return {'ok': True}
+
+
+def control(cmd, path=SOCKET, timeout=10):
+    """Send a command to running daemon.
+
+    :param cmd: Command line such as 'status' or 'run compress'
+    :param path: Path to control socket
+    :return: Response of daemon
+    :rtype: dict
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(path)
+        s.sendall(cmd + '\n')
+        r = s.makefile('rb').readline()
+    finally:
+        s.close()
+    return json.loads(r)
+
+
+def foreground(config=CONFIG, pidfile=PIDFILE, control_socket=SOCKET):
+    """Run daemon in this process until SIGTERM or SIGINT.
+
+    :raise AlreadyRunning: if a daemon is running
+    """
+    tkm.setup_logging()
+    d = Daemon(config, control_socket)
+    signal.signal(signal.SIGTERM, lambda *_: d.stop())
+    signal.signal(signal.SIGINT, lambda *_: d.stop())
+    signal.signal(signal.SIGHUP, lambda *_: d.reload())
+    with PidFile(pidfile):
+        d.run()
+
+
+def _wait(pidfile, timeout):
+    end = time.time() + timeout
+    while read_pid(pidfile) is not None:
+        if time.time() > end: return False
+        time.sleep(0.1)
+    return True
+
+
+def main():
+    """Entry point."""
+    import argparse
+    p = argparse.ArgumentParser(description='Collector daemon of tkm.py')
+    p.add_argument('command', choices=['start', 'stop', 'reload', 'status',
+                                       'run', 'foreground'])
+    p.add_argument('jobs', nargs='*', help='jobs of run {default: all}')
+    p.add_argument('--config', default=CONFIG,
+                   help='configuration file {default: %s}' % CONFIG)
+    p.add_argument('--pidfile', default=PIDFILE)
+    p.add_argument('--socket', default=SOCKET)
+    args = p.parse_args()
+    pid = read_pid(args.pidfile)
+    if args.command == 'foreground':
+        try:
+            foreground(args.config, args.pidfile, args.socket)
+        except AlreadyRunning as e:
+            sys.exit(str(e))
+    elif args.command == 'start':
+        if pid is not None: sys.exit('already running. pid: %d' % pid)
+        with open(os.devnull, 'r+') as null:
+            # a second daemon started at the same time exits on the lock
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), 'foreground',
+                 '--config', args.config, '--pidfile', args.pidfile,
+                 '--socket', args.socket], stdin=null, stdout=null,
+                stderr=null, cwd=tkm.DIR.cur, preexec_fn=os.setsid,
+                close_fds=True)
+    elif pid is None:
+        sys.exit('not running')
+    elif args.command == 'stop':
+        os.kill(pid, signal.SIGTERM)
+        if not _wait(args.pidfile, 300): sys.exit('%d did not stop' % pid)
+    elif args.command == 'reload':
+        os.kill(pid, signal.SIGHUP)
+    else:
+        print json.dumps(control(' '.join([args.command] + args.jobs),
+                                 args.socket), indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Delta encoding of successive traffic data snapshots.
+
+A keyframe is stored as the full data ('id|speed|color&...'). Between
+keyframes only the changes to the previous snapshot are stored, marked by a
+leading '+':
+
+    +id|speed|color&id|speed|color&-id
+
+'-id' means segment id does not exist anymore. '+' alone means nothing has
+changed. A decoded snapshot lists remaining segments in their previous
+order followed by new ones, so a snapshot in another order, or one with a
+malformed record, is stored as a keyframe and rebuilt exactly.
+
+A snapshot of any feed which is the same as the previous one can be
+stored as '=' (See DedupEncoder).
+"""
+
+import hashlib
+from collections import OrderedDict
+
+DELTA = '+'
+REMOVED = '-'
+SAME = '='
+
+
+def _records(data, delta=False):
+    """Split data to (id, 'speed|color') pairs.
+
+    :param delta: data is a delta, so it may have ('-id',) records
+    :raise ValueError: If a record has no '|'
+    :rtype: list
+    """
+    records = [r.split('|', 1) for r in data.split('&') if r]
+    for r in records:
+        if len(r) != 2 and not (delta and r[0].startswith(REMOVED)):
+            raise ValueError('malformed record %r' % r[0])
+    return records
+
+
+def is_delta(data):
+    """Return True if data is delta encoded.
+
+    :rtype: bool
+    """
+    return data.startswith(DELTA)
+
+
+def is_dependent(data):
+    """Return True if data can only be decoded with previous snapshots.
+
+    :rtype: bool
+    """
+    return data.startswith(DELTA) or data == SAME
+
+
+class DeltaEncoder(object):
+    """Encodes successive snapshots as keyframes and deltas."""
+
+    def __init__(self, keyframe_interval=60):
+        """
+        :param keyframe_interval: A keyframe is stored every
+                                  keyframe_interval snapshots
+        """
+        self.keyframe_interval = keyframe_interval
+        self._prev = None
+        self._order = None
+        self._key = None
+        self._n = 0
+
+    def encode(self, data, key=None):
+        """Encode a snapshot.
+
+        A keyframe is also stored whenever key changes, so that every file
+        (key) starts with a keyframe.
+
+        :param data: Snapshot data
+        :param key: Key of target such as file name
+        :return: Data to store
+        :rtype: str
+        """
+        if data == 'NA':
+            self._prev = None
+            return data
+        try:
+            records = _records(data)
+        except ValueError:
+            records = []
+        prev, order = self._prev, self._order
+        self._prev = dict(records)
+        if not records or len(self._prev) != len(records):
+            # malformed or has duplicate ids, so it cannot be rebuilt from
+            # records by id. stored as is and not used as a base of deltas
+            self._prev = None
+            return data
+        self._order = [r[0] for r in records]
+        if prev is None or key != self._key or \
+                self._n >= self.keyframe_interval or \
+                [i for i in order if i in self._prev] + \
+                [i for i in self._order if i not in prev] != self._order:
+            self._key, self._n = key, 1
+            return data
+        self._n += 1
+        changes = ['|'.join(r) for r in records if prev.get(r[0]) != r[1]]
+        changes += [REMOVED + i for i in prev if i not in self._prev]
+        return DELTA + '&'.join(changes)
+
+
+class DedupEncoder(object):
+    """Encodes a snapshot equal to the previous one as SAME.
+
+    Snapshots are compared by their hashes, so large snapshots are not
+    kept in memory.
+    """
+
+    def __init__(self):
+        self._hash = None
+        self._key = None
+
+    def encode(self, data, key=None):
+        """Encode a snapshot.
+
+        First snapshot of every key (file) and 'NA' are stored as is.
+
+        :param data: Snapshot data
+        :param key: Key of target such as file name
+        :return: Data to store
+        :rtype: str
+        """
+        if data == 'NA':
+            self._hash = None
+            return data
+        h = hashlib.sha1(data).digest()
+        if h == self._hash and key == self._key: return SAME
+        self._hash, self._key = h, key
+        return data
+
+
+class DeltaDecoder(object):
+    """Rebuilds full snapshots from keyframes, deltas and SAME markers."""
+
+    def __init__(self):
+        self._state = None
+        self._key_data = None
+        self._last = None
+
+    def decode(self, data):
+        """Decode a stored snapshot to full data.
+
+        :param data: Stored data
+        :raise ValueError: If data cannot be decoded
+        :rtype: str
+        """
+        if data == SAME:
+            if self._last is None:
+                raise ValueError('%s without a previous snapshot' % SAME)
+            return self._last
+        if not is_delta(data):
+            # keyframe is parsed only when a delta follows it
+            self._state, self._key_data = None, data
+            self._last = None if data == 'NA' else data
+            return data
+        if self._state is None:
+            if self._key_data is None or self._key_data == 'NA':
+                raise ValueError('delta without a keyframe')
+            self._state = OrderedDict(_records(self._key_data))
+        for r in _records(data[len(DELTA):], delta=True):
+            if r[0].startswith(REMOVED):
+                self._state.pop(r[0][len(REMOVED):], None)
+            else:
+                self._state[r[0]] = r[1]
+        self._last = '&'.join(k + '|' + v for k, v in
+                              self._state.iteritems())
+        return self._last
+
+
+def expand(lines):
+    """Expand delta encoded and SAME 'date;data' lines to full lines.
+
+    :param lines: Iterable of lines
+    :rtype: generator
+    """
+    d = DeltaDecoder()
+    for l in lines:
+        date, sep, data = l.rstrip('\r\n').partition(';')
+        if not sep: continue
+        yield date + ';' + d.decode(data)
@@ -1,24 +1,169 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-"""Converter functions from eoner csv files to mine"""
+"""Converter functions from eoner csv files to mine
 
+Lines of eoner files are 'OLE date#TrafficIndex#TrafficDataNew#
+ParkingLotData#AnnouncementData#WeatherData' where dates are in UTC.
+Zip files are imported in parallel directly to block archives
+(See archive.py) of data files of each day in local time.
+"""
+
+import calendar
+import logging as log
 import os
 import re
+import time
+import zipfile
+from collections import OrderedDict
 from datetime import timedelta
 from datetime import datetime as dt
-from dateutil import tz
-import compression as comp
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import archive as ar
+import delta as de
 import tkm
 
+_NON_DECIMAL = re.compile(r'[^\d.]+')
+_OA_EPOCH = np.datetime64('1899-12-30T00:00:00', 'us')
+_BOM = '\xef\xbb\xbf'  # UTF-8 byte order mark
+_FEEDS = [os.path.basename(url) for url in tkm.URL[:5]]
+_PART = '.part'
+
+
 def _add_date_to_file_name(f, date):
     return '{0}.{2}{1}'.format(*(os.path.splitext(f) + (date,)))
 
 
 def _oa_to_datetime(x):
-    if isinstance(x, str) or isinstance(x, unicode):
-        non_decimal = re.compile(r'[^\d.]+')
-        x = float(non_decimal.sub('', x))
-    return dt(1899,12,30) + timedelta(days=x)
+    """Convert OLE automation date(s) to datetime.
+
+    :param x: OLE date as a number or string, or a sequence of them
+    :return: datetime for a single date, np.ndarray of datetime64[us]
+             for a sequence
+    """
+    if isinstance(x, (basestring, int, long, float)):
+        if isinstance(x, basestring): x = float(_NON_DECIMAL.sub('', x))
+        return dt(1899, 12, 30) + timedelta(days=x)
+    try:
+        x = np.asarray(x, dtype=np.float64)
+    except ValueError:
+        x = np.array([float(_NON_DECIMAL.sub('', i)) for i in x])
+    return _OA_EPOCH + np.round(x * 86400e6).astype('timedelta64[us]')
+
+
+def _utc_to_local(t):
+    """Convert UTC datetime64 array to naive local time.
+
+    Offset of local time is found once for each hour.
+
+    :type t: np.ndarray
+    :rtype: np.ndarray of datetime64[s]
+    """
+    s = t.astype('datetime64[s]').astype(np.int64)
+    u, inv = np.unique(s // 3600, return_inverse=True)
+    offset = np.array([calendar.timegm(time.localtime(h * 3600)) - h * 3600
+                       for h in u], dtype=np.int64)
+    return (s + offset[inv]).astype('datetime64[s]')
+
+
+def _import_zip(args):
+    """Import a zip file to block archive parts. Runs in a worker process.
+
+    A part is written for each data file (feed and local day) found in zip
+    file.
+
+    :param args: (full path to zip file, output directory,
+                  delta keyframe interval of traffic data (0 is no delta))
+    :return: (zip file name, [(data file name, part, last date)],
+              error message or None)
+    :rtype: tuple
+    """
+    f, out, keyframe = args
+    tag = os.path.splitext(os.path.basename(f))[0]
+    writers, encoders, last = OrderedDict(), {}, {}
+    try:
+        with zipfile.ZipFile(f) as z:
+            il = z.infolist()
+            text = z.read(il[0].filename) if il else ''
+        # separators are ASCII, so text is fixed as UTF-8 bytes at once
+        text = text.replace(_BOM, '').replace(';', '|').replace('|&', '&')
+        lines = [l.split('#', 5) for l in text.splitlines() if l.strip()]
+        dates = _utc_to_local(_oa_to_datetime([l[0] for l in lines]))
+        dates = np.char.replace(
+            np.datetime_as_string(dates, unit='s').astype('S19'), 'T', ' ')
+        for l, d in zip(lines, dates):
+            day = d[:10].replace('-', '')
+            for feed, data in zip(_FEEDS, l[1:]):
+                if data.endswith('&'): data = data[:-1]
+                if not data or data == 'error': continue
+                name = os.path.splitext(
+                    _add_date_to_file_name(feed, day))[0] + '.csv'
+                w = writers.get(name)
+                if w is None:
+                    w = writers[name] = ar.BlockWriter(os.path.join(
+                        out, name + ar.EXT + '.' + tag + _PART))
+                if keyframe > 0 and feed.startswith('TrafficDataNew'):
+                    data = encoders.setdefault(
+                        name, de.DeltaEncoder(keyframe)).encode(data, name)
+                w.write(d + ';' + data + '\r\n')
+                last[name] = d
+    except Exception as e:  # pylint: disable=W0703
+        for w in writers.values():
+            w.close()
+            os.remove(w.path)
+            os.remove(w.path + '.idx')
+        return os.path.basename(f), [], str(e)
+    for w in writers.values(): w.close()
+    return (os.path.basename(f),
+            [(n, w.path, last[n]) for n, w in writers.items()], None)
+
+
+def convert_data_from_zip_files(files, processes=None, keyframe=None):
+    """Import eoner zip files to block archives.
+
+    Zip files are processed by worker processes and each one is written to
+    compressed parts of the data files it has. Parts of a data file are
+    concatenated in order of zip files (days), because a day in local time
+    spans two zip files. Existing data files of imported days are replaced.
+
+    :param files: Full paths to zip files ('YYYY-MM-DD.zip')
+    :param processes: Number of worker processes. Default is number of CPUs.
+    :param keyframe: Delta keyframe interval of traffic data.
+                     Default is tkm.DELTA_KEYFRAME.
+    :return: Full paths to created archives
+    :rtype: list
+    """
+    files = sorted(files, key=os.path.basename)
+    keyframe = tkm.DELTA_KEYFRAME if keyframe is None else keyframe
+    tkm._mkdir(tkm.DIR.data)  # pylint: disable=W0212
+    args = [(f, tkm.DIR.data, keyframe) for f in files]
+    if len(args) > 1 and processes != 1:
+        pool = Pool(min(processes or cpu_count(), len(args)))
+        try:
+            results = list(pool.imap(_import_zip, args))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_import_zip(a) for a in args]
+    parts = OrderedDict()
+    for f, p, e in results:
+        if e is None:
+            log.info('%s imported.', f)
+        else:
+            log.error('%s -> %s', f, e)
+        for name, part, d in p: parts.setdefault(name, []).append((part, d))
+    archives = []
+    for name, p in parts.items():
+        ff = os.path.join(tkm.DIR.data, name)
+        ar.concat([x[0] for x in p], ff + ar.EXT, remove=True)
+        # a data file would overwrite archive when it is compressed
+        if os.path.exists(ff): os.remove(ff)
+        os.utime(ff + ar.EXT, (time.time(), time.mktime(
+            time.strptime(p[-1][1], '%Y-%m-%d %H:%M:%S'))))
+        archives.append(ff + ar.EXT)
+    return archives
+
 
 def convert_data_from_zip_file(f):
     """
@@ -26,60 +171,16 @@ def convert_data_from_zip_file(f):
     :param f: Full path to file name.
     :type f: str
     """
+    return convert_data_from_zip_files([f], processes=1)
 
-    # f = '/Users/isezen/project/tkmpy/tkmdata/2015-07-31.zip'
-    date = os.path.splitext(os.path.basename(f))[0]
-    date = dt.strptime(date,'%Y-%m-%d')
-    fnames = [_add_date_to_file_name(os.path.splitext(os.path.basename(url))[0],
-                                     date.strftime('%Y%m%d')) +'.csv'
-              for url in tkm.URL[:5]]
-    text = comp.read_from_zip(f)
-    k = 0
-    for l in [x for x in text.split('\n') if not re.match(r'^\s*$', x)]:
-        d = l.replace(u'\ufeff','').split('#')
-        if len(d)>6:
-            for i in range(6,len(d)): d[5] = d[5] + '#' + d[i]
-            d = d[0:6]
-
-        d = [i.replace(';', '|').replace('|&', '&') for i in d]
-        for i in range(len(d)):
-            if d[i][len(d[i])-1] == u'&': d[i] = d[i][:(len(d[i])-1)]
-        date = _oa_to_datetime(d[0])
-        date = date.replace(tzinfo=tz.tzutc()).astimezone(tz.tzlocal())
-        k+=1
-        for i in range(len(d[:-1])):
-            f_name = _add_date_to_file_name(os.path.basename(tkm.URL[i]),
-                                            date.strftime('%Y%m%d'))
-            f_name = os.path.splitext(f_name)[0] + '.csv'
-            if d[i+1] != 'error':
-                tkmd = tkm.TKM_DATA(date=date, e_tag=None,
-                                    filename=f_name, data=d[i+1])
-                tkm.save_instant_data(tkmd)
-
-    for f in fnames:
-        f = os.path.join(tkm.DIR.data, f)
-        comp.compress(f)
-        if os.path.exists(f): os.remove(f)
-
-
-def convert_data_from_eoner():
+
+def convert_data_from_eoner(processes=None):
     """
-    Converts directly data from zip file to 7z.
+    Converts all zip files in tkmdata directory to block archives.
+
+    :param processes: Number of worker processes. Default is number of CPUs.
     """
     dir_tkmdata = os.path.join(tkm.DIR.cur, "tkmdata")
-    for f in [f for f in os.listdir(dir_tkmdata) if f.endswith('.zip')]:
-        date = os.path.splitext(os.path.basename(f))[0]
-        date = dt.strptime(date,'%Y-%m-%d')
-        f_names = [
-            _add_date_to_file_name(
-                  os.path.splitext(os.path.basename(url))[0],
-                  date.strftime('%Y%m%d')) +'.csv' for url in tkm.URL[:5]
-            ]
-
-        for fl in f_names:
-            fl = os.path.join(tkm.DIR.data, fl)
-            if os.path.exists(fl): os.remove(fl)
-
-    for f in [f for f in os.listdir(dir_tkmdata) if f.endswith('.zip')]:
-        print f
-        convert_data_from_zip_file(os.path.join(dir_tkmdata, f))
+    return convert_data_from_zip_files(
+        [os.path.join(dir_tkmdata, f) for f in os.listdir(dir_tkmdata)
+         if f.endswith('.zip')], processes)
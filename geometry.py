@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Parsed and cached road geometry of static road files (r0-r4).
+
+Road files are ';' separated text where columns 0, 1, 2, 3 and 10 are
+segment id, point order, longitude, latitude and district. Parsed arrays of
+a file are cached on disk as <name>.<e_tag>.npz next to the file and in an
+in-process LRU cache. invalidate() removes cached versions of a file when
+a new version is downloaded.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from collections import namedtuple as nt
+import numpy as np
+
+# seg, no, lon, lat, district are point arrays sorted by (seg, no).
+# Points of segments[i] are offsets[i]:offsets[i + 1].
+GEOMETRY = nt('Geometry', 'e_tag seg no lon lat district segments offsets')
+LRU_SIZE = 5
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _split_name(f):
+    """Split 'r0.E_TAG.txt' to ('r0', 'E_TAG')."""
+    name = os.path.splitext(os.path.basename(f))[0]
+    stem, _, e_tag = name.partition('.')
+    return stem, e_tag
+
+
+def parse(text, e_tag=''):
+    """Parse road file text.
+
+    :param text: Content of a road file
+    :param e_tag: e_tag of file
+    :type text: str or unicode
+    :rtype: GEOMETRY
+    """
+    if isinstance(text, str): text = text.decode('utf-8')
+    rows = [l.split(';') for l in text.splitlines() if l.strip()]
+    rows = [r for r in rows if len(r) > 10]
+    seg = np.array([int(r[0]) for r in rows], dtype=np.int64)
+    no = np.array([int(r[1]) for r in rows], dtype=np.int64)
+    lon = np.array([float(r[2]) for r in rows], dtype=np.float64)
+    lat = np.array([float(r[3]) for r in rows], dtype=np.float64)
+    district = np.array([r[10].strip() for r in rows], dtype=np.unicode_)
+    s = np.lexsort((no, seg))
+    return _geometry(e_tag, seg[s], no[s], lon[s], lat[s], district[s])
+
+
+def _geometry(e_tag, seg, no, lon, lat, district):
+    segments, offsets = np.unique(seg, return_index=True)
+    offsets = np.append(offsets, len(seg))
+    return GEOMETRY(e_tag, seg, no, lon, lat, district, segments, offsets)
+
+
+def _cache_file(f):
+    return os.path.splitext(f)[0] + '.npz'
+
+
+def load(f):
+    """Load geometry of a road file.
+
+    Looked up in the in-process cache first, then in the disk cache. The
+    file is parsed only if neither has it.
+
+    :param f: Full path to road file ('r0.E_TAG.txt')
+    :rtype: GEOMETRY
+    """
+    f = os.path.abspath(f)
+    with _lock:
+        g = _cache.pop(f, None)
+        if g is not None:
+            _cache[f] = g
+            return g
+    _, e_tag = _split_name(f)
+    cf = _cache_file(f)
+    if os.path.exists(cf) and os.path.getmtime(cf) >= os.path.getmtime(f):
+        with np.load(cf) as z:
+            g = _geometry(e_tag, *[z[k] for k in GEOMETRY._fields[1:6]])
+    else:
+        with open(f, 'rb') as fl: g = parse(fl.read(), e_tag)
+        tmp = cf + '.tmp.npz'
+        np.savez(tmp, **dict((k, getattr(g, k))
+                             for k in GEOMETRY._fields[1:6]))
+        os.rename(tmp, cf)
+    with _lock:
+        _cache[f] = g
+        while len(_cache) > LRU_SIZE: _cache.popitem(last=False)
+    return g
+
+
+def invalidate(f):
+    """Invalidate cached geometry of all versions of a road file.
+
+    Called when a new version of a road file is downloaded.
+
+    :param f: Full path to new road file ('r0.E_TAG.txt')
+    """
+    f = os.path.abspath(f)
+    stem, _ = _split_name(f)
+    d = os.path.dirname(f)
+    with _lock:
+        for k in [k for k in _cache
+                  if os.path.dirname(k) == d and _split_name(k)[0] == stem]:
+            del _cache[k]
+    for c in os.listdir(d):
+        if c.endswith('.npz') and _split_name(c)[0] == stem:
+            os.remove(os.path.join(d, c))
+
+
+def clear():
+    """Clear in-process cache."""
+    with _lock: _cache.clear()
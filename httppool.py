@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Keep-alive HTTP connection pool for tkm.py"""
+
+import httplib
+import socket
+import threading
+import urllib
+import urllib2 as ul
+import urlparse
+from StringIO import StringIO
+
+_REDIRECTS = (301, 302, 303, 307)
+_MAX_REDIRECTS = 5
+
+
+class ConnectionPool(object):
+    """Pool of persistent HTTP connections keyed by (scheme, host, port).
+
+    Idle connections are reused (LIFO) by the next request to same host, so
+    TCP setup is paid once per connection instead of once per request.
+    """
+
+    def __init__(self, max_idle=8, timeout=30):
+        """
+        :param max_idle: Maximum number of idle connections kept per host
+        :param timeout: Socket timeout in seconds
+        :type max_idle: int
+        :type timeout: float
+        """
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle: return idle.pop(), True
+        scheme, host, port = key
+        cls = httplib.HTTPSConnection if scheme == 'https' \
+            else httplib.HTTPConnection
+        return cls(host, port, timeout=self.timeout), False
+
+    def _put(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns: conn.close()
+
+    def _request(self, url, headers, timeout):
+        u = urlparse.urlsplit(url)
+        key = (u.scheme, u.hostname, u.port)
+        path = urlparse.urlunsplit(('', '', u.path or '/', u.query, ''))
+        timeout = self.timeout if timeout is None else \
+            min(self.timeout, timeout)
+        while True:
+            conn, reused = self._get(key)
+            conn.timeout = timeout
+            if conn.sock is not None: conn.sock.settimeout(timeout)
+            try:
+                conn.request('GET', path, headers=headers)
+                # buffered response reads headers by blocks instead of
+                # a recv() per byte. Requests are not pipelined, so nothing
+                # of the next response is buffered.
+                resp = conn.getresponse(buffering=True)
+                body = resp.read()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                # server may close an idle keep-alive connection; retry it
+                # once on a fresh connection. A timeout is not retried, it
+                # would take timeout again.
+                if reused and not isinstance(e, socket.timeout): continue
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._put(key, conn)
+            return resp, body
+
+    def urlopen(self, url, headers=None, timeout=None):
+        """Send a GET request to url over a pooled connection.
+
+        Body is read completely, so connection is given back to the pool
+        before returning. Redirects are followed, 304 is returned as is and
+        other error statuses raise urllib2.HTTPError like urllib2.urlopen.
+
+        :param url: Url to open
+        :param headers: Extra request headers
+        :param timeout: Socket timeout of this request in seconds. It is
+                        limited by timeout of the pool.
+        :type url: str
+        :type headers: dict
+        :type timeout: float
+        :return: File like object with info() and code like urllib2
+        :rtype: urllib.addinfourl
+        """
+        headers = dict(headers or {})
+        for _ in range(_MAX_REDIRECTS + 1):
+            resp, body = self._request(url, headers, timeout)
+            if resp.status in _REDIRECTS:
+                url = urlparse.urljoin(url, resp.getheader('Location'))
+                continue
+            break
+        if resp.status >= 400 or resp.status in _REDIRECTS:
+            raise ul.HTTPError(url, resp.status, resp.reason, resp.msg,
+                               StringIO(body))
+        return urllib.addinfourl(StringIO(body), resp.msg, url, resp.status)
+
+
+_pool = ConnectionPool()
+
+
+def urlopen(url, headers=None, timeout=None):
+    """Send a GET request to url using module level connection pool.
+
+    :param url: Url to open
+    :param headers: Extra request headers
+    :param timeout: Socket timeout of this request in seconds
+    :rtype: urllib.addinfourl
+    """
+    return _pool.urlopen(url, headers, timeout)
+
+
+def close():
+    """Close idle connections of module level connection pool."""
+    _pool.close()
@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Lazy imports of heavy modules for tkm.py
+
+A LazyModule stands for a module which is imported on first attribute
+access, so importing tkm.py does not pay for numpy, pylzma or modules
+depending on them until they are used.
+
+    np = LazyModule('numpy')
+"""
+
+import importlib
+import threading
+import types
+
+_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """Proxy of a module which is imported on first use.
+
+    Attributes are read from and written to the imported module, so
+    monkeypatching a LazyModule patches the module itself.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: Full name of module such as 'numpy'
+        """
+        super(LazyModule, self).__init__(name)
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        m = self.__dict__['_module']
+        if m is None:
+            with _lock:
+                m = self.__dict__['_module'] = \
+                    importlib.import_module(self.__name__)
+        return m
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._load(), attr)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self.__name__
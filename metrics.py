@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Metrics of tkm.py
+
+Counters, gauges and histograms are kept by name and labels in a Metrics
+registry. They are exposed in Prometheus text format by a local HTTP
+server (serve()) and can be dumped to a JSON file (Metrics.dump()).
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+COUNTER, GAUGE, HISTOGRAM = 'counter', 'gauge', 'histogram'
+# upper bounds of histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Add a value."""
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Cumulative counts of buckets as (upper bound, count) pairs.
+
+        :rtype: list
+        """
+        c, r = 0, []
+        for b, n in zip(self.buckets, self.counts):
+            c += n
+            r.append((b, c))
+        return r
+
+
+def _format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels: return ''
+    esc = [(k, unicode(v).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n')) for k, v in labels]
+    return '{' + ','.join('%s="%s"' % kv for kv in esc) + '}'
+
+
+def _format_value(v):
+    if v == float('inf'): return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Metrics(object):
+    """Registry of metrics."""
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param buckets: Default buckets of histograms
+        """
+        self.buckets = buckets
+        self._metrics = {}  # name -> (type, help, {labels: value})
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, name, kind, labels):
+        m = self._metrics.get(name)
+        if m is None:
+            m = self._metrics[name] = (kind, '', {})
+        elif m[0] != kind:
+            raise ValueError('%s is a %s' % (name, m[0]))
+        return m[2], tuple(sorted(labels.items()))
+
+    def describe(self, name, kind, help_text):
+        """Set type and help text of a metric.
+
+        :param name: Metric name
+        :param kind: counter, gauge or histogram
+        :param help_text: Help text
+        """
+        with self._lock:
+            values = self._metrics.get(name, (kind, '', {}))[2]
+            self._metrics[name] = (kind, help_text, values)
+
+    def inc(self, name, value=1, **labels):
+        """Increase a counter."""
+        with self._lock:
+            values, key = self._get(name, COUNTER, labels)
+            values[key] = values.get(key, 0) + value
+
+    def set_total(self, name, value, **labels):
+        """Set a counter to a total counted elsewhere.
+
+        It is used by collectors to export counts of other objects.
+        """
+        with self._lock:
+            values, key = self._get(name, COUNTER, labels)
+            values[key] = value
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        with self._lock:
+            values, key = self._get(name, GAUGE, labels)
+            values[key] = value
+
+    def observe(self, name, value, **labels):
+        """Add a value to a histogram."""
+        with self._lock:
+            values, key = self._get(name, HISTOGRAM, labels)
+            h = values.get(key)
+            if h is None: h = values[key] = Histogram(self.buckets)
+            h.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe duration of a with block in a histogram."""
+        t = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - t, **labels)
+
+    def collector(self, func):
+        """Register a function which is called before metrics are read.
+
+        It is used to set gauges from state of other objects.
+
+        :param func: Callable with a Metrics argument
+        """
+        self._collectors.append(func)
+        return func
+
+    def _collect(self):
+        for f in self._collectors:
+            f(self)
+
+    def render(self):
+        """Metrics in Prometheus text exposition format.
+
+        :rtype: str
+        """
+        self._collect()
+        lines = []
+        with self._lock:
+            for name in sorted(self._metrics):
+                kind, help_text, values = self._metrics[name]
+                if help_text: lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s %s' % (name, kind))
+                for labels in sorted(values):
+                    v = values[labels]
+                    if kind != HISTOGRAM:
+                        lines.append('%s%s %s' % (
+                            name, _format_labels(labels), _format_value(v)))
+                        continue
+                    for b, c in v.cumulative() + [(float('inf'), v.count)]:
+                        le = [('le', _format_value(float(b)))]
+                        lines.append('%s_bucket%s %d' % (
+                            name, _format_labels(labels, le), c))
+                    lines.append('%s_sum%s %s' % (
+                        name, _format_labels(labels), repr(v.sum)))
+                    lines.append('%s_count%s %d' % (
+                        name, _format_labels(labels), v.count))
+        return (u'\n'.join(lines) + u'\n').encode('utf-8')
+
+    def snapshot(self):
+        """Metrics as a JSON serializable dict.
+
+        :rtype: dict
+        """
+        self._collect()
+        r = {}
+        with self._lock:
+            for name, (kind, _, values) in self._metrics.items():
+                r[name] = {'type': kind, 'values': [
+                    dict(labels=dict(labels), **(
+                        {'buckets': [[b, c] for b, c in v.cumulative()],
+                         'sum': v.sum, 'count': v.count}
+                        if kind == HISTOGRAM else {'value': v}))
+                    for labels, v in sorted(values.items())]}
+        return {'time': time.time(), 'metrics': r}
+
+    def dump(self, f):
+        """Write snapshot() to a JSON file atomically.
+
+        :param f: Full path to file
+        """
+        tmp = f + '.tmp'
+        with open(tmp, 'wb') as fl:
+            json.dump(self.snapshot(), fl, sort_keys=True)
+        os.rename(tmp, f)
+
+
+def serve(metrics, port, host='127.0.0.1'):
+    """Serve metrics in Prometheus text format by a daemon thread.
+
+    :param metrics: Metrics registry
+    :param port: Port number. 0 picks a free port.
+    :param host: Address to bind
+    :return: Server. Its server_address is the bound address and
+             shutdown() stops it.
+    :rtype: BaseHTTPServer.HTTPServer
+    """
+    import BaseHTTPServer  # imported on use to keep tkm.py startup fast
+
+    class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        """Serves metrics of server.metrics at /metrics."""
+
+        def do_GET(self):  # pylint: disable=C0111
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = self.server.metrics.render()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # pylint: disable=W0221
+            pass
+
+    server = BaseHTTPServer.HTTPServer((host, port), _Handler)
+    server.metrics = metrics
+    t = threading.Thread(target=server.serve_forever, name='metrics')
+    t.daemon = True
+    t.start()
+    return server
@@ -9,47 +9,30 @@
 """This script downloads traffic data from tkm.ibb.gov.tr"""
 
 
-from StringIO import StringIO
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as p
+import sys
+from datetime import datetime as dt
 import smopy
+import render
 import tkm
 
+tkm.setup_logging()
 
-colors = ['black', 'lime', 'yellowgreen', 'orange', 'red', 'darkred',
-          'lightgray']
 mp = smopy.Map((40.97, 28.7, 41.2, 29.3), z=12)  # Wide
 # map = smopy.Map((41, 28.89, 41.1, 29.0), z=14) # Narrow
 # map.show_ipython()
 
-ti = tkm.get_traffic_index()
-td = tkm.get_traffic_data(); td_date = td.date
-td = p.read_table(StringIO(td.data.replace('&', '\r')), header=None,
-                  sep="|", names=['seg', 'speed', 'color'])
-for i in range(0, 1):
-    road = p.read_table('static_files/r%d.txt' % i, header=None, sep=';',
-                        usecols=[0, 1, 2, 3, 10],
-                        names=['seg', 'no', 'lon', 'lat', 'district'])
-    road.sort_values(['seg', 'no'], ascending=[False, True], inplace=True)
-    # get unique numbers in seg column (Use index instead of column name)
-    segs = np.unique(road.ix[:, 0])
-
-    ax = mp.show_mpl(figsize=(20, 18))
-    ax.text(0.02, 0.02, "r%d.txt" % i, fontsize=20, transform=ax.transAxes)
-    ax.text(0.83, 0.95, "Traffic Index: %%%d" % int(ti.data), fontsize=24,
-            transform=ax.transAxes)
-    ax.text(0.85, 0.92, "{:%Y-%m-%d %H:%M:%S}".format(td_date), fontsize=16,
-            transform=ax.transAxes)
-    for s in segs:  # for each unique segment in road DataFrame
-        seg = road[road.ix[:, 0] == s]  # get road segments
-        t = td[td.ix[:, 0] == s]  # filter traffic data for segment
-        # get color from traffic data, if it does not exist, then lightgray
-        col = 6 if len(t) == 0 else int(t.color)
-        # convert lat/lon to pixel coordinates
-        x, y = mp.to_pixels(np.array([seg.ix[:, 3], seg.ix[:, 2]]).T).T
-        ax.plot(x, y, c='black', linewidth=4)  # make a balck border for roads
-        ax.plot(x, y, c=colors[col], linewidth=3)
-    fig = plt.gcf()
-    fig.savefig('r%d.png' % i)
-plt.show()
+if len(sys.argv) > 1:  # time-lapse of a day: osm.py YYYYMMDD
+    m = tkm.read_speed_matrix(dt.strptime(sys.argv[1], '%Y%m%d'))
+    for i in range(0, 1):
+        g = tkm.road_geometry(i)
+        if g is None or m is None: continue
+        r = render.Renderer(mp, g, label='r%d.txt' % i)
+        render.animate(r, m, 'r%d.{0:04d}.png' % i)
+else:
+    ti = tkm.get_traffic_index()
+    td = tkm.parse_speed_data(tkm.get_traffic_data())
+    for i in range(0, 1):
+        g = tkm.road_geometry(i)
+        if g is None: continue  # road file is not downloaded
+        render.render(mp, g, td.data, 'r%d.png' % i, date=td.date,
+                      traffic_index=ti.data, label='r%d.txt' % i)
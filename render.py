@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Batch rendering of traffic data on road maps.
+
+Speed data is joined to road geometry (See geometry.py) by a binary search
+over sorted segment ids, and all segments of a road file are drawn as a
+single LineCollection whose colors are set from the joined color codes.
+Geometry is projected to map pixels once per Renderer, so successive
+frames only change the color array (See animate()).
+"""
+
+from datetime import datetime as dt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.figure import Figure
+import spatial as sp
+
+# colors by color code of traffic data. Segments without data are NO_DATA.
+COLORS = ['black', 'lime', 'yellowgreen', 'orange', 'red', 'darkred',
+          'lightgray']
+NO_DATA = 6
+
+
+def segment_colors(g, speed):
+    """Join speed data to geometry.
+
+    :param g: Road geometry
+    :param speed: Speed data as an array of tkm.SPEED_DTYPE
+    :type g: geometry.GEOMETRY
+    :type speed: np.ndarray
+    :return: Color code of each segment of g (g.segments)
+    :rtype: np.ndarray
+    """
+    c = np.full(len(g.segments), NO_DATA, dtype=np.uint8)
+    if len(speed) == 0 or len(c) == 0: return c
+    s = np.argsort(speed['id'], kind='mergesort')
+    ids, col = speed['id'][s], speed['color'][s]
+    i = np.minimum(np.searchsorted(ids, g.segments), len(ids) - 1)
+    found = (ids[i] == g.segments) & (col[i] < NO_DATA)
+    c[found] = col[i][found]
+    return c
+
+
+def matrix_colors(g, m):
+    """Join snapshots of a speed matrix to geometry.
+
+    :param g: Road geometry
+    :param m: Speed matrix (See tkm.parse_speed_lines)
+    :type g: geometry.GEOMETRY
+    :type m: tkm.SPEED_MATRIX
+    :return: Color codes of shape (snapshots, segments of g)
+    :rtype: np.ndarray
+    """
+    c = np.full((len(m.date), len(g.segments)), NO_DATA, dtype=np.uint8)
+    if len(m.id) == 0 or len(g.segments) == 0: return c
+    i = np.minimum(np.searchsorted(m.id, g.segments), len(m.id) - 1)
+    found = m.id[i] == g.segments
+    c[:, found] = m.color[:, i[found]]
+    c[c > NO_DATA] = NO_DATA
+    return c
+
+
+class Renderer(object):
+    """Renders traffic data of a road file on a map.
+
+    Base map, projected geometry and artists are created once. update()
+    only recolors segments.
+    """
+
+    def __init__(self, mp, g, figsize=(20, 18), dpi=None, label=None,
+                 index=None):
+        """
+        :param mp: Base map
+        :param g: Road geometry
+        :param figsize: Figure size in inches
+        :param dpi: Resolution of figure
+        :param label: Text shown at lower left corner (i.e. 'r0.txt')
+        :param index: Spatial index of g. Created if not given.
+        :type mp: smopy.Map
+        :type g: geometry.GEOMETRY
+        :type index: spatial.SpatialIndex
+        """
+        self.map, self.geometry = mp, g
+        if index is None: index = sp.SpatialIndex(g)
+        lat0, lon0, lat1, lon1 = mp.box
+        # only segments in the box of map are drawn
+        self.visible = index.bbox(min(lon0, lon1), min(lat0, lat1),
+                                  max(lon0, lon1), max(lat0, lat1))
+        xy = np.asarray(mp.to_pixels(np.column_stack([g.lat, g.lon])))
+        off = g.offsets
+        lines = [xy[off[i]:off[i + 1]] for i in self.visible]
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        ax = self.axes = self.figure.add_axes([0, 0, 1, 1])
+        ax.imshow(np.asarray(mp.img))
+        ax.set_xlim(0, mp.w)
+        ax.set_ylim(mp.h, 0)
+        ax.axis('off')
+        # a black border for roads
+        ax.add_collection(LineCollection(lines, colors='black', linewidths=4))
+        self.roads = LineCollection(lines, linewidths=3)
+        ax.add_collection(self.roads)
+        self._rgba = to_rgba_array(COLORS)
+        if label:
+            ax.text(0.02, 0.02, label, fontsize=20, transform=ax.transAxes)
+        self._index_text = ax.text(0.83, 0.95, '', fontsize=24,
+                                   transform=ax.transAxes)
+        self._date_text = ax.text(0.85, 0.92, '', fontsize=16,
+                                  transform=ax.transAxes)
+        self.update(np.zeros(0, dtype=[('id', '<u4'), ('color', 'u1')]))
+
+    def update(self, speed, date=None, traffic_index=None):
+        """Recolor segments by speed data.
+
+        :param speed: Speed data as an array of tkm.SPEED_DTYPE
+        :param date: Date of data
+        :param traffic_index: Traffic index
+        :type date: datetime.datetime
+        :return: Color codes of visible segments
+        :rtype: np.ndarray
+        """
+        c = segment_colors(self.geometry, speed)[self.visible]
+        self.set_colors(c, date, traffic_index)
+        return c
+
+    def set_colors(self, c, date=None, traffic_index=None):
+        """Recolor visible segments by color codes.
+
+        :param c: Color codes of visible segments
+        :param date: Date of data
+        :param traffic_index: Traffic index
+        """
+        self.roads.set_color(self._rgba[c])
+        self._date_text.set_text(
+            '' if date is None else '{:%Y-%m-%d %H:%M:%S}'.format(date))
+        self._index_text.set_text(
+            '' if traffic_index is None else
+            'Traffic Index: %%%d' % int(traffic_index))
+
+    def save(self, f, **kwargs):
+        """Save current frame.
+
+        :param f: File name or file object
+        :param kwargs: Passed to Figure.savefig
+        """
+        self.figure.savefig(f, **kwargs)
+
+    def to_rgb(self):
+        """Draw current frame to an RGB array.
+
+        :rtype: np.ndarray
+        """
+        canvas = self.figure.canvas
+        canvas.draw()
+        w, h = canvas.get_width_height()
+        return np.frombuffer(canvas.tostring_rgb(),
+                             dtype=np.uint8).reshape(h, w, 3)
+
+
+def render(mp, g, speed, f, date=None, traffic_index=None, **kwargs):
+    """Render traffic data of a road file to a file.
+
+    :param mp: Base map
+    :param g: Road geometry
+    :param speed: Speed data as an array of tkm.SPEED_DTYPE
+    :param f: Output file
+    :param date: Date of data
+    :param traffic_index: Traffic index
+    :param kwargs: Passed to Renderer
+    :rtype: Renderer
+    """
+    r = Renderer(mp, g, **kwargs)
+    r.update(speed, date, traffic_index)
+    r.save(f)
+    return r
+
+
+def animate(r, m, out, writer=None, dpi=None, traffic_index=None):
+    """Render snapshots of a speed matrix as frames of a time-lapse.
+
+    Base map and geometry of the renderer are reused and only segment
+    colors are changed for each frame. Frames are either saved as an image
+    sequence or grabbed by a matplotlib movie writer.
+
+    :param r: Renderer
+    :param m: Speed matrix such as a day read by tkm.read_speed_matrix()
+    :param out: Image file name pattern formatted by frame number and date
+                (i.e. 'frames/r0.{0:04d}.png') or movie file if writer is
+                given
+    :param writer: A matplotlib.animation.MovieWriter (i.e. FFMpegWriter)
+    :param dpi: Resolution of frames
+    :param traffic_index: Traffic index of each snapshot
+    :type r: Renderer
+    :type m: tkm.SPEED_MATRIX
+    :return: Number of frames
+    :rtype: int
+    """
+    colors = matrix_colors(r.geometry, m)[:, r.visible]
+    dates = [dt.utcfromtimestamp(t) for t in m.date.astype(np.int64)]
+    ti = [None] * len(dates) if traffic_index is None else traffic_index
+
+    def frames():
+        for i, d in enumerate(dates):
+            r.set_colors(colors[i], d, ti[i])
+            yield i, d
+
+    if writer is None:
+        for i, d in frames(): r.save(out.format(i, d), dpi=dpi)
+    else:
+        with writer.saving(r.figure, out, dpi or r.figure.dpi):
+            for _ in frames(): writer.grab_frame()
+    return len(dates)
@@ -0,0 +1,330 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Local replay server of tkm.ibb.gov.tr for tests and load testing
+
+Recorded encrypted payloads of the feeds are served at
+/data/IntensityMap/<feed>.aspx and static files at /YHarita/res/<name>
+like the web site. Static files have ETag and Last-Modified headers and
+conditional requests are answered by 304. Latency, HTTP errors and
+'error'/'no_data' bodies can be injected at given rates.
+
+Point tkm.py to a server by tkm.set_base_url(server.url) or
+'tkm.py --base-url'. Throughput of the collector is measured by
+
+    python replay.py tests/fixtures --stress 1000
+"""
+
+import BaseHTTPServer
+import SocketServer
+import argparse
+import hashlib
+import os
+import random
+import threading
+import time
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from multiprocessing import Pool
+
+FEED_PATH = '/data/IntensityMap/'
+STATIC_PATH = '/YHarita/res/'
+OK, ERROR, NO_DATA = 'ok', 'error', 'no_data'
+
+
+def _e_tag(body):
+    # IIS style ETag such as "80bb3bf6e7b4d11:0"
+    return '"%s:0"' % hashlib.md5(body).hexdigest()[:15]
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves responses of server.replay."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    wbufsize = -1  # send headers and body at once
+    disable_nagle_algorithm = True
+
+    def _send(self, code, body='', headers=()):
+        self.send_response(code)
+        for h in headers: self.send_header(*h)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=C0111
+        self._send(*self.server.replay.respond(
+            self.path, self.headers.getheader('If-None-Match'),
+            self.headers.getheader('If-Modified-Since')))
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
+
+
+class ReplayServer(object):
+    """HTTP server replaying recorded responses of tkm web site."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_body_rate=0.0, no_data_rate=0.0,
+                 seed=None):
+        """
+        :param host: Address to bind
+        :param port: Port number. 0 picks a free port.
+        :param latency: Seconds each response is delayed
+        :param jitter: Maximum random seconds added to latency
+        :param error_rate: Rate of responses with HTTP 500
+        :param error_body_rate: Rate of feed responses with 'error' body
+        :param no_data_rate: Rate of feed responses with 'no_data' body
+        :param seed: Seed of random injections
+        """
+        self.host, self.port = host, port
+        self.latency, self.jitter = latency, jitter
+        self.error_rate = error_rate
+        self.error_body_rate = error_body_rate
+        self.no_data_rate = no_data_rate
+        self.feeds = {}  # name -> {OK/ERROR/NO_DATA: body}
+        self.static = {}  # name -> (body, e_tag, last_modified)
+        self.stats = {}  # (path, status) -> count
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def add_feed(self, name, body, kind=OK):
+        """Add a recorded response of a feed.
+
+        :param name: File name such as 'TrafficIndex.aspx'
+        :param body: Encrypted response body
+        :param kind: OK, ERROR or NO_DATA. Bodies of ERROR and NO_DATA are
+                     encrypted 'error' and 'no_data' of the feed.
+        """
+        with self._lock:
+            self.feeds.setdefault(name, {})[kind] = body
+
+    def add_static(self, name, body, last_modified=None):
+        """Add or update a static file.
+
+        A new version gets a new ETag and Last-Modified.
+
+        :param name: File name such as 'r0.txt'
+        :param body: Encrypted file content
+        :param last_modified: Seconds since epoch. Default is now.
+        """
+        if last_modified is None: last_modified = time.time()
+        with self._lock:
+            self.static[name] = (body, _e_tag(body), int(last_modified))
+
+    def load(self, directory):
+        """Load recorded responses from a directory.
+
+        Feeds are read from '<feed>.aspx', '<feed>.error.aspx' and
+        '<feed>.no_data.aspx' files (See tests/payloads.py) and static
+        files from the 'res' subdirectory. Last-Modified of a static file
+        is its modification time.
+
+        :param directory: Full path to directory
+        :return: self
+        """
+        for f in sorted(os.listdir(directory)):
+            stem, ext = os.path.splitext(f)
+            if ext != '.aspx': continue
+            name, kind = os.path.splitext(stem)
+            kind = kind[1:] if kind[1:] in (ERROR, NO_DATA) else OK
+            with open(os.path.join(directory, f), 'rb') as fl:
+                self.add_feed((name if kind != OK else stem) + ext,
+                              fl.read(), kind)
+        res = os.path.join(directory, 'res')
+        if os.path.isdir(res):
+            for f in sorted(os.listdir(res)):
+                fl = os.path.join(res, f)
+                with open(fl, 'rb') as h:
+                    self.add_static(f, h.read(), os.path.getmtime(fl))
+        return self
+
+    def _count(self, path, code):
+        with self._lock:
+            self.stats[(path, code)] = self.stats.get((path, code), 0) + 1
+
+    def _draw(self):
+        with self._lock:
+            return (self._random.random(),
+                    self._random.uniform(0, self.jitter))
+
+    def respond(self, path, if_none_match=None, if_modified_since=None):
+        """Create a response to a GET request.
+
+        :param path: Request path
+        :param if_none_match: If-None-Match header
+        :param if_modified_since: If-Modified-Since header
+        :return: (status, body, headers)
+        :rtype: tuple
+        """
+        path = path.split('?')[0]
+        r, jitter = self._draw()
+        if self.latency or jitter: time.sleep(self.latency + jitter)
+        code, body, headers = 404, '', ()
+        if r < self.error_rate:
+            code = 500
+        elif path.startswith(FEED_PATH) and \
+                path[len(FEED_PATH):] in self.feeds:
+            bodies = self.feeds[path[len(FEED_PATH):]]
+            r -= self.error_rate
+            kind = ERROR if r < self.error_body_rate else \
+                NO_DATA if r < self.error_body_rate + self.no_data_rate \
+                else OK
+            code, body = 200, bodies.get(kind, bodies.get(OK, ''))
+            headers = (('Content-Type', 'text/html; charset=utf-8'),
+                       ('Cache-Control', 'private'))
+        elif path.startswith(STATIC_PATH) and \
+                path[len(STATIC_PATH):] in self.static:
+            body, e_tag, last_modified = self.static[path[len(STATIC_PATH):]]
+            headers = (('Content-Type', 'text/plain'),
+                       ('ETag', e_tag),
+                       ('Last-Modified', formatdate(last_modified,
+                                                    usegmt=True)))
+            code = 200
+            if if_none_match is not None:
+                if e_tag in [e.strip() for e in if_none_match.split(',')]:
+                    code = 304
+            elif if_modified_since is not None:
+                ims = parsedate_tz(if_modified_since)
+                if ims and last_modified <= mktime_tz(ims): code = 304
+            if code == 304: body = ''
+        self._count(path, code)
+        return code, body, headers
+
+    def start(self):
+        """Start serving by a daemon thread.
+
+        :return: self
+        """
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.replay = self
+        self.port = self._server.server_address[1]
+        t = threading.Thread(target=self._server.serve_forever,
+                             name='replay')
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self._server is None: return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def url(self):
+        """Base url of server such as 'http://127.0.0.1:8080/'"""
+        return 'http://%s:%d/' % (self.host, self.port)
+
+    def requests(self, path=None):
+        """Number of served requests.
+
+        :param path: Only count requests of path
+        :rtype: int
+        """
+        with self._lock:
+            return sum(n for (p, _), n in self.stats.items()
+                       if path is None or p == path)
+
+
+def _stress(args):
+    """Collect ticks from url by threads. Runs in a worker process.
+
+    :param args: (base url, ticks per thread, number of threads)
+    :return: Elapsed seconds
+    """
+    url, ticks, concurrency = args
+    import tkm
+    tkm.set_base_url(url)
+
+    def _run():
+        for _ in range(ticks): tkm.get_many()
+    threads = [threading.Thread(target=_run) for _ in range(concurrency)]
+    t = time.time()
+    for th in threads: th.start()
+    for th in threads: th.join()
+    t = time.time() - t
+    tkm.hp.close()
+    return t
+
+
+def stress(url, ticks, concurrency=1, processes=1):
+    """Collect all feeds of tkm.py from a server as fast as possible.
+
+    A collector process is bound by GIL, so several processes are needed to
+    reach hundreds of ticks per second.
+
+    :param url: Base url of server
+    :param ticks: Number of ticks (tkm.get_many() calls) per thread
+    :param concurrency: Number of threads collecting at the same time in
+                        each process
+    :param processes: Number of collector processes
+    :return: Ticks per second
+    :rtype: float
+    """
+    args = [(url, ticks, concurrency)] * processes
+    if processes > 1:
+        pool = Pool(processes)
+        try:
+            elapsed = pool.map(_stress, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        elapsed = [_stress(args[0])]
+    return ticks * concurrency * processes / max(elapsed)
+
+
+def main():
+    """Main function"""
+    p = argparse.ArgumentParser(description='Replay server of tkm web site')
+    p.add_argument('directory', help='directory of recorded responses')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', default=8080, type=int)
+    p.add_argument('--latency', default=0.0, type=float, help='seconds')
+    p.add_argument('--jitter', default=0.0, type=float, help='seconds')
+    p.add_argument('--error-rate', default=0.0, type=float,
+                   help='rate of HTTP 500 responses')
+    p.add_argument('--error-body-rate', default=0.0, type=float,
+                   help="rate of 'error' bodies")
+    p.add_argument('--no-data-rate', default=0.0, type=float,
+                   help="rate of 'no_data' bodies")
+    p.add_argument('--seed', default=None, type=int)
+    p.add_argument('--stress', default=0, type=int, metavar='TICKS',
+                   help='collect TICKS ticks by tkm.py and print ticks/s')
+    p.add_argument('--concurrency', default=1, type=int,
+                   help='number of collector threads of --stress')
+    p.add_argument('--processes', default=1, type=int,
+                   help='number of collector processes of --stress')
+    args = p.parse_args()
+    server = ReplayServer(args.host, 0 if args.stress else args.port,
+                          args.latency, args.jitter, args.error_rate,
+                          args.error_body_rate, args.no_data_rate,
+                          args.seed).load(args.directory)
+    with server:
+        if args.stress:
+            rate = stress(server.url, args.stress, args.concurrency,
+                          args.processes)
+            print '%.1f ticks/s, %d requests' % (rate, server.requests())
+            return
+        print 'Serving %s at %s' % (args.directory, server.url)
+        try:
+            while True: time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
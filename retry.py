@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Retry policy and circuit breaker for tkm.py"""
+
+import random
+import threading
+import time
+
+
+class RetryPolicy(object):
+    """Exponential backoff with jitter bounded by a deadline."""
+
+    def __init__(self, tries=5, delay=0.5, backoff=2.0, max_delay=8.0,
+                 jitter=0.5, min_attempt=0.0):
+        """
+        :param tries: Maximum number of retries after first attempt
+        :param delay: Delay before first retry in seconds
+        :param backoff: Multiplier of delay for each retry
+        :param max_delay: Upper limit of a delay in seconds
+        :param jitter: Random fraction (0-1) removed from each delay
+        :param min_attempt: Seconds a retry needs before the deadline
+        """
+        self.tries = tries
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.min_attempt = min_attempt
+
+    def delays(self, deadline=None):
+        """Generate delays in seconds to wait before each retry.
+
+        Generation stops when retries are exhausted or when waiting would
+        not leave min_attempt seconds for the retry before the deadline.
+
+        :param deadline: time.time() value retries must end before
+        :type deadline: float
+        :rtype: generator
+        """
+        for i in range(self.tries):
+            d = min(self.max_delay, self.delay * self.backoff ** i)
+            d *= 1 - self.jitter * random.random()
+            if deadline is not None and \
+                    time.time() + d + self.min_attempt >= deadline: return
+            yield d
+
+
+class CircuitBreaker(object):
+    """Circuit breaker of an endpoint.
+
+    Opens after threshold consecutive failures. While open, requests are
+    not allowed until reset_after seconds pass; then one trial request is
+    allowed (half-open) and its result closes or re-opens the circuit.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, threshold=5, reset_after=300.0):
+        """
+        :param threshold: Number of consecutive failures to open circuit
+        :param reset_after: Seconds to wait before a trial request
+        """
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """State of circuit: closed, open or half-open"""
+        if self._opened is None: return self.CLOSED
+        if time.time() - self._opened >= self.reset_after:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """Return True if a request is allowed.
+
+        :rtype: bool
+        """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED: return True
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        """Record a successful request."""
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+            self._trial = False
+
+    def failure(self):
+        """Record a failed request."""
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self._opened = time.time()
+            self._trial = False
+
+
+class CircuitBreakers(object):
+    """Registry of circuit breakers by endpoint."""
+
+    def __init__(self, threshold=5, reset_after=300.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get circuit breaker of an endpoint.
+
+        :param key: Endpoint (url)
+        :rtype: CircuitBreaker
+        """
+        with self._lock:
+            b = self._breakers.get(key)
+            if b is None:
+                b = self._breakers[key] = CircuitBreaker(self.threshold,
+                                                         self.reset_after)
+            return b
+
+    def items(self):
+        """Return (endpoint, CircuitBreaker) pairs.
+
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._breakers.items())
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Monotonic clock job scheduler for tkm.py"""
+
+import ctypes
+import ctypes.util
+import heapq
+import itertools
+import logging as log
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime as dt
+
+SKIP, COALESCE, CATCH_UP = 'skip', 'coalesce', 'catch-up'
+OVERRUN_POLICIES = (SKIP, COALESCE, CATCH_UP)
+
+# region monotonic clock
+
+
+def _clock_gettime():
+    class _Timespec(ctypes.Structure):  # pylint: disable=R0903
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+    lib = ctypes.CDLL(ctypes.util.find_library('rt') or
+                      ctypes.util.find_library('c'), use_errno=True)
+    clock_gettime = lib.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+    t = _Timespec()
+    monotonic_id = 1  # CLOCK_MONOTONIC on linux, it differs by platform
+
+    def _monotonic():
+        if clock_gettime(monotonic_id, ctypes.byref(t)) != 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        return t.tv_sec + t.tv_nsec * 1e-9
+    _monotonic()
+    return _monotonic
+
+
+def _time():
+    return time.time()
+
+
+def _get_monotonic():
+    if hasattr(time, 'monotonic'): return time.monotonic
+    if sys.platform.startswith('linux'):
+        try:
+            return _clock_gettime()
+        except (OSError, AttributeError, TypeError):
+            pass
+    return _time  # not monotonic
+
+
+monotonic = _get_monotonic()
+monotonic.__doc__ = """Return value of a monotonic clock in seconds."""
+
+# endregion
+
+
+class Job(object):
+    """A scheduled job.
+
+    Job is run every interval seconds starting at start (time.time()
+    value). func is called with planned run time as a naive local datetime.
+    """
+
+    def __init__(self, name, func, start, interval=0, overrun=SKIP):
+        """
+        :param name: Name of job
+        :param func: Callable to run. Called with planned datetime.
+        :param start: First run time as time.time() value
+        :param interval: Repeat interval in seconds. 0 runs once.
+        :param overrun: What to do if job is still running on its next
+                        tick. skip: drop the tick, coalesce: run once when
+                        current run ends, catch-up: run every missed tick.
+        """
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError('overrun must be one of %s' %
+                             str(OVERRUN_POLICIES))
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.overrun = overrun
+        self.runs = 0
+        self.dropped = 0
+        self.lateness = deque(maxlen=1440)
+        self.last_run = None
+        self._anchor = (start, monotonic() + start - time.time())
+        self._n = 0
+        self._running = False
+        self._backlog = deque()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def due(self):
+        """Monotonic time of next tick"""
+        return self._anchor[1] + self._n * self.interval
+
+    @property
+    def planned(self):
+        """Wall clock time of next tick as time.time() value"""
+        return self._anchor[0] + self._n * self.interval
+
+    def _correct_drift(self, threshold=0.5):
+        """Re-anchor to wall clock if it moved away from monotonic clock."""
+        wall, mono = self._anchor
+        skew = (time.time() - wall) - (monotonic() - mono)
+        if abs(skew) > threshold:
+            log.info('%s: wall clock drifted %.3f s. Re-anchored.',
+                     self.name, skew)
+            self._anchor = (wall, mono - skew)
+
+    def _advance(self):
+        """Move to next tick. Return False if job does not repeat."""
+        self._n += 1
+        if self.interval <= 0: return False
+        self._correct_drift()
+        return True
+
+    def _dispatch(self):
+        """Run current tick in a thread or apply overrun policy."""
+        tick = (self.due, self.planned)
+        with self._lock:
+            if self._running:
+                if self.overrun == SKIP:
+                    self.dropped += 1
+                    log.warning('%s: previous run has not finished. '
+                                'Tick %s skipped.', self.name,
+                                dt.fromtimestamp(tick[1]))
+                    return
+                if self.overrun == COALESCE: self._backlog.clear()
+                self._backlog.append(tick)
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, args=[tick],
+                                        name=self.name)
+        self._thread.start()
+
+    def _run(self, tick):
+        while True:
+            due, planned = tick
+            self.lateness.append(monotonic() - due)
+            if self.lateness[-1] > 1:
+                log.warning('%s: started %.3f s late.', self.name,
+                            self.lateness[-1])
+            try:
+                self.func(dt.fromtimestamp(planned))
+            except Exception as e:  # pylint: disable=W0703
+                log.error('%s -> %s', self.name, str(e))
+            self.runs += 1
+            self.last_run = planned
+            with self._lock:
+                if not self._backlog:
+                    self._running = False
+                    return
+                tick = self._backlog.popleft()
+
+    def join(self, timeout=None):
+        """Wait for current run to finish."""
+        t = self._thread
+        if t is not None: t.join(timeout)
+
+
+class Scheduler(object):
+    """Runs jobs on time by a single thread.
+
+    Jobs are kept in a heap ordered by their next tick on monotonic clock.
+    Scheduler thread sleeps until the next tick instead of polling.
+    """
+
+    def __init__(self):
+        self.jobs = []
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+
+    def add(self, name, func, start=None, interval=0, overrun=SKIP):
+        """Add a job. See Job for parameters.
+
+        :param start: First run time as time.time() value.
+                      Default is now.
+        :rtype: Job
+        """
+        job = Job(name, func, time.time() if start is None else start,
+                  interval, overrun)
+        with self._lock:
+            self.jobs.append(job)
+            heapq.heappush(self._heap, (job.due, next(self._seq), job))
+        self._wake.set()
+        return job
+
+    def run(self):
+        """Run scheduler until stop() is called or no job is left."""
+        while not self._stopping:
+            with self._lock:
+                if not self._heap: break
+                due, _, job = self._heap[0]
+                timeout = due - monotonic()
+                if timeout <= 0: heapq.heappop(self._heap)
+            if timeout > 0:
+                self._wake.wait(min(timeout, 60))
+                self._wake.clear()
+                continue
+            job._dispatch()  # pylint: disable=W0212
+            if job._advance():  # pylint: disable=W0212
+                with self._lock:
+                    heapq.heappush(self._heap,
+                                   (job.due, next(self._seq), job))
+        self.join()
+
+    def stop(self):
+        """Stop scheduler. It is safe to call from a signal handler."""
+        self._stopping = True
+        self._wake.set()
+
+    def join(self, timeout=None):
+        """Wait for running jobs to finish."""
+        for job in list(self.jobs): job.join(timeout)
+
+
+def next_time(on, now=None):
+    """Calculate first run time from a time suffix.
+
+    on is the right hand side of '%Y-%m-%d %H:%M:%S' such as '00'
+    (second 00 of every minute) or '30:00'. 'immediate' means now.
+
+    :param on: Time suffix or 'immediate'
+    :param now: time.time() value. Default is now.
+    :return: time.time() value
+    :rtype: float
+    """
+    fmt = '%Y-%m-%d %H:%M:%S'
+    now = time.time() if now is None else now
+    if on == 'immediate': return now
+    t = dt.fromtimestamp(int(now)).strftime(fmt)
+    t = dt.strptime(t[:-len(on)] + on, fmt)
+    # step of the smallest unit that is not fixed by the suffix
+    step = {2: 60, 5: 3600, 8: 86400}.get(len(on), 86400)
+    t = time.mktime(t.timetuple())
+    while t < now - 0.5: t += step
+    return t
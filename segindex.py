@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Per-segment index over columnar traffic data (See speedstore.py).
+
+For each day of a SpeedStore two files are kept:
+
+    <prefix>.<YYYYMMDD>.sord  row numbers sorted by (segment id, time),
+                              uint32. Its length is the number of indexed
+                              rows.
+    <prefix>.<YYYYMMDD>.sidx  SEGMENT_DTYPE records (id, start, count) of
+                              each segment into .sord
+
+so the history of a segment in a day is a contiguous slice of .sord.
+Index of a day is extended incrementally by update(): only rows appended
+since the last update are sorted and merged into the existing order.
+Queries do not update the index unless they are asked to.
+"""
+
+import os
+from datetime import datetime as dt
+import numpy as np
+import speedstore as ss
+
+SEGMENT_DTYPE = np.dtype([('id', '<u4'), ('start', '<i8'), ('count', '<u4')])
+HISTORY_DTYPE = np.dtype([('date', '<i8'), ('speed', 'u1'), ('color', 'u1')])
+_ORDER_DTYPE = np.dtype('<u4')
+
+
+def _write(f, a):
+    """Write array to file atomically."""
+    tmp = f + '.tmp'
+    a.tofile(tmp)
+    os.rename(tmp, f)
+
+
+class SegmentIndex(object):
+    """Per-segment index of a SpeedStore."""
+
+    def __init__(self, store):
+        """
+        :param store: Columnar store to index
+        :type store: ss.SpeedStore
+        """
+        self.store = store
+
+    def _read(self, day):
+        return (ss.memmap(self.store.path(day, 'sord'), _ORDER_DTYPE),
+                ss.memmap(self.store.path(day, 'sidx'), SEGMENT_DTYPE))
+
+    def update(self, day):
+        """Index rows of day appended since last update.
+
+        New rows are sorted by segment id and inserted after the indexed
+        rows of their segments, so indexed rows are not sorted again.
+
+        :param day: Day as 'YYYYMMDD'
+        :return: Number of newly indexed rows
+        :rtype: int
+        """
+        d = self.store.read(day)
+        order, segments = self._read(day)
+        m, n = len(order), len(d.id)
+        if m >= n: return 0
+        new = np.arange(m, n)
+        ids = np.asarray(d.id[m:n])
+        # a stable sort keeps time order of new rows of a segment
+        s = np.argsort(ids, kind='mergesort')
+        new, ids = new[s], ids[s]
+        # new rows of a segment come after its indexed rows, a new segment
+        # comes before the next indexed one
+        j = np.searchsorted(segments['id'], ids)
+        found = j < len(segments)
+        found[found] = segments['id'][j[found]] == ids[found]
+        pos = np.append(segments['start'], m)[j]
+        pos[found] += segments['count'][j[found]]
+        order = np.insert(np.asarray(order, dtype=np.int64), pos, new)
+        u, inverse = np.unique(np.concatenate([segments['id'], ids]),
+                               return_inverse=True)
+        count = np.bincount(inverse, np.concatenate(
+            [segments['count'], np.ones(len(ids))])).astype(np.int64)
+        segments = np.empty(len(u), dtype=SEGMENT_DTYPE)
+        segments['id'], segments['count'] = u, count
+        segments['start'] = np.cumsum(count) - count
+        _write(self.store.path(day, 'sord'), order.astype(_ORDER_DTYPE))
+        _write(self.store.path(day, 'sidx'), segments)
+        return n - m
+
+    def update_all(self):
+        """Update index of every day in store.
+
+        :return: Number of newly indexed rows
+        :rtype: int
+        """
+        return sum(self.update(day) for day in self.store.days())
+
+    def day_history(self, seg_id, day, update=False):
+        """History of a segment in a day.
+
+        :param seg_id: Segment id
+        :param day: Day as 'YYYYMMDD'
+        :param update: Index new rows of day before query
+        :rtype: np.ndarray of HISTORY_DTYPE
+        """
+        if update: self.update(day)
+        order, segments = self._read(day)
+        i = np.searchsorted(segments['id'], seg_id)
+        if i >= len(segments) or segments['id'][i] != seg_id:
+            return np.zeros(0, dtype=HISTORY_DTYPE)
+        r = segments[i]
+        rows = np.asarray(order[int(r['start']):int(r['start'] + r['count'])],
+                          dtype=np.int64)
+        d = self.store.read(day)
+        h = np.empty(len(rows), dtype=HISTORY_DTYPE)
+        snapshot = np.searchsorted(d.index['offset'], rows, side='right') - 1
+        h['date'] = d.index['date'][snapshot]
+        h['speed'], h['color'] = d.speed[rows], d.color[rows]
+        return h
+
+    def segment_history(self, seg_id, start, end, update=False):
+        """History of a segment between start and end (inclusive).
+
+        :param seg_id: Segment id
+        :param start: Start date
+        :param end: End date
+        :param update: Index new rows before query
+        :type start: datetime.datetime
+        :type end: datetime.datetime
+        :return: (date, speed, color) records where date is seconds since
+                 epoch
+        :rtype: np.ndarray of HISTORY_DTYPE
+        """
+        t0, t1 = ss.timestamp(start), ss.timestamp(end)
+        days = [d for d in self.store.days()
+                if start.strftime('%Y%m%d') <= d <= end.strftime('%Y%m%d')]
+        h = [self.day_history(seg_id, d, update) for d in days]
+        h = np.concatenate(h) if h else np.zeros(0, dtype=HISTORY_DTYPE)
+        return h[(h['date'] >= t0) & (h['date'] <= t1)]
+
+
+def to_datetime(h):
+    """Convert dates of a history to local datetimes.
+
+    :param h: History returned by segment_history
+    :rtype: list
+    """
+    return [dt.fromtimestamp(t) for t in h['date']]
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Spatial index over road segments (See geometry.py).
+
+Bounding boxes of segments are registered to the cells of a regular
+lon/lat grid they overlap. Keys of (cell, segment) pairs are kept sorted,
+so segments of a column of cells are a contiguous slice found by binary
+search. A query only looks at segments in cells around it instead of every
+polyline of a road file.
+"""
+
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # meters
+_M_PER_DEG = np.pi * EARTH_RADIUS / 180.
+
+
+def _ranges(starts, ends):
+    """Concatenation of np.arange(s, e) for each (s, e) pair."""
+    n = ends - starts
+    if n.sum() == 0: return np.zeros(0, dtype=np.int64)
+    first = np.repeat(starts - np.cumsum(n) + n, n)
+    return first + np.arange(n.sum())
+
+
+class SpatialIndex(object):
+    """Grid index of segments of a road geometry."""
+
+    def __init__(self, g, cell_size=0.005):
+        """
+        :param g: Road geometry
+        :param cell_size: Size of a grid cell in degrees
+        :type g: geometry.GEOMETRY
+        """
+        self.geometry = g
+        self.cell_size = cell_size
+        off = g.offsets
+        self.segments = g.segments
+        self.district = g.district[off[:-1]]
+        if len(g.seg) == 0:
+            self.bounds = np.zeros((0, 4))
+            self.origin, self.shape = (0., 0.), (1, 1)
+            self._keys = self._items = np.zeros(0, dtype=np.int64)
+            self._pieces = (np.zeros(0, dtype=np.int64),) * 2
+            self._piece_offsets = np.zeros(1, dtype=np.int64)
+            return
+        # bounds of segments as (lon0, lat0, lon1, lat1)
+        s = off[:-1]
+        self.bounds = np.column_stack([
+            np.minimum.reduceat(g.lon, s), np.minimum.reduceat(g.lat, s),
+            np.maximum.reduceat(g.lon, s), np.maximum.reduceat(g.lat, s)])
+        self.origin = (self.bounds[:, 0].min(), self.bounds[:, 1].min())
+        c0 = self._cell(self.bounds[:, 0], self.bounds[:, 1])
+        c1 = self._cell(self.bounds[:, 2], self.bounds[:, 3])
+        self.shape = (int(c1[0].max()) + 1, int(c1[1].max()) + 1)
+        # register each segment to every cell its bounds overlap
+        nx, ny = c1[0] - c0[0] + 1, c1[1] - c0[1] + 1
+        items = np.repeat(np.arange(len(s)), nx * ny)
+        k = np.arange(len(items)) - np.repeat(np.cumsum(nx * ny) - nx * ny,
+                                              nx * ny)
+        ix = c0[0][items] + k // ny[items]
+        iy = c0[1][items] + k % ny[items]
+        keys = ix * self.shape[1] + iy
+        o = np.lexsort((items, keys))
+        self._keys, self._items = keys[o], items[o]
+        # pieces (point pairs) of polylines grouped by segment. A segment
+        # with a single point has one zero length piece.
+        p = np.arange(len(g.seg))
+        nxt = np.minimum(p + 1, len(p) - 1)
+        last = np.zeros(len(p), dtype=bool)
+        last[off[1:] - 1] = True
+        single = np.zeros(len(p), dtype=bool)
+        single[off[:-1][np.diff(off) == 1]] = True
+        keep = ~last | single
+        self._pieces = (p[keep], np.where(last, p, nxt)[keep])
+        self._piece_offsets = np.searchsorted(
+            self._pieces[0], off, side='left')
+
+    def _cell(self, lon, lat):
+        """Grid cell (ix, iy) of coordinates."""
+        return (np.floor((np.asarray(lon) - self.origin[0]) /
+                         self.cell_size).astype(np.int64),
+                np.floor((np.asarray(lat) - self.origin[1]) /
+                         self.cell_size).astype(np.int64))
+
+    def _candidates(self, ix0, iy0, ix1, iy1):
+        """Indices of segments registered to cells in a range of cells."""
+        ix0, iy0 = max(ix0, 0), max(iy0, 0)
+        ix1, iy1 = min(ix1, self.shape[0] - 1), min(iy1, self.shape[1] - 1)
+        if ix0 > ix1 or iy0 > iy1: return np.zeros(0, dtype=np.int64)
+        # keys of a column of cells are contiguous
+        cols = np.arange(ix0, ix1 + 1) * self.shape[1]
+        a = np.searchsorted(self._keys, cols + iy0, side='left')
+        b = np.searchsorted(self._keys, cols + iy1, side='right')
+        return np.unique(self._items[_ranges(a, b)])
+
+    def _filter(self, i, district):
+        if district is None: return i
+        return i[self.district[i] == district]
+
+    def bbox(self, lon0, lat0, lon1, lat1, district=None):
+        """Segments whose bounds intersect a bounding box.
+
+        :param lon0: Minimum longitude
+        :param lat0: Minimum latitude
+        :param lon1: Maximum longitude
+        :param lat1: Maximum latitude
+        :param district: Only segments in district
+        :return: Indices of segments (into self.segments)
+        :rtype: np.ndarray
+        """
+        (ix0, ix1), (iy0, iy1) = self._cell([lon0, lon1], [lat0, lat1])
+        i = self._candidates(ix0, iy0, ix1, iy1)
+        b = self.bounds[i]
+        i = i[(b[:, 0] <= lon1) & (b[:, 2] >= lon0) &
+              (b[:, 1] <= lat1) & (b[:, 3] >= lat0)]
+        return self._filter(i, district)
+
+    def in_district(self, district):
+        """Segments in a district.
+
+        :rtype: np.ndarray
+        """
+        return np.flatnonzero(self.district == district)
+
+    def distances(self, lon, lat, i):
+        """Distances of a point to segments in meters.
+
+        Coordinates are projected to a plane tangent at the point, which is
+        accurate enough at the scale of a city.
+
+        :param lon: Longitude
+        :param lat: Latitude
+        :param i: Indices of segments
+        :rtype: np.ndarray
+        """
+        i = np.asarray(i, dtype=np.int64)
+        po = self._piece_offsets
+        n = po[i + 1] - po[i]
+        p = _ranges(po[i], po[i + 1])
+        g, kx = self.geometry, np.cos(np.radians(lat)) * _M_PER_DEG
+        a, b = self._pieces[0][p], self._pieces[1][p]
+        ax, ay = (g.lon[a] - lon) * kx, (g.lat[a] - lat) * _M_PER_DEG
+        bx, by = (g.lon[b] - lon) * kx, (g.lat[b] - lat) * _M_PER_DEG
+        dx, dy = bx - ax, by - ay
+        l2 = dx * dx + dy * dy
+        t = np.where(l2 > 0, -(ax * dx + ay * dy) / np.where(l2 > 0, l2, 1),
+                     0)
+        t = np.clip(t, 0, 1)
+        d = np.hypot(ax + t * dx, ay + t * dy)
+        if len(d) == 0: return np.zeros(0)
+        return np.minimum.reduceat(d, np.cumsum(n) - n)
+
+    def nearest(self, lon, lat, max_distance=None, district=None):
+        """Nearest segment to a point.
+
+        Rings of cells around the point are searched until no segment in
+        further rings can be closer than the nearest one found.
+
+        :param lon: Longitude
+        :param lat: Latitude
+        :param max_distance: Maximum distance in meters
+        :param district: Only segments in district
+        :return: (index of segment, distance in meters) or None
+        :rtype: tuple
+        """
+        if len(self.segments) == 0: return None
+        cx, cy = [int(c) for c in self._cell(lon, lat)]
+        # minimum distance covered by a ring of cells
+        step = self.cell_size * _M_PER_DEG * min(np.cos(np.radians(lat)), 1)
+        limit = max(cx, cy, self.shape[0] - cx, self.shape[1] - cy)
+        if max_distance is not None:
+            limit = min(limit, int(max_distance / step) + 1)
+        best, seen = None, np.zeros(0, dtype=np.int64)
+        for r in range(limit + 1):
+            i = self._filter(self._candidates(cx - r, cy - r, cx + r, cy + r),
+                             district)
+            i = np.setdiff1d(i, seen, assume_unique=True)
+            if len(i):
+                seen = np.union1d(seen, i)
+                d = self.distances(lon, lat, i)
+                j = np.argmin(d)
+                if best is None or d[j] < best[1]:
+                    best = (int(i[j]), float(d[j]))
+            if best is not None and best[1] <= r * step: break
+        if best is None or \
+                (max_distance is not None and best[1] > max_distance):
+            return None
+        return best
+
+    def nearest_segment(self, lon, lat, max_distance=None, district=None):
+        """Id of the nearest segment to a point or None.
+
+        :rtype: int
+        """
+        n = self.nearest(lon, lat, max_distance, district)
+        return None if n is None else int(self.segments[n[0]])
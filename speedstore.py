@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, C0321
+"""Columnar binary storage of traffic (speed) data.
+
+Each day is stored in four raw little-endian files which can be read by
+numpy.memmap without parsing:
+
+    <prefix>.<YYYYMMDD>.idx  snapshots (date, offset, count), INDEX_DTYPE
+    <prefix>.<YYYYMMDD>.sid  segment ids, uint32
+    <prefix>.<YYYYMMDD>.spd  speeds, uint8
+    <prefix>.<YYYYMMDD>.col  colors, uint8
+
+Rows of snapshot i are [offset, offset + count) of the column files. date is
+seconds since epoch.
+"""
+
+import calendar
+import os
+import threading
+import time
+from collections import namedtuple as nt
+import numpy as np
+
+INDEX_DTYPE = np.dtype([('date', '<i8'), ('offset', '<i8'), ('count', '<u4')])
+COLUMNS = (('sid', np.dtype('<u4')), ('spd', np.dtype('u1')),
+           ('col', np.dtype('u1')))
+SPEED_DAY = nt('SpeedDay', 'index id speed color')
+SNAPSHOT = nt('Snapshot', 'date id speed color')
+
+
+def timestamp(d):
+    """Convert a datetime to seconds since epoch.
+
+    Naive datetimes are treated as local time.
+
+    :type d: datetime.datetime
+    :rtype: int
+    """
+    if d.tzinfo is None: return int(time.mktime(d.timetuple()))
+    return calendar.timegm(d.utctimetuple())
+
+
+def memmap(f, dtype):
+    """Memory map a raw array file. Missing or empty file is an empty array.
+
+    :param f: Full path to file
+    :param dtype: Data type of array
+    :rtype: np.ndarray
+    """
+    if not os.path.exists(f) or os.path.getsize(f) < dtype.itemsize:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(f, dtype=dtype, mode='r',
+                     shape=(os.path.getsize(f) // dtype.itemsize,))
+
+
+class SpeedStore(object):
+    """Daily columnar store of traffic data."""
+
+    def __init__(self, directory, prefix='TrafficDataNew'):
+        """
+        :param directory: Directory of files
+        :param prefix: File name prefix
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+    def path(self, day, ext):
+        """Full path to a file of day.
+
+        :param day: Day as 'YYYYMMDD'
+        :param ext: One of idx, sid, spd, col
+        :rtype: str
+        """
+        return os.path.join(self.directory,
+                            '{0}.{1}.{2}'.format(self.prefix, day, ext))
+
+    def days(self):
+        """Days in store as sorted list of 'YYYYMMDD'.
+
+        :rtype: list
+        """
+        p = self.prefix + '.'
+        return sorted(f[len(p):-4] for f in os.listdir(self.directory)
+                      if f.startswith(p) and f.endswith('.idx'))
+
+    def append(self, date, ids, speeds, colors):
+        """Append a snapshot.
+
+        Columns are written before the index record, so a snapshot is only
+        visible after all of it is on disk. Leftovers of an interrupted
+        append are truncated.
+
+        :param date: Date of snapshot
+        :param ids: Segment ids
+        :param speeds: Speeds
+        :param colors: Colors
+        :type date: datetime.datetime
+        :type ids: array_like
+        """
+        day = date.strftime('%Y%m%d')
+        cols = [np.asarray(c, dtype=dtype)
+                for c, (_, dtype) in zip((ids, speeds, colors), COLUMNS)]
+        if not len(cols[0]) == len(cols[1]) == len(cols[2]):
+            raise ValueError('ids, speeds and colors must have same length')
+        with self._lock:
+            idx = self.path(day, 'idx')
+            offset = 0
+            if os.path.exists(idx):
+                n = os.path.getsize(idx) // INDEX_DTYPE.itemsize
+                if n > 0:
+                    with open(idx, 'rb') as f:
+                        f.seek((n - 1) * INDEX_DTYPE.itemsize)
+                        last = np.frombuffer(f.read(INDEX_DTYPE.itemsize),
+                                             dtype=INDEX_DTYPE)[0]
+                    offset = int(last['offset']) + int(last['count'])
+                with open(idx, 'r+b') as f:
+                    f.truncate(n * INDEX_DTYPE.itemsize)
+            for c, (ext, dtype) in zip(cols, COLUMNS):
+                with open(self.path(day, ext), 'ab') as f:
+                    f.truncate(offset * dtype.itemsize)
+                    f.write(c.tostring())
+            rec = np.array([(timestamp(date), offset, len(cols[0]))],
+                           dtype=INDEX_DTYPE)
+            with open(idx, 'ab') as f: f.write(rec.tostring())
+
+    def read(self, day):
+        """Memory map a day.
+
+        :param day: Day as 'YYYYMMDD'
+        :rtype: SPEED_DAY
+        """
+        index = memmap(self.path(day, 'idx'), INDEX_DTYPE)
+        n = int(index['offset'][-1] + index['count'][-1]) if len(index) \
+            else 0
+        cols = [memmap(self.path(day, ext), dtype)[:n]
+                for ext, dtype in COLUMNS]
+        return SPEED_DAY(index, *cols)
+
+    def snapshot(self, day, i):
+        """Get snapshot i of day.
+
+        :param day: Day as 'YYYYMMDD'
+        :param i: Snapshot number
+        :rtype: SNAPSHOT
+        """
+        d = self.read(day)
+        r = d.index[i]
+        s = slice(int(r['offset']), int(r['offset'] + r['count']))
+        return SNAPSHOT(int(r['date']), d.id[s], d.speed[s], d.color[s])
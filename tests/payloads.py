@@ -0,0 +1,135 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Encrypted payload generator for tests.
+
+Produces payloads in the format decrypted by tkmdecrypt.decrypt0 so tests do
+not need the live tkm.ibb.gov.tr web site.
+
+Payloads are synthetic, not captured: fixtures are built where the site
+is not reachable and no captures of the feeds are kept in the
+repository. Generated payloads have the field layout, record
+counts and value ranges of the real feeds (about 4000 segments in
+TrafficDataNew), and they are encrypted by the same algorithm.
+tests/encrypted.dat is the only real capture (road file r0.txt).
+Captured responses can be used instead by putting them into a directory
+for replay.py.
+"""
+
+import random
+import tkmdecrypt as td  # pylint: disable=E0401
+
+_TABLE = td._INT_TO_CHAR_TABLE.decode('utf-8')
+
+
+def _rotl(v, r):
+    return ((v << r) | (v >> (8 - r))) & 255
+
+
+def _shuffle_hex_str(h, key, p3):
+    u = [int(j) for j in key]
+    l7 = [u[(i - p3) % td._KEY_SIZE] for i in range(td._KEY_SIZE)]
+    l8 = list(h)
+    for i in range(len(h) / td._KEY_SIZE):
+        k = i * td._KEY_SIZE
+        for j in range(td._KEY_SIZE):
+            l8[k + j] = h[k + l7[j]]
+    return ''.join(l8)
+
+
+def encrypt0(clear_text, key, option=2, seed=0):
+    """Encrypt clear_text so that td.decrypt0(result, key) == clear_text.
+
+    :param clear_text: utf-8 encoded clear text
+    :param key: Key string
+    :param option: 0: plain, 1: hex, 2: shuffled hex
+    :param seed: Random seed for rotation values
+    :rtype: str
+    """
+    rnd = random.Random(seed)
+    text = clear_text.decode('utf-8')
+    l9 = [rnd.randint(1, 7) for _ in range(td._KEY_SIZE)]
+    l10 = sum(l9) % l9[0] + 1
+    body = ''.join(chr(_rotl(_TABLE.index(ch) + l10, l9[i % td._KEY_SIZE]))
+                   for i, ch in enumerate(text))
+    l6 = 'A' * 20 + ''.join(chr(90 + i) for i in range(td._KEY_SIZE))
+    l6 += ''.join(chr(ord(d) + 60 + i)
+                  for i, d in enumerate('{0:05d}'.format(len(text))))
+    key_section = ''.join(chr(90 + i) for i in l9)
+    l6 += key_section.ljust(td._KEY_SECTION_LENGTH, 'A') + body
+    if option == 0:
+        return l6 + '0'
+    h = ''.join('{0:02X}'.format(ord(ch)) for ch in l6)
+    if option == 1:
+        return h + '1'
+    p3 = rnd.randint(0, 9)
+    return _shuffle_hex_str(h, key, p3) + str(p3) + '2'
+
+
+def speed_data(n=4000, seed=0):
+    """Generate clear text of a TrafficDataNew payload.
+
+    :param n: Number of segments
+    :rtype: str
+    """
+    rnd = random.Random(seed)
+    return '&'.join('{0}|{1}|{2}'.format(i, rnd.randint(0, 120),
+                                         rnd.randint(0, 5))
+                    for i in range(1, n + 1))
+
+
+def parking_data(n=300, seed=0):
+    """Generate clear text of a ParkingLotData payload.
+
+    :param n: Number of parking lots
+    :rtype: str
+    """
+    rnd = random.Random(seed)
+    return '&'.join(u'{0};İSPARK Otopark {0};{1:.6f};{2:.6f};{3};{4};'.format(
+        i, 40.9 + rnd.random() * 0.3, 28.7 + rnd.random() * 0.6,
+        rnd.randint(50, 500), rnd.randint(0, 50)) for i in range(1, n + 1)
+                    ).encode('utf-8')
+
+
+def announcements(n=40, seed=0):
+    """Generate clear text of an AnnouncementData payload.
+
+    :param n: Number of announcements
+    :rtype: str
+    """
+    rnd = random.Random(seed)
+    return '&'.join(u'{0};{1};Kaza: Boğaziçi Köprüsü Avrupa yönü {2}. şerit '
+                    u'kapalı;{3:.6f};{4:.6f};'.format(
+                        i, rnd.randint(1, 9), rnd.randint(1, 4),
+                        41 + rnd.random() * 0.1, 29 + rnd.random() * 0.1)
+                    for i in range(1, n + 1)).encode('utf-8')
+
+
+# feed -> (clear text generator, key of feed in tkm._INSTANT)
+FEEDS = {
+    'TrafficIndex': (lambda: '42', 'traffic_index'),
+    'TrafficDataNew': (lambda: speed_data().replace('|', ';'),
+                       'traffic_data'),
+    'ParkingLotData': (parking_data, 'parking_data'),
+    'AnnouncementData': (announcements, 'announcements'),
+    'WeatherData': (lambda: u'22;Parçalı Bulutlu;65;12;KB;'.encode('utf-8'),
+                    'weather_data')}
+
+
+def write_fixtures(directory, keys):
+    """Write encrypted payload of each feed as <feed>.aspx.
+
+    'error' and 'no_data' responses of the feed are written as
+    <feed>.error.aspx and <feed>.no_data.aspx (See replay.py).
+    Payloads are deterministic, so fixtures are reproducible.
+
+    :param directory: Output directory
+    :param keys: data type -> key (tkm._INSTANT)
+    """
+    import os
+    for feed, (clear_text, t) in sorted(FEEDS.items()):
+        for suffix, text in (('', clear_text()), ('.error', 'error'),
+                             ('.no_data', 'no_data')):
+            with open(os.path.join(directory, feed + suffix + '.aspx'),
+                      'wb') as f:
+                f.write(encrypt0(text, keys[t][1]))
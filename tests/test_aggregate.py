@@ -0,0 +1,93 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for aggregate.py"""
+
+from datetime import datetime, timedelta
+import numpy as np
+import aggregate as ag  # pylint: disable=E0401
+import speedstore as ss  # pylint: disable=E0401
+
+
+def test_window_start():
+    """Test windows are aligned to local time"""
+    d = datetime(2016, 4, 22, 8, 44, 59)
+    t = ss.timestamp(d)
+    assert ag.window_start(t, 900) == ss.timestamp(d.replace(minute=30,
+                                                             second=0))
+    assert ag.window_start(t, 3600) == ss.timestamp(d.replace(minute=0,
+                                                              second=0))
+    assert ag.window_start(t, 86400) == ss.timestamp(datetime(2016, 4, 22))
+
+
+def test_aggregator(tmpdir):
+    """Test finished windows are written and segments are queried"""
+    a = ag.Aggregator(str(tmpdir), (900, 3600))
+    d0 = datetime(2016, 4, 22, 8)
+    for i in range(10):  # 08:00 ... 08:18
+        a.update(d0 + timedelta(minutes=2 * i), [3, 1],
+                 [30 + i, 10 + i], [1, 5 if i < 3 else 1])
+    r = a.read(900, '20160422')
+    assert list(r['id']) == [1, 3]
+    assert list(r['start']) == [ss.timestamp(d0)] * 2
+    assert list(r['count']) == [8, 8]  # 08:00 ... 08:14
+    assert list(r['sum']) == [sum(range(10, 18)), sum(range(30, 38))]
+    assert (r['min'][0], r['max'][0]) == (10, 17)
+    assert list(r['congested']) == [3, 0]
+    assert not tmpdir.join('TrafficDataNew.20160422.a3600').check()
+    a.update(d0.replace(minute=30), [2], [20], [4])
+    assert len(a.read(900, '20160422')) == 4
+    a.close()
+    r = a.read(3600, '20160422')
+    assert list(r['id']) == [1, 2, 3]
+    assert list(r['count']) == [10, 1, 10]
+    h = a.segment(1, 900, d0, d0.replace(hour=9))
+    assert list(h['count']) == [8, 2]
+    assert list(ag.mean_speed(h)) == [13.5, 18.5]
+    assert list(ag.congestion_share(h)) == [3 / 8.0, 0.0]
+    h = a.segment(1, 3600, d0, d0.replace(hour=9))
+    assert list(ag.congestion_share(h)) == [0.3]
+    assert len(a.segment(1, 900, d0.replace(minute=30),
+                         d0.replace(hour=9))) == 0
+
+
+def test_restart(tmpdir):
+    """Test a window written before and after a restart is merged"""
+    d = datetime(2016, 4, 22, 23, 50)
+    a = ag.Aggregator(str(tmpdir), (3600,))
+    a.update(d, [1, 2], [10, 20], [1, 1])
+    a.close()
+    a = ag.Aggregator(str(tmpdir), (3600,))
+    a.update(d + timedelta(minutes=5), [1], [30], [5])
+    a.update(d + timedelta(minutes=10), [1], [40], [1])  # next day
+    a.close()
+    r = a.read(3600, '20160422')
+    assert list(r['id']) == [1, 2]
+    assert list(r['count']) == [2, 1]
+    assert (r['min'][0], r['max'][0], r['congested'][0]) == (10, 30, 1)
+    h = a.segment(1, 3600, d, d + timedelta(hours=1))
+    assert list(ag.mean_speed(h)) == [20.0, 40.0]
+    assert len(ag.merge(np.zeros(0, ag.AGGREGATE_DTYPE))) == 0
+
+
+def test_index(tmpdir):
+    """Test windows are indexed and records without index are found"""
+    a = ag.Aggregator(str(tmpdir), (900,))
+    d0 = datetime(2016, 4, 22, 8)
+    for i in range(8):  # 4 windows
+        a.update(d0 + timedelta(minutes=8 * i), [5, 2 + i % 2, 9],
+                 [10 * i, 20, 30], [1, 1, 1])
+    a.close()
+    runs = np.fromfile(a.path(900, '20160422', 'i'), dtype=ag.RUN_DTYPE)
+    assert list(runs['count']) == [4, 4, 4, 4]
+    assert list(runs['offset']) == [0, 4, 8, 12]
+    h = a.segment(5, 900, d0, d0.replace(hour=9))
+    assert list(h['sum']) == [10, 50, 90, 130]
+    assert list(a.segment(3, 900, d0, d0.replace(hour=9))['count']) == [
+        1, 1, 1, 1]
+    # index of last window is lost
+    with open(a.path(900, '20160422', 'i'), 'r+b') as f:
+        f.truncate(3 * ag.RUN_DTYPE.itemsize)
+    h = a.segment(5, 900, d0, d0.replace(hour=9))
+    assert list(h['sum']) == [10, 50, 90, 130]
+    assert len(a.segment(7, 900, d0, d0.replace(hour=9))) == 0
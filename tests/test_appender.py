@@ -0,0 +1,74 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for appender.py"""
+
+import os
+import time
+from datetime import datetime
+import appender as ap  # pylint: disable=E0401
+
+
+def test_appender(tmpdir):
+    """Records are buffered until flush_bytes and mtime is set on flush"""
+    f = tmpdir.join('a.csv')
+    a = ap.Appender(str(f), flush_interval=3600, flush_bytes=10)
+    d = datetime(2016, 4, 22, 8, 15)
+    a.write('12345', d)
+    assert not f.check()
+    a.write('67890', d)
+    assert f.read() == '1234567890'
+    assert os.path.getmtime(str(f)) == time.mktime(d.timetuple())
+    a.write('x', datetime(2016, 4, 22, 8, 16))
+    assert f.read() == '1234567890'
+    a.close()
+    assert f.read() == '1234567890x'
+    a.write('y', d)  # opened again
+    a.close()
+    assert f.read() == '1234567890xy'
+
+
+def test_appender_interval(tmpdir, monkeypatch):
+    """Buffer is flushed when flush_interval passes"""
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    f = tmpdir.join('a.csv')
+    a = ap.Appender(str(f), flush_interval=60, flush_bytes=1 << 20)
+    a.write('a', datetime(2016, 4, 22))
+    now[0] += 59
+    a.write('b', datetime(2016, 4, 22))
+    assert not f.check()
+    now[0] += 1
+    a.write('c', datetime(2016, 4, 22))
+    assert f.read() == 'abc'
+    a.close()
+
+
+def test_appenders_roll_over(tmpdir):
+    """Writing to the file of next day closes file of previous day"""
+    r = ap.Appenders(flush_interval=3600)
+    d = datetime(2016, 4, 22)
+    f1, f2 = str(tmpdir.join('T.20160422.csv')), \
+        str(tmpdir.join('T.20160423.csv'))
+    r.write(f1, 'a', d, key='T')
+    r.write(f2, 'b', d, key='T')
+    assert tmpdir.join('T.20160422.csv').read() == 'a'
+    assert r.paths() == [f2]
+    r.flush()
+    assert tmpdir.join('T.20160423.csv').read() == 'b'
+    r.close()
+    assert r.paths() == []
+
+
+def test_appenders_timer(tmpdir):
+    """Buffer of a quiet feed is flushed by the timer"""
+    r = ap.Appenders(flush_interval=0.2)
+    f = tmpdir.join('T.20160422.csv')
+    r.write(str(f), 'a', datetime(2016, 4, 22), key='T')
+    assert not f.check()
+    end = time.time() + 5
+    while not f.check() and time.time() < end: time.sleep(0.02)
+    assert f.read() == 'a'
+    stop = r._stop
+    r.close()
+    assert stop.is_set() and r._stop is None
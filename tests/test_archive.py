@@ -0,0 +1,45 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for archive.py"""
+
+from datetime import datetime, timedelta
+import archive as ar  # pylint: disable=E0401
+
+
+def test_archive(tmpdir):
+    """Test building and reading a block archive"""
+    f = tmpdir.join('TrafficIndex.20160422.csv')
+    d0 = datetime(2016, 4, 22)
+    f.write(''.join('{0:%Y-%m-%d %H:%M:%S};{1}\r\n'.format(
+        d0 + timedelta(minutes=i), i) for i in range(1440)))
+    fn = ar.build(str(f), block_lines=60)
+    index = ar.read_index(fn)
+    assert len(index) == 24
+    assert index['lines'].sum() == 1440
+    assert ar.read_block(fn, 1, index)[0] == '2016-04-22 01:00:00;60'
+    assert [l[20:] for l in ar.read_lines(fn)] == \
+        [str(i) for i in range(1440)]
+    s = ar.read_snapshot(fn, datetime(2016, 4, 22, 8, 15))
+    assert s.data == str(8 * 60 + 15)
+    s = ar.read_snapshot(fn, datetime(2016, 4, 22, 8, 15, 30))
+    assert s.data == str(8 * 60 + 15)
+    assert ar.read_snapshot(fn, datetime(2016, 4, 21, 23, 59)) is None
+
+
+def test_concat(tmpdir):
+    """Concatenated archive must have lines of parts in order"""
+    d0 = datetime(2016, 4, 22)
+    parts = []
+    for k in range(3):
+        p = str(tmpdir.join('part%d.blk' % k))
+        with ar.BlockWriter(p, block_lines=7) as w:
+            for i in range(k * 20, k * 20 + 20):
+                w.write('{0:%Y-%m-%d %H:%M:%S};{1}'.format(
+                    d0 + timedelta(minutes=i), i))
+        parts.append(p)
+    fn = ar.concat(parts, str(tmpdir.join('all.blk')), remove=True)
+    assert [int(l[20:]) for l in ar.read_lines(fn)] == range(60)
+    assert len(ar.read_index(fn)) == 9
+    assert ar.read_snapshot(fn, d0 + timedelta(minutes=45)).data == '45'
+    assert not tmpdir.join('part0.blk').check()
@@ -0,0 +1,132 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212, W0621
+"""Offline benchmarks of decrypt, parse, compress and ingest stages.
+
+Benchmarks use synthetic encrypted payloads of each feed in tests/fixtures
+(See payloads.py for why they are not captured) and the captured road
+file tests/encrypted.dat, so they do not need the live web site. Results are
+saved as JSON by tkm.bench to compare commits.
+"""
+
+import os
+import urllib
+from datetime import datetime
+from StringIO import StringIO
+from mimetools import Message
+import pytest
+import compression as c  # pylint: disable=E0401
+import geometry as geo  # pylint: disable=E0401
+import payloads  # pylint: disable=E0401
+import tkm  # pylint: disable=E0401
+import tkmdecrypt as td  # pylint: disable=E0401
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+_FIXTURES = os.path.join(_DIR, 'fixtures')
+_FEEDS = sorted(payloads.FEEDS)
+
+
+def _fixture(feed):
+    with open(os.path.join(_FIXTURES, feed + '.aspx'), 'rb') as f:
+        return f.read()
+
+
+def _key(feed):
+    return tkm._INSTANT[payloads.FEEDS[feed][1]][1]
+
+
+@pytest.fixture(scope='module')
+def road():
+    """Encrypted road file"""
+    with open(os.path.join(_DIR, 'encrypted.dat'), 'rb') as f: return f.read()
+
+
+@pytest.fixture(scope='module')
+def data_file(tmpdir_factory):
+    """A data file of an hour of traffic data"""
+    f = tmpdir_factory.mktemp('data').join('TrafficDataNew.20160422.csv')
+    with open(str(f), 'wb') as fl:
+        for i in range(60):
+            fl.write('2016-04-22 08:%02d:00;%s\r\n' % (
+                i, payloads.speed_data(seed=i)))
+    return str(f)
+
+
+@pytest.mark.parametrize('feed', _FEEDS)
+def test_fixtures(feed):
+    """Fixtures must be the payloads generated by payloads.py"""
+    assert td.decrypt0(_fixture(feed), _key(feed)) == \
+        payloads.FEEDS[feed][0]()
+
+
+@pytest.mark.parametrize('feed', _FEEDS)
+def test_decrypt0(benchmark, feed):
+    """decrypt0 of each feed"""
+    enc = _fixture(feed)
+    assert benchmark(td.decrypt0, enc, _key(feed)) == \
+        payloads.FEEDS[feed][0]()
+
+
+def test_decrypt2_road(benchmark, road):
+    """decrypt2 of a road file"""
+    assert benchmark(td.decrypt2, road).startswith('1;0;')
+
+
+def test_parse_road_geometry(benchmark, road):
+    """Parse a road file to geometry"""
+    g = benchmark(geo.parse, td.decrypt2(road))
+    assert len(g.segments) > 0
+
+
+def test_parse_speed_data(benchmark):
+    """parse_speed_data of a traffic data snapshot"""
+    data = td.decrypt0(_fixture('TrafficDataNew'), _key('TrafficDataNew'))
+    tkmd = tkm.TKM_DATA(date=datetime(2016, 4, 22), e_tag=None,
+                        filename='TrafficDataNew.20160422.csv',
+                        data=data.replace(';', '|'))
+    assert len(benchmark(tkm.parse_speed_data, tkmd).data) == 4000
+
+
+@pytest.mark.parametrize('f_type', ['7z', 'xz', 'zip'])
+def test_compress(benchmark, data_file, f_type):
+    """Compress an hour of traffic data"""
+    if f_type == 'xz' and c.lzma is None: pytest.skip('lzma is missing')
+    fn = benchmark(c.compress, data_file, f_type=f_type)
+    assert os.path.getsize(fn) < os.path.getsize(data_file)
+    os.remove(fn)
+
+
+@pytest.mark.parametrize('f_type', ['7z', 'xz', 'zip'])
+def test_decompress(benchmark, data_file, f_type, tmpdir):
+    """Decompress an hour of traffic data"""
+    if f_type == 'xz' and c.lzma is None: pytest.skip('lzma is missing')
+    f = tmpdir.join(os.path.basename(data_file))
+    fn = c.compress(data_file, str(f), f_type=f_type)
+    out = benchmark(c.decompress, fn)
+    assert os.path.getsize(out) == os.path.getsize(data_file)
+
+
+def test_ingest_tick(benchmark, monkeypatch, tmpdir):
+    """Download, decrypt and save all instant data of a tick.
+
+    Responses are served from fixtures instead of the web site.
+    """
+    bodies = dict((os.path.basename(getattr(tkm.URL, u)),
+                   _fixture(os.path.splitext(os.path.basename(
+                       getattr(tkm.URL, u)))[0]))
+                  for u, _ in tkm._INSTANT.values())
+
+    def _urlopen(url, headers=None, timeout=None):
+        # pylint: disable=W0613
+        return urllib.addinfourl(StringIO(bodies[os.path.basename(url)]),
+                                 Message(StringIO('')), url, 200)
+    monkeypatch.setattr(tkm.hp, 'urlopen', _urlopen)
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(data=str(tmpdir)))
+    monkeypatch.setattr(tkm, 'METRICS', tkm.mt.Metrics())
+    monkeypatch.setattr(tkm, '_appenders', None)
+    monkeypatch.setattr(tkm, '_run_time', datetime(2016, 4, 22, 8, 15))
+    day = tkm._now().strftime('%Y%m%d')
+    benchmark(tkm.run_action, sorted(tkm._INSTANT))
+    tkm.close_files()
+    assert sorted(f.basename for f in tmpdir.listdir()) == sorted(
+        os.path.splitext(b)[0] + '.%s.csv' % day for b in bodies)
@@ -7,6 +7,7 @@
 import os
 import hashlib
 import tempfile
+import pytest
 import compression as c  # pylint: disable=E0401
 
 _f = 'tests/encrypted.dat'
@@ -26,3 +27,14 @@ def test_compression():
     fd = c.decompress(fc)
     assert f_sha == hashlib.sha256(open(fd, 'rb').read()).hexdigest()
     os.remove(fc); os.remove(fd)
+
+
+def test_compression_xz():
+    """ Test streaming xz compression and decompression """
+    if c.lzma is None: pytest.skip('lzma is missing')
+    f_sha = hashlib.sha256(open(_f, 'rb').read()).hexdigest()
+    temp_name = os.path.join('tests', next(tempfile._get_candidate_names()))
+    fc = c.compress(_f, temp_name, f_type='xz', buffer_size=4096)
+    fd = c.decompress(fc, buffer_size=4096)
+    assert f_sha == hashlib.sha256(open(fd, 'rb').read()).hexdigest()
+    os.remove(fc); os.remove(fd)
@@ -0,0 +1,109 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for daemon.py"""
+
+import os
+import threading
+import time
+import pytest
+import daemon  # pylint: disable=E0401
+import tkm  # pylint: disable=E0401
+
+
+def _wait(cond, timeout=10):
+    end = time.time() + timeout
+    while not cond():
+        assert time.time() < end
+        time.sleep(0.01)
+
+
+def test_pidfile(tmpdir):
+    """Test pidfile is locked while it is held"""
+    f = str(tmpdir.join('tkm.pid'))
+    assert daemon.read_pid(f) is None
+    with daemon.PidFile(f):
+        assert daemon.read_pid(f) == os.getpid()
+        with pytest.raises(daemon.AlreadyRunning):
+            daemon.PidFile(f).acquire()
+    assert not os.path.exists(f)
+    assert daemon.read_pid(f) is None
+    tmpdir.join('tkm.pid').write('12345\n')  # stale
+    with daemon.PidFile(f):
+        assert daemon.read_pid(f) == os.getpid()
+
+
+def test_read_config(tmpdir):
+    """Test configuration file and defaults"""
+    f = tmpdir.join('tkm.conf')
+    assert daemon.read_config(str(f)) == ({}, 'skip', daemon.JOBS)
+    f.write('[tkm]\ndelta = 60\ncolumnar = yes\noverrun = coalesce\n'
+            'aggregate = 900,3600\n'
+            '[jobs]\ninstant = 00 30 traffic_index,traffic_data\n'
+            'static = 00:00 3600 static_files\n')
+    settings, overrun, jobs = daemon.read_config(str(f))
+    assert settings == {'delta': 60, 'columnar': True,
+                        'aggregate': [900, 3600]}
+    assert overrun == 'coalesce'
+    assert sorted(jobs) == [
+        ('instant', '00', 30, ['traffic_index', 'traffic_data']),
+        ('static', '00:00', 3600, 'static_files')]
+    f.write('[tkm]\nunknown = 1\n')
+    with pytest.raises(ValueError):
+        daemon.read_config(str(f))
+
+
+def test_daemon(monkeypatch, tmpdir):
+    """Test jobs, control commands and reload of daemon"""
+    calls = []
+    lock = threading.Lock()
+
+    def _run_action(a):
+        with lock: calls.append(a if isinstance(a, str) else ','.join(a))
+    monkeypatch.setattr(tkm, 'run_action', _run_action)
+    monkeypatch.setattr(tkm, 'METRICS', tkm.mt.Metrics())
+    monkeypatch.setattr(tkm, 'TICK_BUDGET', 0)
+    monkeypatch.setattr(tkm, 'DELTA_KEYFRAME', 0)
+    monkeypatch.setattr(tkm, '_run_time', tkm._run_time)
+    conf = tmpdir.join('tkm.conf')
+    conf.write('[jobs]\ninstant = immediate 3600 traffic_index\n'
+               'compress = immediate 3600 compress\n')
+    sock = str(tmpdir.join('tkm.sock'))
+    d = daemon.Daemon(str(conf), sock)
+    assert d.command('run') == {'error': 'not running'}
+    t = threading.Thread(target=d.run)
+    t.start()
+    try:
+        _wait(lambda: len(calls) == 2 and os.path.exists(sock))
+        assert sorted(calls) == ['compress', 'traffic_index']
+        assert tkm.TICK_BUDGET == 3600 * 0.8
+        s = daemon.control('status', sock)
+        assert s['pid'] == os.getpid()
+        assert sorted(j['name'] for j in s['jobs']) == [
+            'compress', 'instant']
+        assert daemon.control('run compress', sock) == {'ok': True}
+        _wait(lambda: calls.count('compress') == 2)
+        assert 'error' in daemon.control('run unknown', sock)
+        assert 'error' in daemon.control('unknown', sock)
+        # reload reads configuration again
+        conf.write('[tkm]\ndelta = 30\n'
+                   '[jobs]\ninstant = immediate 3600 traffic_index\n')
+        assert daemon.control('reload', sock) == {'ok': True}
+        _wait(lambda: calls.count('traffic_index') == 2)
+        assert tkm.DELTA_KEYFRAME == 30
+        s = daemon.control('status', sock)
+        assert s['reloads'] == 1
+        assert [j['name'] for j in s['jobs']] == ['instant']
+        # removed options and tick budget of removed job get defaults
+        conf.write('[jobs]\ncompress = immediate 3600 compress\n')
+        assert daemon.control('reload', sock) == {'ok': True}
+        _wait(lambda: calls.count('compress') == 3)
+        assert tkm.DELTA_KEYFRAME == 0
+        assert tkm.TICK_BUDGET == 0
+        assert daemon.control('stop', sock) == {'ok': True}
+        t.join(10)
+        assert not t.is_alive()
+        assert not os.path.exists(sock)
+    finally:
+        d.stop()
+        t.join(10)
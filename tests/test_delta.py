@@ -0,0 +1,116 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for delta.py"""
+
+from datetime import datetime, timedelta
+import pytest
+import archive as ar  # pylint: disable=E0401
+import delta as de  # pylint: disable=E0401
+
+_SNAPSHOTS = ['1|50|1&2|60|2&3|70|3', '1|50|1&2|61|2&3|70|3',
+              '1|50|1&2|61|2&3|70|3', '1|50|1&3|70|4&4|10|5',
+              'NA', '1|50|1&3|70|4', '1|55|1&3|70|4']
+
+
+def test_delta_encode_decode():
+    """Test encoder output and decoder rebuilds every snapshot"""
+    e = de.DeltaEncoder(keyframe_interval=4)
+    enc = [e.encode(s, 'a') for s in _SNAPSHOTS]
+    assert enc == ['1|50|1&2|60|2&3|70|3', '+2|61|2', '+',
+                   '+3|70|4&4|10|5&-2', 'NA', '1|50|1&3|70|4',
+                   '+1|55|1']
+    d = de.DeltaDecoder()
+    assert [d.decode(s) for s in enc] == _SNAPSHOTS
+    assert e.encode(_SNAPSHOTS[0], 'b') == _SNAPSHOTS[0]  # new key
+
+
+def test_delta_order_malformed():
+    """Test reordered and malformed snapshots are stored as keyframes"""
+    snapshots = ['1|50|1&2|60|2', '2|60|2&1|50|1', '2|61|2&1|50|1',
+                 '2|61|2&x&1|50|1', '2|62|2&1|50|1', '2|62|2&3|9|1&1|50|1',
+                 '2|62|2&3|9|1&1|51|1']
+    e = de.DeltaEncoder(keyframe_interval=100)
+    enc = [e.encode(s, 'a') for s in snapshots]
+    assert enc == [snapshots[0], snapshots[1], '+2|61|2', snapshots[3],
+                   snapshots[4], snapshots[5], '+1|51|1']
+    d = de.DeltaDecoder()
+    assert [d.decode(s) for s in enc] == snapshots
+    with pytest.raises(ValueError):
+        d.decode('+2|63|2&x')
+
+
+def test_delta_duplicate_id():
+    """Test snapshots with duplicate ids are rebuilt exactly"""
+    snapshots = ['1|50|1&2|60|2', '1|50|1&1|60|2', '1|50|1&1|61|2',
+                 '1|50|1&2|61|2', '1|51|1&2|61|2']
+    e = de.DeltaEncoder(keyframe_interval=100)
+    enc = [e.encode(s, 'a') for s in snapshots]
+    assert enc == snapshots[:4] + ['+1|51|1']
+    d = de.DeltaDecoder()
+    assert [d.decode(s) for s in enc] == snapshots
+
+
+def test_delta_archive(tmpdir):
+    """Test block archives of delta encoded files"""
+    e = de.DeltaEncoder(keyframe_interval=7)
+    d0 = datetime(2016, 4, 22)
+    lines = ['{0:%Y-%m-%d %H:%M:%S};{1}'.format(
+        d0 + timedelta(minutes=i), '1|%d|1&2|%d|2' % (i % 3, i % 5))
+             for i in range(100)]
+    f = tmpdir.join('TrafficDataNew.20160422.csv')
+    f.write(''.join(l[:20] + e.encode(l[20:]) + '\r\n' for l in lines))
+    assert list(de.expand(open(str(f)))) == lines
+    fn = ar.build(str(f), block_lines=10)
+    index = ar.read_index(fn)
+    assert list(index['lines']) == [10] * 10
+    for i in range(len(index)):
+        assert not de.is_delta(ar.read_block(fn, i, index)[0][20:])
+    for i in [0, 9, 10, 55, 99]:
+        s = ar.read_snapshot(fn, d0 + timedelta(minutes=i))
+        assert s.data == lines[i][20:]
+
+
+def test_dedup_encode_decode():
+    """Test unchanged snapshots are stored as SAME and decoded back"""
+    e, delta = de.DedupEncoder(), de.DeltaEncoder(keyframe_interval=4)
+    enc = []
+    for s in _SNAPSHOTS:
+        x = e.encode(s, 'a')
+        enc.append(x if x == de.SAME else delta.encode(x, 'a'))
+    assert enc == ['1|50|1&2|60|2&3|70|3', '+2|61|2', de.SAME,
+                   '+3|70|4&4|10|5&-2', 'NA', '1|50|1&3|70|4', '+1|55|1']
+    d = de.DeltaDecoder()
+    assert [d.decode(s) for s in enc] == _SNAPSHOTS
+    assert e.encode('42', 'b') == '42'
+    assert [e.encode(s, 'b') for s in ['42', '42', 'NA', 'NA', '42']] == [
+        de.SAME, de.SAME, 'NA', 'NA', '42']
+    assert e.encode('42', 'c') == '42'  # new key
+    assert [d.decode(s) for s in ['7', de.SAME]] == ['7', '7']
+    try:
+        de.DeltaDecoder().decode(de.SAME)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_dedup_archive(tmpdir):
+    """Test blocks of archives end at SAME and start with full data"""
+    e = de.DedupEncoder()
+    d0 = datetime(2016, 4, 22)
+    lines = ['{0:%Y-%m-%d %H:%M:%S};{1}'.format(
+        d0 + timedelta(minutes=i), '1|%d|1&2|60|2' % (i // 15))
+             for i in range(60)]
+    f = tmpdir.join('TrafficIndex.20160422.csv')
+    f.write(''.join(l[:20] + e.encode(l[20:]) + '\r\n' for l in lines))
+    assert f.size() < sum(len(l) + 2 for l in lines)
+    assert list(de.expand(open(str(f)))) == lines
+    fn = ar.build(str(f), block_lines=10)
+    index = ar.read_index(fn)
+    assert list(index['lines']) == [10] * 6
+    for i in range(6):
+        assert not de.is_dependent(ar.read_block(fn, i, index)[0][20:])
+    for i in [0, 9, 16, 59]:
+        s = ar.read_snapshot(fn, d0 + timedelta(minutes=i))
+        assert s.data == lines[i][20:]
+    assert list(de.expand(ar.read_lines(fn))) == lines
@@ -0,0 +1,97 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for eoner.py"""
+
+import zipfile
+from datetime import datetime, timedelta
+import numpy as np
+from dateutil import tz
+import archive as ar  # pylint: disable=E0401
+import delta as de  # pylint: disable=E0401
+import eoner  # pylint: disable=E0401
+import tkm  # pylint: disable=E0401
+
+
+def _oa(d):
+    return (d - datetime(1899, 12, 30)).total_seconds() / 86400.
+
+
+def _write_zip(f, d0, n):
+    """Write an eoner zip file of n minutes starting from d0 (UTC)."""
+    lines = []
+    for i in range(n):
+        td = ''.join('%d;%d;%d;&' % (s, (s + i) % 90, 1 + (s + i) % 5)
+                      for s in range(1, 4))
+        lines.append('#'.join([
+            '%.8f' % _oa(d0 + timedelta(minutes=i)), '%d' % (i % 100),
+            td, 'error', '', 'sunny#windy;&']))
+    z = zipfile.ZipFile(str(f), 'w')
+    z.writestr('data.csv', '\xef\xbb\xbf' + '\r\n'.join(lines) + '\r\n')
+    z.close()
+
+
+def _local(d):
+    d = d.replace(tzinfo=tz.tzutc()).astimezone(tz.tzlocal())
+    return d.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def test_oa_to_datetime():
+    """Vectorized conversion must match scalar conversion"""
+    x = ['42216.5', '42216.0006944444', u'﻿42217.25']
+    v = eoner._oa_to_datetime(x)
+    for a, b in zip(v.astype(datetime), x):
+        assert abs(a - eoner._oa_to_datetime(b)) < timedelta(microseconds=2)
+    d = datetime(2015, 7, 31, 21, 30)
+    assert str(eoner._utc_to_local(np.array([d], dtype='datetime64[us]'))[0]
+               ).replace('T', ' ') == _local(d)
+
+
+def test_convert_data_from_zip_files(monkeypatch, tmpdir):
+    """Zip files are imported to block archives of local days"""
+    data = tmpdir.mkdir('data')
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(data=str(data)))
+    d0 = datetime(2015, 7, 31)
+    files = []
+    for k in range(2):
+        f = tmpdir.join((d0 + timedelta(days=k)).strftime('%Y-%m-%d.zip'))
+        _write_zip(f, d0 + timedelta(days=k), 1440)
+        files.append(str(f))
+    data.join('TrafficIndex.20150731.csv').write('stale')
+    archives = eoner.convert_data_from_zip_files(files, processes=2,
+                                                 keyframe=10)
+    assert not data.join('TrafficIndex.20150731.csv').check()
+    assert not [f for f in data.listdir() if f.ext == '.part']
+    lines = {}
+    for a in archives:
+        lines[a] = list(ar.read_lines(a))
+    ti = [l for a in sorted(lines) if 'TrafficIndex' in a for l in lines[a]]
+    assert len(ti) == 2880
+    # dates are converted as the former line by line converter did
+    expected = [
+        _local(eoner._oa_to_datetime('%.8f' % _oa(
+            d0 + timedelta(minutes=i)))) + ';%d' % (i % 1440 % 100)
+        for i in range(2880)]
+    assert ti == expected
+    assert not [a for a in archives if 'ParkingLotData' in a]
+    assert not [a for a in archives if 'AnnouncementData' in a]
+    w = [l for a in archives if 'WeatherData' in a for l in lines[a]]
+    assert w[0].endswith(';sunny#windy')
+    td = sorted(a for a in archives if 'TrafficDataNew' in a)
+    full = list(de.expand(l for a in td for l in lines[a]))
+    assert full[1][20:] == '1|2|3&2|3|4&3|4|5'
+    assert any(de.is_delta(l[20:]) for l in lines[td[0]])
+    assert ar.read_snapshot(td[0], ar.line_date(full[5])).data == \
+        full[5][20:]
+
+
+def test_convert_data_to_missing_dir(monkeypatch, tmpdir):
+    """Data directory is created if it does not exist"""
+    data = tmpdir.join('data')
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(data=str(data)))
+    f = tmpdir.join('2015-07-31.zip')
+    _write_zip(f, datetime(2015, 7, 31), 10)
+    archives = eoner.convert_data_from_zip_files([str(f)], processes=1)
+    assert archives
+    assert all(a.startswith(str(data)) for a in archives)
+    assert len(list(ar.read_lines(sorted(archives)[0]))) > 0
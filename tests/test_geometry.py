@@ -0,0 +1,39 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for geometry.py"""
+
+import os
+import geometry as geo  # pylint: disable=E0401
+
+_ROAD = u'\n'.join([
+    u'20;2;28.92;41.01;0;0;0;0;0;0;Fatih',
+    u'10;1;28.90;41.00;0;0;0;0;0;0;Şişli',
+    u'20;1;28.91;41.02;0;0;0;0;0;0;Fatih',
+    u'10;2;28.95;41.05;0;0;0;0;0;0;Şişli',
+    u'10;3;28.96;41.06;0;0;0;0;0;0;Şişli']).encode('utf-8')
+
+
+def test_geometry_cache(tmpdir):
+    """Test parsing, disk/LRU cache and invalidation"""
+    geo.clear()
+    f = tmpdir.join('r0.ABC.txt')
+    f.write(_ROAD, 'wb')
+    g = geo.load(str(f))
+    assert g.e_tag == 'ABC'
+    assert list(g.segments) == [10, 20]
+    assert list(g.offsets) == [0, 3, 5]
+    assert list(g.no) == [1, 2, 3, 1, 2]
+    assert list(g.lon[3:]) == [28.91, 28.92]
+    assert g.district[0] == u'Şişli'
+    assert tmpdir.join('r0.ABC.npz').check()
+    assert geo.load(str(f)) is g  # LRU
+    geo.clear()
+    g2 = geo.load(str(f))  # disk cache
+    assert g2 is not g and list(g2.lat) == list(g.lat)
+    assert g2.district[4] == u'Fatih'
+    f2 = tmpdir.join('r0.DEF.txt')
+    f2.write(_ROAD, 'wb')
+    geo.invalidate(str(f2))
+    assert not tmpdir.join('r0.ABC.npz').check()
+    assert os.path.abspath(str(f)) not in geo._cache
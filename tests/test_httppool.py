@@ -0,0 +1,99 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for httppool.py"""
+
+import socket
+import threading
+import time
+import urllib2 as ul
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import httppool as hp  # pylint: disable=E0401
+
+_connections = []
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=C0111
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/ok')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/slow': time.sleep(0.5)
+        code, body = (200, 'ok') if self.path in ('/ok', '/slow') \
+            else (404, 'no')
+        _connections.append(self.client_address)
+        self.send_response(code)
+        self.send_header('ETag', '"abc:0"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
+
+
+def test_connection_pool():
+    """Test connections are reused, redirects and errors"""
+    server = HTTPServer(('127.0.0.1', 0), _Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    url = 'http://127.0.0.1:%d' % server.server_port
+    pool = hp.ConnectionPool()
+    try:
+        for _ in range(3):
+            r = pool.urlopen(url + '/ok')
+            assert r.code == 200
+            assert r.read() == 'ok'
+            assert r.info().getheader('ETag') == '"abc:0"'
+        assert len(set(_connections)) == 1
+        assert pool.urlopen(url + '/redirect').read() == 'ok'
+        try:
+            pool.urlopen(url + '/notfound')
+            assert False
+        except ul.HTTPError as e:
+            assert e.code == 404
+    finally:
+        pool.close()
+        server.shutdown()
+        server.server_close()
+
+
+class _QuietServer(HTTPServer):
+    def handle_error(self, request, client_address):
+        pass  # client closed connection on timeout
+
+
+def test_timeout():
+    """Test timeout of a request is limited by timeout of pool"""
+    server = _QuietServer(('127.0.0.1', 0), _Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    url = 'http://127.0.0.1:%d' % server.server_port
+    pool = hp.ConnectionPool(timeout=0.2)
+    try:
+        assert pool.urlopen(url + '/ok').read() == 'ok'
+        t = time.time()
+        try:
+            pool.urlopen(url + '/slow', timeout=5)  # reused connection
+            assert False
+        except socket.timeout:
+            assert time.time() - t < 0.4  # not retried
+        pool.timeout = 5
+        t = time.time()
+        try:
+            pool.urlopen(url + '/slow', timeout=0.1)
+            assert False
+        except socket.timeout:
+            assert time.time() - t < 0.3
+        assert pool.urlopen(url + '/slow').read() == 'ok'
+    finally:
+        pool.close()
+        server.shutdown()
+        server.server_close()
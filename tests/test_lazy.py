@@ -0,0 +1,26 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for lazy.py"""
+
+import sys
+import lazy  # pylint: disable=E0401
+
+
+def test_lazy_module(monkeypatch):
+    """Test module is imported on first attribute access"""
+    monkeypatch.delitem(sys.modules, 'colorsys', raising=False)
+    m = lazy.LazyModule('colorsys')
+    assert 'colorsys' not in sys.modules
+    assert m.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert m._module is sys.modules['colorsys']
+
+
+def test_lazy_module_setattr(monkeypatch):
+    """Test attributes are set on the imported module"""
+    import json
+    m = lazy.LazyModule('json')
+    monkeypatch.setattr(m, 'dumps', len)
+    assert json.dumps is len
+    monkeypatch.undo()
+    assert json.dumps('ab') == '"ab"'
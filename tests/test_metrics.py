@@ -0,0 +1,72 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Test module for metrics.py"""
+
+import json
+import urllib2
+import metrics as mt  # pylint: disable=E0401
+
+
+def test_render():
+    """Test Prometheus text format"""
+    m = mt.Metrics(buckets=(0.1, 1))
+    m.describe('a_total', mt.COUNTER, 'A counter')
+    m.inc('a_total', feed='x')
+    m.inc('a_total', 2, feed='x')
+    m.set_total('a_total', 7, feed='w')
+    m.set('b', 1.5)
+    m.observe('c_seconds', 0.05, feed='y"z')
+    m.observe('c_seconds', 0.5, feed='y"z')
+    m.observe('c_seconds', 5, feed='y"z')
+    lines = m.render().splitlines()
+    assert '# HELP a_total A counter' in lines
+    assert '# TYPE a_total counter' in lines
+    assert 'a_total{feed="x"} 3' in lines
+    assert 'a_total{feed="w"} 7' in lines
+    assert 'b 1.5' in lines
+    assert '# TYPE c_seconds histogram' in lines
+    assert 'c_seconds_bucket{feed="y\\"z",le="0.1"} 1' in lines
+    assert 'c_seconds_bucket{feed="y\\"z",le="1.0"} 2' in lines
+    assert 'c_seconds_bucket{feed="y\\"z",le="+Inf"} 3' in lines
+    assert 'c_seconds_sum{feed="y\\"z"} 5.55' in lines
+    assert 'c_seconds_count{feed="y\\"z"} 3' in lines
+
+
+def test_snapshot(tmpdir):
+    """Test JSON dump and collectors"""
+    m = mt.Metrics()
+    m.collector(lambda r: r.set('g', 7, job='j'))
+    with m.timer('t_seconds'):
+        pass
+    f = str(tmpdir.join('metrics.json'))
+    m.dump(f)
+    with open(f) as fl: d = json.load(fl)
+    assert d['metrics']['g']['values'] == [{'labels': {'job': 'j'},
+                                            'value': 7}]
+    assert d['metrics']['t_seconds']['values'][0]['count'] == 1
+    try:
+        m.inc('g')
+        assert False
+    except ValueError:
+        pass
+
+
+def test_serve():
+    """Metrics are served over HTTP"""
+    m = mt.Metrics()
+    m.inc('a_total')
+    server = mt.serve(m, 0)
+    try:
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+        r = urllib2.urlopen(url + '/metrics')
+        assert r.info().getheader('Content-Type') == mt.CONTENT_TYPE
+        assert 'a_total 1' in r.read().splitlines()
+        try:
+            urllib2.urlopen(url + '/other')
+            assert False
+        except urllib2.HTTPError as e:
+            assert e.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,77 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, R0903
+"""Test module for render.py"""
+
+import numpy as np
+import pytest
+import geometry as geo  # pylint: disable=E0401
+
+pytest.importorskip('matplotlib')
+import render  # noqa pylint: disable=E0401, C0413
+import tkm  # noqa pylint: disable=E0401, C0413
+
+_ROAD = '\n'.join([
+    '1;1;29.00;41.00;0;0;0;0;0;0;A', '1;2;29.01;41.01;0;0;0;0;0;0;A',
+    '2;1;29.02;41.02;0;0;0;0;0;0;A', '2;2;29.03;41.01;0;0;0;0;0;0;A',
+    '3;1;29.04;41.00;0;0;0;0;0;0;B', '3;2;29.05;41.01;0;0;0;0;0;0;B',
+    '4;1;30.00;42.00;0;0;0;0;0;0;B', '4;2;30.01;42.01;0;0;0;0;0;0;B'])
+
+
+class _Map(object):
+    """Offline stand-in for smopy.Map (tiles are fetched from network)."""
+    box = (40.99, 28.99, 41.03, 29.06)
+    w, h = 200, 100
+    img = np.zeros((100, 200, 3), dtype=np.uint8)
+
+    def to_pixels(self, latlon):
+        lat, lon = latlon.T
+        return np.c_[(lon - 28.99) / 0.07 * self.w,
+                     (41.03 - lat) / 0.04 * self.h]
+
+
+def _speed(*records):
+    return np.array(list(records), dtype=[('id', '<u4'), ('speed', 'u1'),
+                                    ('color', 'u1')])
+
+
+def test_segment_colors():
+    """Speed data is joined to segments by id"""
+    g = geo.parse(_ROAD)
+    c = render.segment_colors(g, _speed((3, 40, 2), (1, 10, 4), (9, 5, 5)))
+    assert list(c) == [4, render.NO_DATA, 2, render.NO_DATA]
+    c = render.segment_colors(g, _speed())
+    assert list(c) == [render.NO_DATA] * 4
+
+
+def test_renderer(tmpdir):
+    """Only segments in map are drawn and recolored"""
+    r = render.Renderer(_Map(), geo.parse(_ROAD), figsize=(2, 1), dpi=100,
+                        label='r0.txt')
+    assert list(r.visible) == [0, 1, 2]
+    assert len(r.roads.get_segments()) == 3
+    c = r.update(_speed((2, 40, 1), (4, 10, 5)))
+    assert list(c) == [render.NO_DATA, 1, render.NO_DATA]
+    rgba = r.roads.get_colors()
+    assert np.allclose(rgba[1], r._rgba[1])  # pylint: disable=W0212
+    assert r.to_rgb().shape == (100, 200, 3)
+    f = tmpdir.join('r0.png')
+    r.save(str(f))
+    assert f.size() > 0
+
+
+def test_animate(tmpdir):
+    """Frames of a speed matrix are saved as an image sequence"""
+    lines = ['2016-10-20 10:00:00;1|10|1&2|20|2&4|1|1',
+             '2016-10-20 10:01:00;2|30|3&3|40|5',
+             '2016-10-20 10:02:00;NA']
+    m = tkm.parse_speed_lines(lines)
+    g = geo.parse(_ROAD)
+    c = render.matrix_colors(g, m)
+    assert c.tolist() == [[1, 2, 6, 1], [6, 3, 5, 6], [6, 6, 6, 6]]
+    r = render.Renderer(_Map(), g, figsize=(2, 1), dpi=50)
+    out = str(tmpdir.join('r0.{0:04d}.{1:%H%M}.png'))
+    assert render.animate(r, m, out) == 3
+    assert sorted(f.basename for f in tmpdir.listdir()) == \
+        ['r0.0000.1000.png', 'r0.0001.1001.png', 'r0.0002.1002.png']
+    assert list(r.roads.get_colors()[0]) == list(r._rgba[6])  # noqa pylint: disable=W0212
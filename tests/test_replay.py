@@ -0,0 +1,109 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212, W0621
+"""Test module for replay.py"""
+
+import os
+import pytest
+import replay  # pylint: disable=E0401
+import tkm  # pylint: disable=E0401
+import tkmdecrypt as td  # pylint: disable=E0401
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+_FIXTURES = os.path.join(_DIR, 'fixtures')
+
+
+@pytest.fixture
+def server(monkeypatch, tmpdir):
+    """Replay server of fixtures which tkm.py collects from."""
+    s = replay.ReplayServer(seed=1).load(_FIXTURES)
+    with open(os.path.join(_DIR, 'encrypted.dat'), 'rb') as f:
+        s.add_static('r0.txt', f.read(), 1461300000)
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(
+        data=str(tmpdir.mkdir('data')), static=str(tmpdir.mkdir('static'))))
+    monkeypatch.setattr(tkm, 'METRICS', tkm.mt.Metrics())
+    monkeypatch.setattr(tkm, 'BREAKERS', tkm.rt.CircuitBreakers())
+    monkeypatch.setattr(tkm, 'RETRY', tkm.rt.RetryPolicy(tries=3, delay=0))
+    monkeypatch.setattr(tkm, '_raw_e_tags', {})
+    base_url = tkm.BASE_URL
+    with s:
+        tkm.set_base_url(s.url)
+        yield s
+    tkm.set_base_url(base_url)
+
+
+def test_load():
+    """Test responses are loaded from fixtures."""
+    s = replay.ReplayServer().load(_FIXTURES)
+    assert sorted(s.feeds) == sorted(
+        os.path.basename(getattr(tkm.URL, u)) for u, _ in
+        tkm._INSTANT.values())
+    key = tkm._INSTANT['traffic_index'][1]
+    bodies = s.feeds['TrafficIndex.aspx']
+    assert td.decrypt0(bodies[replay.ERROR], key) == 'error'
+    assert td.decrypt0(bodies[replay.NO_DATA], key) == 'no_data'
+
+
+def test_set_base_url(server):
+    """Test urls of tkm.py point to server."""
+    assert tkm.URL.trafficindex == \
+        server.url + 'data/IntensityMap/TrafficIndex.aspx'
+    assert tkm.URL.road[0] == server.url + 'YHarita/res/r0.txt'
+
+
+def test_get_many(server):
+    """Test all feeds are collected from server."""
+    for t, tkmd in zip(sorted(tkm._INSTANT), tkm.get_many()):
+        assert tkmd.data != 'NA', t
+    assert tkm.get('traffic_index').data == '42'
+    assert server.requests() == len(tkm._INSTANT) + 1
+
+
+def test_error_bodies(server):
+    """Test 'error' and 'no_data' bodies and HTTP errors are retried."""
+    server.error_body_rate = server.no_data_rate = 0.3
+    server.error_rate = 0.2
+    data = [tkm.get('traffic_index').data for _ in range(20)]
+    assert data.count('42') > 10
+    assert set(data) <= {'42', 'NA'}
+    assert server.requests() > 20
+    assert (replay.FEED_PATH + 'TrafficIndex.aspx', 500) in server.stats
+    server.error_body_rate = 1
+    server.error_rate = 0
+    assert tkm.get('traffic_index').data == 'NA'
+
+
+def test_static_file(server):
+    """Test static file download is conditional."""
+    url = tkm.URL.road[0]
+    tkmd = tkm._static_file_download(url)
+    assert tkmd.filename.startswith('r0.') and tkmd.filename != 'r0.txt'
+    assert tkmd.data.startswith('1|0|')
+    assert os.path.getmtime(os.path.join(tkm.DIR.static,
+                                         tkmd.filename)) == 1461300000
+    assert tkm._static_file_download(url) is None
+    path = replay.STATIC_PATH + 'r0.txt'
+    assert server.stats[(path, 304)] == 1
+    # a new version is downloaded
+    body = server.static['r0.txt'][0]
+    server.add_static('r0.txt', body + ' ', 1461400000)
+    assert tkm._static_file_download(url).filename != tkmd.filename
+
+
+def test_respond():
+    """Test latency, errors and conditional responses."""
+    s = replay.ReplayServer(latency=0.05)
+    s.add_static('d01.txt', 'abc', 1461300000)
+    path = replay.STATIC_PATH + 'd01.txt'
+    code, body, headers = s.respond(path)
+    headers = dict(headers)
+    assert (code, body) == (200, 'abc')
+    assert headers['Last-Modified'] == 'Fri, 22 Apr 2016 04:40:00 GMT'
+    assert s.respond(path, headers['ETag'])[:2] == (304, '')
+    assert s.respond(path, '"x:0"')[0] == 200
+    assert s.respond(path, None, headers['Last-Modified'])[0] == 304
+    assert s.respond(path, None, 'Fri, 22 Apr 2016 04:39:59 GMT')[0] == 200
+    assert s.respond('/notfound.html')[0] == 404
+    s.error_rate = 1
+    assert s.respond(path)[0] == 500
+    assert s.requests(path) == 6
@@ -0,0 +1,43 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for retry.py"""
+
+import time
+import retry as rt  # pylint: disable=E0401
+
+
+def test_retry_policy_delays():
+    """Test backoff, jitter and deadline of delays"""
+    p = rt.RetryPolicy(tries=4, delay=1, backoff=2, max_delay=5, jitter=0)
+    assert list(p.delays()) == [1, 2, 4, 5]
+    p.jitter = 0.5
+    for d, m in zip(p.delays(), [1, 2, 4, 5]):
+        assert m * 0.5 <= d <= m
+    assert list(p.delays(time.time() + 0.4)) == []
+    p.jitter = 0
+    assert list(p.delays(time.time() + 2.5)) == [1, 2]
+    p.min_attempt = 1
+    assert list(p.delays(time.time() + 2.5)) == [1]
+
+
+def test_circuit_breaker():
+    """Test circuit breaker states"""
+    b = rt.CircuitBreaker(threshold=2, reset_after=0.05)
+    assert b.allow()
+    b.failure()
+    assert b.state == b.CLOSED
+    b.failure()
+    assert b.state == b.OPEN
+    assert not b.allow()
+    time.sleep(0.06)
+    assert b.state == b.HALF_OPEN
+    assert b.allow()
+    assert not b.allow()  # only one trial request
+    b.failure()
+    assert b.state == b.OPEN
+    time.sleep(0.06)
+    assert b.allow()
+    b.success()
+    assert b.state == b.CLOSED
+    assert rt.CircuitBreakers().get('a') is not rt.CircuitBreakers().get('a')
@@ -0,0 +1,71 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for scheduler.py"""
+
+import threading
+import time
+from datetime import datetime
+import scheduler as sc  # pylint: disable=E0401
+
+
+def _run(policy, n=4, interval=0.05, duration=0.12):
+    s = sc.Scheduler()
+    planned = []
+
+    def _f(t):
+        planned.append(t)
+        time.sleep(duration)
+        if len(planned) >= n: s.stop()
+    j = s.add('job', _f, interval=interval, overrun=policy)
+    timer = threading.Timer(2, s.stop)
+    timer.start()
+    s.run()
+    timer.cancel()
+    return j, planned
+
+
+def test_scheduler_overrun_policies():
+    """Test skip, coalesce and catch-up policies"""
+    j, planned = _run(sc.SKIP)
+    assert j.dropped > 0
+    assert all(isinstance(t, datetime) for t in planned)
+    j, planned = _run(sc.CATCH_UP)
+    assert j.dropped == 0
+    # catch-up runs every tick, so planned times are one interval apart
+    d = [(b - a).total_seconds() for a, b in zip(planned, planned[1:])]
+    assert all(abs(i - 0.05) < 0.01 for i in d)
+    assert max(j.lateness) > 0.05
+    j, planned = _run(sc.COALESCE)
+    d = [(b - a).total_seconds() for a, b in zip(planned, planned[1:])]
+    assert all(i > 0.09 for i in d)
+
+
+def test_scheduler_run_once():
+    """Test a job without interval runs once"""
+    s = sc.Scheduler()
+    runs = []
+    j = s.add('once', runs.append)
+    s.run()
+    assert len(runs) == 1 and j.runs == 1
+    assert abs(j.lateness[0]) < 0.5
+
+
+def test_next_time():
+    """Test next_time function"""
+    now = time.mktime((2016, 4, 22, 10, 15, 30, 0, 0, -1))
+    assert sc.next_time('immediate', now) == now
+    assert sc.next_time('00', now) == now + 30
+    assert sc.next_time('45', now) == now + 15
+    assert sc.next_time('15:00', now) == now + 3600 - 30
+    assert sc.monotonic() <= sc.monotonic()
+
+
+def test_get_monotonic(monkeypatch):
+    """Test clock_gettime is only used on linux"""
+    monkeypatch.setattr(sc.sys, 'platform', 'darwin')
+    m = sc._get_monotonic()
+    assert m is sc._time or m is getattr(time, 'monotonic', None)
+    monkeypatch.setattr(sc.sys, 'platform', 'linux2')
+    m = sc._get_monotonic()
+    assert m is not sc._time and m() <= m()
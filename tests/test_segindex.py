@@ -0,0 +1,55 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for segindex.py"""
+
+from datetime import datetime, timedelta
+import numpy as np
+import speedstore as ss  # pylint: disable=E0401
+import segindex as si  # pylint: disable=E0401
+
+
+def test_segment_history(tmpdir):
+    """Test incremental index and segment_history"""
+    s = ss.SpeedStore(str(tmpdir))
+    idx = si.SegmentIndex(s)
+    d0 = datetime(2016, 4, 22, 23, 58)
+    dates = [d0 + timedelta(minutes=i) for i in range(4)]
+    for i, d in enumerate(dates[:2]):
+        s.append(d, [3, 1, 2], [30 + i, 10 + i, 20 + i], [3, 1, 2])
+    assert idx.update('20160422') == 6
+    assert idx.update('20160422') == 0
+    # segment 2 is missing in the third snapshot
+    s.append(dates[2], [1, 3], [12, 32], [1, 3])
+    s.append(dates[3], [2, 1], [23, 13], [2, 1])
+    # query does not update index by default
+    assert len(idx.segment_history(1, dates[0], dates[3])) == 2
+    h = idx.segment_history(1, dates[0], dates[3], update=True)
+    assert list(h['speed']) == [10, 11, 12, 13]
+    assert list(h['date']) == [ss.timestamp(d) for d in dates]
+    assert si.to_datetime(h) == dates
+    h = idx.segment_history(2, dates[1], dates[3])
+    assert list(h['speed']) == [21, 23]
+    assert len(idx.segment_history(9, dates[0], dates[3])) == 0
+    assert idx.update_all() == 0
+
+
+def test_update_merge(tmpdir):
+    """Test merged index equals index built at once"""
+    rnd = np.random.RandomState(1)
+    s = ss.SpeedStore(str(tmpdir))
+    idx = si.SegmentIndex(s)
+    d0 = datetime(2016, 4, 22, 8)
+    for i in range(30):
+        ids = rnd.choice(50, rnd.randint(1, 20), replace=False) + 100 * (
+            i % 3)
+        s.append(d0 + timedelta(minutes=i), ids, ids % 90, ids % 5)
+        if i % 4 == 0: idx.update('20160422')
+    idx.update('20160422')
+    order, segments = idx._read('20160422')
+    d = s.read('20160422')
+    assert list(order) == list(np.argsort(d.id, kind='mergesort'))
+    u, count = np.unique(d.id, return_counts=True)
+    assert list(segments['id']) == list(u)
+    assert list(segments['count']) == list(count)
+    assert list(segments['start']) == list(np.cumsum(count) - count)
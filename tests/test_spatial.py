@@ -0,0 +1,67 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103
+"""Test module for spatial.py"""
+
+import numpy as np
+import geometry as geo  # pylint: disable=E0401
+import spatial as sp  # pylint: disable=E0401
+
+
+def _road(n=300, seed=0):
+    """Random road file text of n segments with 1-4 points."""
+    r = np.random.RandomState(seed)
+    lines = []
+    for s in range(n):
+        lon, lat = 28.7 + r.rand() * 0.6, 40.97 + r.rand() * 0.2
+        for k in range(r.randint(1, 5)):
+            lines.append('{0};{1};{2:.6f};{3:.6f};0;0;0;0;0;0;{4}'.format(
+                s + 1000, k + 1, lon, lat, 'D%d' % (s % 3)))
+            lon += (r.rand() - 0.5) * 0.01
+            lat += (r.rand() - 0.5) * 0.01
+    return '\n'.join(lines)
+
+
+def _linear_nearest(index, lon, lat):
+    d = index.distances(lon, lat, np.arange(len(index.segments)))
+    return int(np.argmin(d)), float(d.min())
+
+
+def test_bbox():
+    """bbox query must match linear scan of bounds"""
+    index = sp.SpatialIndex(geo.parse(_road()))
+    box = (28.9, 41.0, 29.0, 41.1)
+    b = index.bounds
+    expected = np.flatnonzero((b[:, 0] <= box[2]) & (b[:, 2] >= box[0]) &
+                              (b[:, 1] <= box[3]) & (b[:, 3] >= box[1]))
+    assert list(index.bbox(*box)) == list(expected)
+    d = index.bbox(*box, district='D1')
+    assert list(d) == [i for i in expected if index.district[i] == 'D1']
+    assert len(index.bbox(10, 10, 11, 11)) == 0
+    assert len(index.in_district('D2')) == 100
+
+
+def test_nearest():
+    """nearest must match linear scan"""
+    index = sp.SpatialIndex(geo.parse(_road()))
+    r = np.random.RandomState(1)
+    for _ in range(50):
+        lon, lat = 28.6 + r.rand() * 0.8, 40.9 + r.rand() * 0.4
+        i, d = index.nearest(lon, lat)
+        j, e = _linear_nearest(index, lon, lat)
+        assert abs(d - e) < 1e-6
+        assert i == j or abs(index.distances(lon, lat, [j])[0] - d) < 1e-6
+    i, d = index.nearest(29.0, 41.05, district='D0')
+    assert index.district[i] == 'D0'
+    assert index.nearest(10., 10., max_distance=1000) is None
+
+
+def test_distances():
+    """Distance to a polyline is distance to its closest piece"""
+    text = '1;1;29.0;41.0;0;0;0;0;0;0;A\n1;2;29.01;41.0;0;0;0;0;0;0;A\n' \
+           '2;1;29.0;41.01;0;0;0;0;0;0;B'
+    index = sp.SpatialIndex(geo.parse(text))
+    d = index.distances(29.005, 41.001, [0, 1])
+    assert abs(d[0] - 111.195) < 0.5
+    assert index.nearest_segment(29.005, 41.001) == 1
+    assert index.nearest_segment(29.0, 41.0099) == 2
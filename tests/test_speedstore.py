@@ -0,0 +1,30 @@
+#!/usr/bin/python # noqa
+# -*- coding: utf-8 -*-
+# pylint: disable=C0103, W0212
+"""Test module for speedstore.py"""
+
+import os
+from datetime import datetime
+import numpy as np
+import speedstore as ss  # pylint: disable=E0401
+
+
+def test_speed_store(tmpdir):
+    """Test append, read and recovery of a partial append"""
+    s = ss.SpeedStore(str(tmpdir))
+    d1, d2 = datetime(2016, 4, 22, 8, 15), datetime(2016, 4, 22, 8, 16)
+    s.append(d1, [1, 2, 70000], [50, 60, 70], [1, 2, 3])
+    # leftovers of an interrupted append
+    with open(s.path('20160422', 'spd'), 'ab') as f: f.write('xx')
+    s.append(d2, [1, 3], [10, 20], [4, 5])
+    assert s.days() == ['20160422']
+    d = s.read('20160422')
+    assert isinstance(d.speed, np.memmap)
+    assert list(d.index['count']) == [3, 2]
+    assert list(d.id) == [1, 2, 70000, 1, 3]
+    assert list(d.speed) == [50, 60, 70, 10, 20]
+    assert os.path.getsize(s.path('20160422', 'spd')) == 5
+    sn = s.snapshot('20160422', 1)
+    assert sn.date == ss.timestamp(d2)
+    assert list(sn.id) == [1, 3] and list(sn.color) == [4, 5]
+    assert len(s.read('20160423').id) == 0
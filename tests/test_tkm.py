@@ -3,8 +3,9 @@
 # pylint: disable=C0103, W0212
 """Test module for tkm.py"""
 
+import time
 import tkm  # pylint: disable=E0401
-from datetime import datetime
+from datetime import datetime, timedelta
 
 _URL_MAIN = 'http://tkm.ibb.gov.tr'
 _URL_NOT_FOUND = _URL_MAIN + '/notfound.html'
@@ -132,3 +133,340 @@ def test_get_weather_data():
     str_list = 'abcçdefgğhıijklmnoöprsştuüvyz' + \
                'ABCÇDEFGĞHIİJKLMNOÖPRSŞTUÜVYZ 0123456789-:.,&|'
     _get_diff(d, str_list)
+
+
+def test_static_file_conditional_request(monkeypatch, tmpdir):
+    """Test static files are requested conditionally and 304 is a no-op."""
+    import os
+    import urllib
+    from StringIO import StringIO
+    from mimetools import Message
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(static=str(tmpdir)))
+    f = tmpdir.join('r0.ABC0.txt')
+    f.write('data')
+    os.utime(str(f), (1461300000, 1461300000))
+    sent = []
+
+    def _urlopen(url, headers=None, timeout=None):
+        # pylint: disable=W0613
+        sent.append(headers)
+        return urllib.addinfourl(StringIO(''), Message(StringIO('')), url, 304)
+    monkeypatch.setattr(tkm.hp, 'urlopen', _urlopen)
+    monkeypatch.setitem(tkm._raw_e_tags, _URL_STATIC_FILE, '"abc:0"')
+    assert tkm._static_file_download(_URL_STATIC_FILE) is None
+    assert sent[0]['If-Modified-Since'] == 'Fri, 22 Apr 2016 04:40:00 GMT'
+    assert sent[0]['If-None-Match'] == '"abc:0"'
+
+
+def test_metrics(monkeypatch, tmpdir):
+    """Test metrics of download, decrypt, retries and write stages."""
+    import socket
+    import urllib
+    from StringIO import StringIO
+    from mimetools import Message
+    from payloads import encrypt0
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(data=str(tmpdir)))
+    monkeypatch.setattr(tkm, 'METRICS', tkm.mt.Metrics())
+    monkeypatch.setattr(tkm, 'BREAKERS', tkm.rt.CircuitBreakers())
+    monkeypatch.setattr(tkm, 'RETRY', tkm.rt.RetryPolicy(delay=0))
+    monkeypatch.setattr(tkm, '_run_time', datetime(2016, 4, 22, 8, 15))
+    body = encrypt0('42', tkm._INSTANT['traffic_index'][1])
+    calls = []
+
+    def _urlopen(url, headers=None, timeout=None):
+        # pylint: disable=W0613
+        calls.append(url)
+        if len(calls) == 1: raise socket.error('reset')
+        return urllib.addinfourl(StringIO(body), Message(StringIO('')), url,
+                                 200)
+    monkeypatch.setattr(tkm.hp, 'urlopen', _urlopen)
+    tkmd = tkm.get('traffic_index')
+    assert tkmd.data == '42'
+    tkm.save_instant_data(tkmd)
+    m = dict((k, dict((tuple(sorted(v['labels'].items())), v)
+                      for v in d['values']))
+             for k, d in tkm.METRICS.snapshot()['metrics'].items())
+    feed = (('feed', 'TrafficIndex'),)
+    assert m['tkm_retries_total'][feed + (('reason', 'network'),)][
+        'value'] == 1
+    assert m['tkm_request_seconds'][feed]['count'] == 2  # with failed one
+    assert m['tkm_downloaded_bytes_total'][feed]['value'] == len(body)
+    assert m['tkm_decrypt_seconds'][
+        (('feed', 'TrafficIndex'), ('method', 'decrypt0'))]['count'] == 1
+    assert m['tkm_write_seconds'][feed]['count'] == 1
+    assert feed in m['tkm_last_success_timestamp_seconds']
+    assert 'tkm_na_total' not in m or feed not in m['tkm_na_total']
+    tkm.close_files()
+
+
+def test_collect_metrics(monkeypatch):
+    """Test job counts are exported as counters."""
+    monkeypatch.setattr(tkm, 'METRICS', tkm.mt.Metrics())
+    monkeypatch.setattr(tkm, 'BREAKERS', tkm.rt.CircuitBreakers())
+    s = tkm.sc.Scheduler()
+    j = s.add('instant', lambda planned: None)
+    j.runs, j.dropped = 3, 1
+    tkm._collect_metrics(s)(tkm.METRICS)
+    lines = tkm.METRICS.render().splitlines()
+    assert 'tkm_job_runs_total{job="instant"} 3' in lines
+    assert 'tkm_job_dropped_total{job="instant"} 1' in lines
+
+
+def test_circuit_breaker_error_bodies(monkeypatch):
+    """Test circuit breaker opens if a feed keeps returning 'error'."""
+    import urllib
+    from StringIO import StringIO
+    from mimetools import Message
+    from payloads import encrypt0
+    monkeypatch.setattr(tkm, 'METRICS', tkm.mt.Metrics())
+    monkeypatch.setattr(tkm, 'BREAKERS', tkm.rt.CircuitBreakers(threshold=5))
+    monkeypatch.setattr(tkm, 'RETRY', tkm.rt.RetryPolicy(tries=1, delay=0))
+    monkeypatch.setattr(tkm, '_run_time', datetime(2016, 4, 22, 8, 15))
+    bodies = [encrypt0('error', tkm._INSTANT['traffic_index'][1])]
+    calls = []
+
+    def _urlopen(url, headers=None, timeout=None):
+        # pylint: disable=W0613
+        calls.append(url)
+        return urllib.addinfourl(StringIO(bodies[0]), Message(StringIO('')),
+                                 url, 200)
+    monkeypatch.setattr(tkm.hp, 'urlopen', _urlopen)
+    breaker = tkm.BREAKERS.get(tkm.URL.trafficindex)
+    for _ in range(10):
+        assert tkm.get('traffic_index').data == 'NA'
+    assert breaker.state == breaker.OPEN
+    assert len(calls) == 5 * 2  # a retry for each tick until it opens
+    # a valid payload closes it
+    bodies[0] = encrypt0('42', tkm._INSTANT['traffic_index'][1])
+    breaker.reset_after = 0
+    assert tkm.get('traffic_index').data == '42'
+    assert breaker.state == breaker.CLOSED and breaker.failures == 0
+
+
+def test_circuit_breaker_bad_body(monkeypatch):
+    """Test an undecryptable body is a failure of the half-open trial."""
+    import urllib
+    from StringIO import StringIO
+    from mimetools import Message
+    from payloads import encrypt0
+    monkeypatch.setattr(tkm, 'METRICS', tkm.mt.Metrics())
+    monkeypatch.setattr(tkm, 'BREAKERS', tkm.rt.CircuitBreakers(
+        threshold=1, reset_after=0.05))
+    monkeypatch.setattr(tkm, 'RETRY', tkm.rt.RetryPolicy(tries=0))
+    monkeypatch.setattr(tkm, '_run_time', datetime(2016, 4, 22, 8, 15))
+    bodies = ['garbage']
+
+    def _urlopen(url, headers=None, timeout=None):
+        # pylint: disable=W0613
+        return urllib.addinfourl(StringIO(bodies[0]), Message(StringIO('')),
+                                 url, 200)
+    monkeypatch.setattr(tkm.hp, 'urlopen', _urlopen)
+    breaker = tkm.BREAKERS.get(tkm.URL.trafficindex)
+    assert tkm.get('traffic_index').data == 'NA'
+    assert breaker.state == breaker.OPEN
+    time.sleep(0.06)
+    assert breaker.state == breaker.HALF_OPEN
+    assert tkm.get('traffic_index').data == 'NA'  # trial fails
+    assert breaker.state == breaker.OPEN
+    time.sleep(0.06)
+    bodies[0] = encrypt0('42', tkm._INSTANT['traffic_index'][1])
+    assert tkm.get('traffic_index').data == '42'
+    assert breaker.state == breaker.CLOSED
+
+
+def test_get_data_deadline(monkeypatch):
+    """Test attempts and retries of a tick end before its deadline."""
+    import socket
+    monkeypatch.setattr(tkm, 'METRICS', tkm.mt.Metrics())
+    monkeypatch.setattr(tkm, 'BREAKERS', tkm.rt.CircuitBreakers())
+    monkeypatch.setattr(tkm, 'RETRY', tkm.rt.RetryPolicy(
+        tries=10, delay=0.05, backoff=1, jitter=0, min_attempt=0.1))
+    monkeypatch.setattr(tkm, '_run_time', datetime(2016, 4, 22, 8, 15))
+    timeouts = []
+
+    def _urlopen(url, headers=None, timeout=None):
+        # pylint: disable=W0613
+        timeouts.append(timeout)
+        time.sleep(min(timeout, 0.12))  # a slow server
+        raise socket.timeout('timed out')
+    monkeypatch.setattr(tkm.hp, 'urlopen', _urlopen)
+    t = time.time()
+    tkmd = tkm._get_data(tkm.URL.trafficindex,
+                         tkm._INSTANT['traffic_index'][1], deadline=t + 0.5)
+    assert tkmd.data == 'NA'
+    assert time.time() - t < 0.5
+    assert timeouts[0] <= 0.5
+    assert all(a > b for a, b in zip(timeouts, timeouts[1:]))
+    assert all(to >= 0.1 for to in timeouts[1:])  # min_attempt is left
+    n = len(timeouts)
+    assert 1 < n < 5
+    tkmd = tkm._get_data(tkm.URL.trafficindex,
+                         tkm._INSTANT['traffic_index'][1], deadline=t)
+    assert tkmd.data == 'NA'
+    assert len(timeouts) == n  # no request after deadline
+
+
+def test_parse_speed_data():
+    """Test parse_speed_data and parse_speed_lines functions."""
+    tkmd = tkm.TKM_DATA(date=-1, e_tag=None, filename='a.csv',
+                        data='10|50|1&20|60|2&30|70|3')
+    a = tkm.parse_speed_data(tkmd)
+    assert a.filename == 'a.csv'
+    assert a.data.dtype == tkm.SPEED_DTYPE
+    assert list(a.data['id']) == [10, 20, 30]
+    assert list(a.data['speed']) == [50, 60, 70]
+    assert list(a.data['color']) == [1, 2, 3]
+    # tolerant parser
+    b = tkm.parse_speed_data(tkmd._replace(data='10|50|1&&20|60&30||70|3&'))
+    assert list(b.data['id']) == [10, 30]
+    assert list(b.data['color']) == [1, 3]
+    # misaligned records are not parsed by the fast path
+    b = tkm.parse_speed_data(tkmd._replace(data='1|2&3|4|5|6'))
+    assert b.data.tolist() == [(3, 4, 5)]
+    assert len(tkm.parse_speed_data(tkmd._replace(data='NA')).data) == 0
+
+    m = tkm.parse_speed_lines(['2016-04-22 08:15:00;10|50|1&20|60|2\r\n',
+                               '2016-04-22 08:16:00;NA\r\n',
+                               '2016-04-22 08:17:00;30|70|3&10|55|1\r\n'])
+    assert list(m.id) == [10, 20, 30]
+    assert str(m.date[2]) == '2016-04-22T08:17:00'
+    assert m.speed.tolist() == [[50, 60, 255], [255, 255, 255],
+                                [55, 255, 70]]
+    assert m.color[2].tolist() == [1, 255, 3]
+    m = tkm.parse_speed_lines(['2016-04-22 08:15:00;1|2&3|4|5|6\r\n',
+                               '2016-04-22 08:16:00;1|7|1\r\n'])
+    assert list(m.id) == [1, 3]
+    assert m.speed.tolist() == [[255, 4], [7, 255]]
+
+
+def test_compress_files(monkeypatch, tmpdir):
+    """Test compress_files compresses old csv files in parallel."""
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(data=str(tmpdir)))
+    for f in ['a.20160101.csv', 'b.20160101.csv', 'c.' + _E_TAG + '.csv']:
+        tmpdir.join(f).write('2016-01-01 00:00:00;1|2|3\r\n' * 100)
+    tkm.compress_files(2, 'zip')
+    assert sorted(tmpdir.listdir(lambda x: True)) == sorted(
+        [tmpdir.join(f) for f in ['a.20160101.csv.zip', 'b.20160101.csv.zip',
+                                  'c.' + _E_TAG + '.csv']])
+
+
+def test_read_snapshot(monkeypatch, tmpdir):
+    """Test read_snapshot from data files and block archives."""
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(data=str(tmpdir)))
+    f = tmpdir.join('TrafficIndex.20160422.csv')
+    f.write('2016-04-22 08:14:00;7\r\n2016-04-22 08:15:00;8\r\n')
+    d = datetime(2016, 4, 22, 8, 15, 20)
+    a = tkm.read_snapshot('traffic_index', d)
+    assert a.date == datetime(2016, 4, 22, 8, 15)
+    assert a.data == '8'
+    tkm.compress_files(1, 'blk')
+    assert not f.check()
+    assert tkm.read_snapshot('traffic_index', d) == a
+    assert tkm.read_snapshot('traffic_data', d) is None
+
+
+def test_save_instant_data(monkeypatch, tmpdir):
+    """Saved data is buffered and visible to readers."""
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(data=str(tmpdir)))
+    monkeypatch.setattr(tkm, '_appenders', None)
+    monkeypatch.setattr(tkm, 'FLUSH_INTERVAL', 3600)
+    d = datetime(2016, 4, 22, 8, 15)
+    f = tmpdir.join('TrafficIndex.20160422.csv')
+    for i in range(3):
+        tkm.save_instant_data(tkm.TKM_DATA(
+            date=d.replace(minute=i), e_tag=None, filename=f.basename,
+            data=str(i)))
+    assert not f.check()
+    assert tkm.read_snapshot('traffic_index', d).data == '2'
+    tkm.save_instant_data(tkm.TKM_DATA(
+        date=d.replace(day=23), e_tag=None,
+        filename='TrafficIndex.20160423.csv', data='3'))
+    assert f.read() == ''.join('2016-04-22 08:%02d:00;%d\r\n' % (i, i)
+                               for i in range(3))
+    tkm.close_files()
+    assert tmpdir.join('TrafficIndex.20160423.csv').check()
+
+
+def test_save_instant_data_dedup(monkeypatch, tmpdir):
+    """Unchanged snapshots are saved as '=' and read as full data."""
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(data=str(tmpdir)))
+    monkeypatch.setattr(tkm, '_appenders', None)
+    monkeypatch.setattr(tkm, '_dedup_encoders', {})
+    monkeypatch.setattr(tkm, 'METRICS', tkm.mt.Metrics())
+    monkeypatch.setattr(tkm, 'DEDUP', True)
+    d = datetime(2016, 4, 22, 8, 15)
+    f = tmpdir.join('TrafficIndex.20160422.csv')
+    for i, v in enumerate(['5', '5', '5', '6', 'NA', 'NA', '6']):
+        tkm.save_instant_data(tkm.TKM_DATA(
+            date=d.replace(minute=i), e_tag=None, filename=f.basename,
+            data=v))
+    tkm.close_files()
+    assert [l.split(';')[1] for l in f.read().split('\r\n')[:-1]] == [
+        '5', '=', '=', '6', 'NA', 'NA', '6']
+    assert tkm.read_snapshot('traffic_index', d.replace(minute=2)).data == '5'
+    assert tkm.METRICS.snapshot()['metrics']['tkm_dedup_total'][
+        'values'][0]['value'] == 2
+
+
+def test_save_instant_data_aggregate(monkeypatch, tmpdir):
+    """Traffic data updates per-segment aggregates."""
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(data=str(tmpdir)))
+    monkeypatch.setattr(tkm, '_appenders', None)
+    monkeypatch.setattr(tkm, '_aggregator', None)
+    monkeypatch.setattr(tkm, 'AGGREGATE_WINDOWS', ())
+    monkeypatch.setattr(tkm, 'METRICS', tkm.mt.Metrics())
+    tkm.configure(aggregate=[900])
+    d = datetime(2016, 4, 22, 8, 10)
+    for i, v in enumerate(['1|10|1&2|20|5', 'NA', '1|30|1', '1|50|2']):
+        tkm.save_instant_data(tkm.TKM_DATA(
+            date=d + timedelta(minutes=3 * i), e_tag=None,
+            filename='TrafficDataNew.20160422.csv', data=v))
+    tkm.close_files()
+    h = tkm.segment_aggregates(1, 900, d, d.replace(hour=9))
+    assert list(h['count']) == [1, 2]  # NA is skipped
+    assert list(tkm.ag.mean_speed(h)) == [10.0, 40.0]
+    h = tkm.segment_aggregates(2, 900, d, d.replace(hour=9))
+    assert list(tkm.ag.congestion_share(h)) == [1.0]
+    tkm.configure(aggregate=[])
+    assert tkm._aggregator is None
+
+
+def test_read_speed_matrix(monkeypatch, tmpdir):
+    """Test reading a day of traffic data as a speed matrix."""
+    monkeypatch.setattr(tkm, 'DIR', tkm.DIR._replace(data=str(tmpdir)))
+    d = datetime(2016, 4, 22)
+    assert tkm.read_speed_matrix(d) is None
+    tmpdir.join('TrafficDataNew.20160422.csv').write(
+        '2016-04-22 08:14:00;1|10|1&2|20|2\r\n'
+        '2016-04-22 08:15:00;+2|30|3\r\n')
+    m = tkm.read_speed_matrix(d)
+    assert m.color.tolist() == [[1, 2], [1, 3]]
+    tkm.compress_files(1, 'blk')
+    a = tkm.read_speed_matrix(d)
+    assert a.speed.tolist() == m.speed.tolist()
+    assert list(a.date) == list(m.date)
+
+
+def test_import(tmpdir):
+    """Test importing tkm is fast and has no side effects.
+
+    Heavy modules are not imported, directories and log file are not
+    created. Import time is the best of 3 runs in a fresh interpreter.
+    """
+    import os
+    import subprocess
+    import sys
+    budget = 0.1  # seconds
+    code = ('import os, sys, time; sys.path.insert(0, %r); '
+            'os.makedirs = None; t = time.time(); import tkm; '
+            'print time.time() - t; '
+            'print [m for m in %r if m in sys.modules]') % (
+                os.path.dirname(os.path.abspath(tkm.__file__)),
+                ['numpy', 'pylzma', 'tkmdecrypt', 'compression', 'archive',
+                 'speedstore', 'scheduler', 'httppool'])
+    runs = [subprocess.check_output([sys.executable, '-c', code],
+                                    cwd=str(tmpdir)).split('\n')
+            for _ in range(3)]
+    assert [r[1] for r in runs] == ['[]'] * 3
+    assert min(float(r[0]) for r in runs) < budget
+    assert tmpdir.listdir() == []
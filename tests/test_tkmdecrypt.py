@@ -5,6 +5,7 @@
 
 import os
 import tkmdecrypt as td  # pylint: disable=E0401
+import payloads  # pylint: disable=E0401
 
 _encrypted_traffic_index_data = 'AF199176AE2FC5028302F355B0478735825B0302A' + \
   '274B755277DA566CD6FE6661066C57506660566CC599573A3533645FB5813077D0A1433' + \
@@ -59,3 +60,40 @@ def test_decrypt2(benchmark):
 def test_decrypt2_old(benchmark):
     """Big data benchmark test for decrypt2 function"""
     benchmark(td.decrypt2_old, _enc_data)
+
+
+def test_tkmdecrypt_decrypt0_and_old_0():
+    """Test decrypt0 function against reference implementation"""
+    text = payloads.speed_data() + u' çğıöşüÇĞİÖŞÜ\n'.encode('utf-8')
+    for option in range(3):
+        enc = payloads.encrypt0(text, "62403715", option)
+        a = td.decrypt0(enc, "62403715")
+        assert a == td.decrypt0_old(enc, "62403715")
+        assert a == text
+    assert td.decrypt0(payloads.encrypt0('', "62403715"), "62403715") == ''
+
+
+def test_decrypt0(benchmark):
+    """Big data benchmark test for decrypt0 function"""
+    enc = payloads.encrypt0(payloads.speed_data(), "62403715")
+    benchmark(td.decrypt0, enc, "62403715")
+
+
+def test_decrypt0_old(benchmark):
+    """Big data benchmark test for decrypt0_old function"""
+    enc = payloads.encrypt0(payloads.speed_data(), "62403715")
+    benchmark(td.decrypt0_old, enc, "62403715")
+
+
+def test_tkmdecrypt_decrypt2_into():
+    """Test decrypt2_into function"""
+    a = td.decrypt2(_enc_data)
+    n = td.decrypt2_length(_enc_data)
+    assert n == len(a)
+    out = bytearray(n + 10)
+    assert td.decrypt2_into(memoryview(bytearray(_enc_data)), out) == n
+    assert bytes(out[:n]) == a
+    out = bytearray(n)
+    assert td.decrypt2_into(bytearray(_enc_data), memoryview(out)) == n
+    assert bytes(out) == a
+    assert td.decrypt2('') == ''
@@ -3,38 +3,125 @@
 # pylint: disable=C0103, C0321, C0330
 """This script downloads traffic data from tkm.ibb.gov.tr"""
 
-import argparse
+import atexit
 import signal
 import logging as log
 import os
+import socket
 from os import path
 from os.path import join as joinp
-import re
 import threading
 import time
-import urllib2 as ul
 from collections import namedtuple as nt
 
 from datetime import datetime as dt
-import datetime
 from dateutil import tz
 
-import tkmdecrypt as td
-import compression as c
+import retry as rt
+import delta as de
+import appender as ap
+import metrics as mt
+from lazy import LazyModule
+
+# heavy modules are imported on first use to start fast (See lazy.py)
+np = LazyModule('numpy')
+td = LazyModule('tkmdecrypt')
+c = LazyModule('compression')
+hp = LazyModule('httppool')
+sc = LazyModule('scheduler')
+ss = LazyModule('speedstore')
+si = LazyModule('segindex')
+ar = LazyModule('archive')
+ag = LazyModule('aggregate')
+geo = LazyModule('geometry')
+sp = LazyModule('spatial')
 
 # region initial definitions
 
-log.basicConfig(format='%(asctime)s %(levelname)s %(name)s %(message)s',
-                filename='tkm.log', level=log.INFO)
 logger = log.getLogger(__name__)
-logger.root.name = 'tkm.py'
 
 SENSOR_DATA = nt('SensorData', 'id speed color')
 TKM_DATA = nt('TkmData', 'date e_tag filename data')
+SPEED_MATRIX = nt('SpeedMatrix', 'date id speed color')
+# numpy dtype of speed data. It is a list of fields, so numpy is not
+# imported to define it.
+SPEED_DTYPE = [('id', '<u4'), ('speed', 'u1'), ('color', 'u1')]
+# speed and color of a segment missing in a snapshot
+MISSING = 255
+
+# Retry policy of requests and circuit breakers of each url
+RETRY = rt.RetryPolicy(tries=5, delay=0.5, backoff=2.0, max_delay=8.0,
+                       jitter=0.5, min_attempt=1.0)
+BREAKERS = rt.CircuitBreakers(threshold=5, reset_after=300.0)
+# Seconds an instant data download may take including retries (0: no limit)
+TICK_BUDGET = 0
+# Store traffic data also in columnar binary form (See speedstore.py)
+COLUMNAR = False
+# Store traffic data delta encoded with a keyframe every DELTA_KEYFRAME
+# snapshots (0: disabled, See delta.py)
+DELTA_KEYFRAME = 0
+# Store a snapshot equal to the previous one of its feed as '=' (See delta.py)
+DEDUP = False
+# Keep per-segment aggregates of traffic data for windows of these lengths
+# in seconds (empty: disabled, See aggregate.py)
+AGGREGATE_WINDOWS = ()
+# File type of compressed data files: 7z | zip | xz | blk (See archive.py)
+COMPRESS_TYPE = '7z'
+# Data files are flushed every FLUSH_INTERVAL seconds or when FLUSH_BYTES
+# bytes are buffered (See appender.py)
+FLUSH_INTERVAL = 300
+FLUSH_BYTES = 1 << 20
+# Metrics of each feed (See metrics.py). They are served in Prometheus text
+# format on METRICS_PORT (0: disabled) and dumped to METRICS_JSON file
+# every METRICS_INTERVAL seconds (None: disabled).
+METRICS = mt.Metrics()
+METRICS_PORT = 0
+METRICS_JSON = None
+METRICS_INTERVAL = 60
+for _m in [
+        ('tkm_request_seconds', mt.HISTOGRAM, 'Latency of HTTP requests'),
+        ('tkm_request_failures_total', mt.COUNTER,
+         'HTTP requests failed after retries'),
+        ('tkm_retries_total', mt.COUNTER, 'Retried requests by reason'),
+        ('tkm_downloaded_bytes_total', mt.COUNTER, 'Bytes downloaded'),
+        ('tkm_decrypt_seconds', mt.HISTOGRAM, 'Decryption time'),
+        ('tkm_parse_seconds', mt.HISTOGRAM, 'Parse time of data'),
+        ('tkm_write_seconds', mt.HISTOGRAM, 'Time to save instant data'),
+        ('tkm_na_total', mt.COUNTER, 'Snapshots saved as NA'),
+        ('tkm_dedup_total', mt.COUNTER,
+         'Snapshots saved as same as previous'),
+        ('tkm_last_success_timestamp_seconds', mt.GAUGE,
+         'Time of last successful download'),
+        ('tkm_tick_lateness_seconds', mt.HISTOGRAM,
+         'Delay of job runs from their planned time'),
+        ('tkm_job_runs_total', mt.COUNTER, 'Number of job runs'),
+        ('tkm_job_dropped_total', mt.COUNTER, 'Number of skipped job ticks'),
+        ('tkm_circuit_open', mt.GAUGE, '1 if circuit breaker is not closed')]:
+    METRICS.describe(*_m)
+
+# Base url of web site (See set_base_url())
+BASE_URL = 'http://tkm.ibb.gov.tr/'
+
+# instant data type -> (URL field, key)
+_INSTANT = {'traffic_data': ('trafficdata', "62403715"),
+            'traffic_index': ('trafficindex', "60413275"),
+            'parking_data': ('parkingdata', "74205136"),
+            'announcements': ('announcements', "50614732"),
+            'weather_data': ('weatherdata', "26107354")}
 
-_stop_events = []
-_terminate = False
 _run_time = -1
+_executor = None
+_executor_lock = threading.Lock()
+_speed_store = None
+_aggregator = None
+_segment_index = None
+_delta_encoder = None
+_dedup_encoders = {}  # feed -> de.DedupEncoder
+_appenders = None
+# directories created in this session (See _mkdir())
+_made_dirs = set()
+# url -> raw ETag header of static files seen in this session
+_raw_e_tags = {}
 # _file_pid = ""
 
 
@@ -43,11 +130,14 @@ def __init__():
         cdir = os.path.dirname(os.path.realpath(__file__))
     else:
         cdir = os.getcwd()
+    # directories are created on first use by _mkdir()
     _dir = nt('DirObject', 'cur data static')(
         *[joinp(cdir, d) for d in ['', 'database/', 'static_files/']])
-    # pylint: disable=W0106
-    [os.makedirs(p) for p in _dir if not path.exists(p)]
-    main_url = 'http://tkm.ibb.gov.tr/'
+    return _urls(BASE_URL), _dir
+
+
+def _urls(main_url):
+    """Create list of URLs of a web site."""
     # File Names for static files
     fl_road = ['r{0:d}.txt'.format(x) for x in range(5)]
     fl_other = ['d{0:02d}.txt'.format(x) for x in range(1, 10)]
@@ -66,7 +156,7 @@ def __init__():
                 'WeatherData']]]) +
             ([joinp(main_url, static_files_url, fn) for fn in fl_road],
              [joinp(main_url, static_files_url, fn) for fn in fl_other])))
-    return _url, _dir
+    return _url
 
 
 URL, DIR = __init__()
@@ -77,6 +167,20 @@ URL, DIR = __init__()
 # region private functions
 
 
+def _mkdir(d):
+    """Create directory d if it does not exist.
+
+    It is checked once per session, so it is cheap to call on each use.
+
+    :param d: Full path to directory
+    :return: d
+    """
+    if d not in _made_dirs:
+        if not path.exists(d): os.makedirs(d)
+        _made_dirs.add(d)
+    return d
+
+
 def _now():
     """
     Return current DateTime in Local Time Zone.
@@ -86,6 +190,11 @@ def _now():
     return dt.now().replace(tzinfo=tz.tzlocal())
 
 
+def _feed(f):
+    """Feed name of a url or file name ('TrafficDataNew')"""
+    return path.basename(f).split('.')[0]
+
+
 def _add_e_tag(f, e_tag):
     return '{0}.{2}{1}'.format(*(path.splitext(f) + (e_tag,)))
 
@@ -115,8 +224,9 @@ def _static_file_write(tkmd):
     :type tkmd: TKM_DATA
     :rtype: None
     """
-    _write_to_file(joinp(DIR.static, tkmd.filename),
-                   tkmd.data, tkmd.date)
+    f = joinp(_mkdir(DIR.static), tkmd.filename)
+    _write_to_file(f, tkmd.data, tkmd.date)
+    if tkmd.filename.startswith('r'): geo.invalidate(f)
 
 
 def _static_file_read(fl):
@@ -137,28 +247,109 @@ def _static_file_get_modified_time(f):
     return None
 
 
-def _urlopen(url, k=0):
+def _static_file_find_local(url):
+    """Find the latest local copy of a static file.
+
+    :param url: url of remote file
+    :return: (filename, e_tag, local_last_modified) or None
+    :rtype: tuple
+    """
+    stem, ext = path.splitext(path.basename(url))
+    fl = [f for f in os.listdir(_mkdir(DIR.static))
+          if f.startswith(stem + '.') and f.endswith(ext) and
+          f != stem + ext]
+    if not fl: return None
+    f = max(fl, key=lambda x: path.getmtime(joinp(DIR.static, x)))
+    return (f, f[len(stem) + 1:len(f) - len(ext)],
+            _static_file_get_modified_time(f))
+
+
+def _conditional_headers(url):
+    """Create conditional request headers for a static file.
+
+    If-Modified-Since is created from modification time of local file which
+    is set to Last-Modified of remote file. If-None-Match is only sent if
+    raw ETag of the same file was seen in this session because e_tag in the
+    filename is not reversible.
+
+    :param url: url of remote file
+    :rtype: dict
+    """
+    from email.utils import formatdate
+    headers = {}
+    local = _static_file_find_local(url)
+    if local:
+        f, e_tag, _ = local
+        headers['If-Modified-Since'] = formatdate(
+            path.getmtime(joinp(DIR.static, f)), usegmt=True)
+        raw = _raw_e_tags.get(url)
+        if raw and _normalize_e_tag(raw) == e_tag:
+            headers['If-None-Match'] = raw
+    return headers
+
+
+def _normalize_e_tag(e_tag):
+    """Make e_tag filename friendly."""
+    return e_tag.replace('"', '').replace(':', '').upper()
+
+
+def _retryable(e):
+    """Return True if a failed request should be retried.
+
+    Client errors other than timeout and rate limit are not retried.
+    :rtype: bool
+    """
+    code = getattr(e, 'code', None)
+    return not isinstance(code, int) or code >= 500 or code in (408, 429)
+
+
+def _urlopen(url, headers=None, deadline=None):
     """Send a request to url.
 
+    Failed requests are retried by RETRY policy until deadline. Socket
+    timeout of each attempt ends at deadline. If circuit breaker of url is
+    open, request is not sent at all and url_handle is None. A 200 response
+    is a success of the circuit breaker only after its payload is checked
+    (See _get_data).
+
     :param url: Url to open
-    :param k: Only for internal use
-    :return: (url_handle, local_last_modified, e_tag)
+    :param headers: Extra request headers such as conditional headers
+    :param deadline: time.time() value retries must end before
+    :return: (url_handle, local_last_modified, e_tag). If server returns
+             304 (Not Modified), local_last_modified and e_tag are None.
     :rtype: tuple
     """
-    from socket import error as SocketError
-    import errno
-
     file_with_e_tag = path.basename(url)
-    try:
-        url_handle = ul.urlopen(ul.Request(url))
-    # pylint: disable=W0703
-    except Exception as e:
-        if k < 5:
-            k += 1
-            return _urlopen(url, k)
-        else:
-            url_handle = None
-            log.error('%s -> %s STOPPED. saved as NA', file_with_e_tag, str(e))
+    feed = _feed(url)
+    url_handle = None
+    breaker = BREAKERS.get(url)
+    if breaker.allow():
+        delays = RETRY.delays(deadline)
+        while True:
+            timeout = None if deadline is None else deadline - time.time()
+            try:
+                if timeout is not None and timeout <= 0:
+                    raise socket.timeout('tick budget is exceeded')
+                with METRICS.timer('tkm_request_seconds', feed=feed):
+                    url_handle = hp.urlopen(url, headers, timeout)
+                if url_handle.code == 304: breaker.success()
+                break
+            # pylint: disable=W0703
+            except Exception as e:
+                d = next(delays, None) if _retryable(e) else None
+                if d is None:
+                    breaker.failure()
+                    METRICS.inc('tkm_request_failures_total', feed=feed)
+                    log.error('%s -> %s STOPPED. saved as NA',
+                              file_with_e_tag, str(e))
+                    break
+                METRICS.inc('tkm_retries_total', feed=feed,
+                            reason='network')
+                time.sleep(d)
+    else:
+        log.warning('%s -> circuit is open. saved as NA', file_with_e_tag)
+    if url_handle and url_handle.code == 304:
+        return url_handle, None, None, file_with_e_tag
     if url_handle:
         h = url_handle.info()
         # this value changes if file at url is modified
@@ -166,8 +357,8 @@ def _urlopen(url, k=0):
     else:
         h = e_tag = None
     if e_tag:
-        e_tag = e_tag.replace('"', '')  # WTF?
-        e_tag = e_tag.replace(':', '').upper()  # make e_tag filename friendly
+        _raw_e_tags[url] = e_tag
+        e_tag = _normalize_e_tag(e_tag)
         local_last_modified = dt.fromtimestamp(
             time.mktime(
                 time.strptime(
@@ -202,51 +393,77 @@ def _static_file_compare_last_modified(url):
     :type url: str or tuple
     :rtype: tuple
     """
-    ret = _urlopen(url)
+    ret = _urlopen(url, headers=_conditional_headers(url))
+    if ret[0] and ret[0].code == 304: return None
     f, _ = _get_filename_with_e_tag(url, ret[2])
     last_modified = ret[1]
-    if last_modified == _static_file_get_modified_time(f): return None
+    if last_modified == _static_file_get_modified_time(f):
+        BREAKERS.get(url).success()
+        return None
     return ret
 
 
-def _get_data(url, key=None, decrypt=True):
+def _get_data(url, key=None, decrypt=True, deadline=None):
     """Download/Get and decrypts data from tkm web site.
 
+    If server returns 'error' or 'no_data', request is retried by RETRY
+    policy until deadline. Result of a url is recorded by its circuit
+    breaker.
+
     :param url: Full url to data or a tuple from _urlopen()
     :param key: Encryption key
+    :param deadline: time.time() value retries must end before
     :return: TKM_DATA object
     :type url: str or tuple
     :type key: str
     :rtype: TKM_DATA
     """
-    def _get_data_internal(_url, _key, k=0):
-        url_handle, _last_modified, _e_tag, _f_e_tag = _url \
-            if isinstance(_url, tuple) else _urlopen(_url)
-
-        if not _e_tag:
-            _last_modified = _run_time
-
-        if url_handle:
-            _data = url_handle.read()
+    delays = RETRY.delays(deadline)
+    while True:
+        url_handle, last_modified, e_tag, f_e_tag = url \
+            if isinstance(url, tuple) else _urlopen(url, deadline=deadline)
+
+        if not e_tag:
+            last_modified = _run_time
+
+        feed = _feed(f_e_tag)
+        if not url_handle:
+            data = 'NA'
+            break
+        try:
+            data = url_handle.read()
+            METRICS.inc('tkm_downloaded_bytes_total', len(data), feed=feed)
             if decrypt:
-                _data = td.decrypt0(_data, _key) \
-                    if _key else td.decrypt2(_data)
-
-            if _data == 'error' or _data == 'no_data':
-                if k < 5:
-                    k += 1
-                    (_data, _e_tag, _f_e_tag, _last_modified,
-                     k) = _get_data_internal(_url, _key, k)
-                else:
-                    e = "%s returned '%s'. saved as NA"
-                    log.error(e, path.basename(_url), _data)
-                    _data = 'NA'
-        else:
-            _data = 'NA'
-
-        return _data, _e_tag, _f_e_tag, _last_modified, k
-
-    (data, e_tag, f_e_tag, last_modified, _) = _get_data_internal(url, key)
+                method = 'decrypt0' if key else 'decrypt2'
+                with METRICS.timer('tkm_decrypt_seconds', feed=feed,
+                                   method=method):
+                    data = td.decrypt0(data, key) if key else \
+                        td.decrypt2(data)
+        # pylint: disable=W0703
+        except Exception as e:  # such as a truncated or garbage body
+            if not isinstance(url, tuple): BREAKERS.get(url).failure()
+            log.error('%s -> %s. saved as NA', f_e_tag, str(e))
+            data = 'NA'
+            break
+        if data != 'error' and data != 'no_data':
+            if not isinstance(url, tuple): BREAKERS.get(url).success()
+            break
+        # a tuple is an already read response, it cannot be retried.
+        d = None if isinstance(url, tuple) else next(delays, None)
+        if d is None:
+            if not isinstance(url, tuple): BREAKERS.get(url).failure()
+            e = "%s returned '%s'. saved as NA"
+            log.error(e, f_e_tag, data)
+            data = 'NA'
+            break
+        METRICS.inc('tkm_retries_total', feed=feed, reason=data)
+        time.sleep(d)
+
+    if data == 'NA':
+        METRICS.inc('tkm_na_total', feed=feed)
+    else:
+        METRICS.set('tkm_last_success_timestamp_seconds', time.time(),
+                    feed=feed)
     data = data.replace(';', '|').replace('|&', '&')
     if len(data) > 0:
         if data[len(data) - 1] == '&': data = data[:len(data) - 1]
@@ -268,7 +485,14 @@ def _get_static_file_data_if_modified(url):
     ret = _static_file_compare_last_modified(url)
     if ret:  # if modified
         tkmd = _get_data(ret)
-        if tkmd.data != _static_file_read(ret[3]): return tkmd
+        # a failed request is already recorded by _urlopen()
+        if tkmd.data != 'NA':
+            BREAKERS.get(url).success()
+        elif ret[0]:
+            BREAKERS.get(url).failure()
+        if not path.exists(joinp(DIR.static, ret[3])) or \
+                tkmd.data != _static_file_read(ret[3]):
+            return tkmd
     return None
 
 
@@ -292,6 +516,33 @@ def _static_file_download(url):
 # region public functions
 
 
+def setup_logging(filename='tkm.log', level=log.INFO):
+    """Log to a file.
+
+    It is called by main(). Modules using tkm.py as a library configure
+    logging themselves.
+
+    :param filename: Log file
+    :param level: Log level
+    """
+    log.basicConfig(format='%(asctime)s %(levelname)s %(name)s %(message)s',
+                    filename=filename, level=level)
+    logger.root.name = 'tkm.py'
+
+
+def set_base_url(url):
+    """Set base url of web site.
+
+    Used to collect data from a local replay server (See replay.py).
+
+    :param url: Base url such as 'http://127.0.0.1:8080/'
+    :type url: str
+    """
+    global URL, BASE_URL  # pylint: disable=W0603
+    BASE_URL = url.rstrip('/') + '/'
+    URL = _urls(BASE_URL)
+
+
 def get(t):
     """ Get data by type
 
@@ -299,20 +550,12 @@ def get(t):
                       'parking_data', 'announcements', 'weather_data']
     :return: TKM_DATA object
     """
-    if t not in ['traffic_data', 'traffic_index',
-                 'parking_data', 'announcements', 'weather_data']:
+    if t not in _INSTANT:
         raise ValueError('get_data(t) -> t is not proper option')
     try:
-        if t == "traffic_data":
-            return _get_data(URL.trafficdata, "62403715")
-        elif t == "traffic_index":
-            return _get_data(URL.trafficindex, "60413275")
-        elif t == "parking_data":
-            return _get_data(URL.parkingdata, "74205136")
-        elif t == "announcements":
-            return _get_data(URL.announcements, "50614732")
-        elif t == "weather_data":
-            return _get_data(URL.weatherdata, "26107354")
+        url, key = _INSTANT[t]
+        deadline = time.time() + TICK_BUDGET if TICK_BUDGET > 0 else None
+        return _get_data(getattr(URL, url), key, deadline=deadline)
     except Exception as e:  # pylint: disable=W0703
         err = t + '-> ' + str(e)
         log.error(err)
@@ -321,6 +564,29 @@ def get(t):
     return None
 
 
+def get_many(types=None):
+    """Get data of several types concurrently.
+
+    Requests are issued at the same time over pooled keep-alive connections,
+    so returned snapshots are closely aligned in time.
+
+    :param types: list of data types (See get()). Default is all types.
+    :type types: list
+    :return: list of TKM_DATA objects in the same order of types
+    :rtype: list
+    """
+    global _executor  # pylint: disable=W0603
+    types = sorted(_INSTANT) if types is None else list(types)
+    for t in types:
+        if t not in _INSTANT:
+            raise ValueError('get_many(types) -> %s is not proper option' % t)
+    with _executor_lock:
+        if _executor is None:
+            from multiprocessing.pool import ThreadPool
+            _executor = ThreadPool(len(_INSTANT))
+    return _executor.map(get, types)
+
+
 def get_traffic_index():
     """Download Traffic Index.
 
@@ -366,13 +632,14 @@ def get_weather_data():
     return get("weather_data")
 
 
-def download_static_files(url_list=URL.road + URL.other):
+def download_static_files(url_list=None):
     """Download Static Files.
 
     :type url_list: list
-    :param url_list: List of URL
+    :param url_list: List of URL. Default is all static files.
     :rtype: None
     """
+    if url_list is None: url_list = URL.road + URL.other
     if isinstance(url_list, str): url_list = [url_list]
     for u in url_list: _static_file_download(u)
     if '_logged' not in globals():  # log once per session
@@ -388,6 +655,29 @@ def download_roads():
     download_static_files(URL.road)
 
 
+def road_geometry(i):
+    """Parsed geometry of local road file r<i>.txt (See geometry.py).
+
+    :param i: Road file number (0-4)
+    :type i: int
+    :return: GEOMETRY object or None if road file is not downloaded
+    :rtype: geo.GEOMETRY
+    """
+    local = _static_file_find_local(URL.road[i])
+    return geo.load(joinp(DIR.static, local[0])) if local else None
+
+
+def road_index(i, cell_size=0.005):
+    """Spatial index of local road file r<i>.txt (See spatial.py).
+
+    :param i: Road file number (0-4)
+    :param cell_size: Size of a grid cell in degrees
+    :rtype: sp.SpatialIndex
+    """
+    g = road_geometry(i)
+    return None if g is None else sp.SpatialIndex(g, cell_size)
+
+
 def file_is_modified(url):
     """Check if a remote file was modified or not.
 
@@ -417,22 +707,100 @@ def roads_are_modified():
     return [file_is_modified(u) for u in URL.road]
 
 
+def _is_aligned(data):
+    """Return True if every record of speed data has 3 fields.
+
+    Separators of records must be '|', '|', '&' repeated.
+
+    :param data: Speed data as 'id|speed|color&id|speed|color...'
+    :rtype: bool
+    """
+    b = np.frombuffer(data, dtype=np.uint8)
+    s = b[(b == ord('|')) | (b == ord('&'))]
+    return len(s) % 3 == 2 and (s[2::3] == ord('&')).all() and \
+        (s[0::3] == ord('|')).all() and (s[1::3] == ord('|')).all()
+
+
+def _parse_speed(data):
+    """Parse speed data text to a SPEED_DTYPE array.
+
+    Whole text is converted at once by NumPy. Text which does not have
+    exactly 3 numbers per record falls back to a tolerant parser which
+    skips empty and short records.
+
+    :param data: Speed data as 'id|speed|color&id|speed|color...'
+    :type data: str
+    :rtype: np.ndarray
+    """
+    if not data or data == 'NA': return np.zeros(0, dtype=SPEED_DTYPE)
+    v = np.fromstring(data.replace('&', '|'), dtype=np.int64, sep='|')
+    if len(v) != 3 * (data.count('&') + 1) or not _is_aligned(data):
+        v = [[int(x) for x in t[:3]] for t in
+             ([x for x in l.split('|') if x.strip()]
+              for l in data.split('&') if l.strip()) if len(t) >= 3]
+        v = np.array(v, dtype=np.int64)
+    v = v.reshape(-1, 3)
+    a = np.empty(len(v), dtype=SPEED_DTYPE)
+    a['id'], a['speed'], a['color'] = v[:, 0], v[:, 1], v[:, 2]
+    return a
+
+
 def parse_speed_data(tkmd):
-    """Parse speed data and store the result in a hierarchical list object.
+    """Parse speed data to a NumPy structured array.
 
     :param tkmd: TKM_DATA object
-    :return: TKM_DATA
+    :return: TKM_DATA object whose data is an array of SPEED_DTYPE
+    :rtype: TKM_DATA
+    """
+    return tkmd._replace(data=_parse_speed(tkmd.data))
+
+
+def parse_speed_lines(lines):
+    """Parse archived speed data lines into 2-D arrays.
+
+    Lines are in the form of saved data files ('date;id|speed|color&...').
+    Delta encoded lines are expanded. A segment missing in a line has
+    MISSING speed and color.
+
+    :param lines: Iterable of lines such as a file object
+    :return: SPEED_MATRIX of date (n,), id (m,), speed (n, m) and
+             color (n, m)
+    :rtype: SPEED_MATRIX
     """
-    data = list()
-    # Split tkm.data by & (remove empty elements)
-    for l in [x for x in tkmd.data.split('&') if not re.match(r'^\s*$', x)]:
-        # split segment value by '|' (remove empty elements)
-        token = [x for x in l.split('|') if not re.match(r'^\s*$', x)]
-        if token == '' or len(token) < 3: continue
-        s = SENSOR_DATA(id=int(token[0]), speed=int(token[1]),
-                        color=int(token[2]))
-        data.append(s)
-    return TKM_DATA(date=tkmd.date, data=data)
+    dates, data = [], []
+    for l in de.expand(lines):
+        d, _, t = l.partition(';')
+        if not d: continue
+        dates.append(d)
+        data.append('' if t == 'NA' else t)
+    # parse all lines by a single call if each record has 3 numbers
+    counts = [t.count('&') + 1 if t else 0 for t in data]
+    t = '&'.join(t for t in data if t)
+    v = np.fromstring(t.replace('&', '|'), dtype=np.int64, sep='|') \
+        if t else np.zeros(0)
+    if len(v) == 3 * sum(counts) and (not t or _is_aligned(t)):
+        v = v.reshape(-1, 3)
+        a = np.empty(len(v), dtype=SPEED_DTYPE)
+        a['id'], a['speed'], a['color'] = v[:, 0], v[:, 1], v[:, 2]
+        v = a
+    else:
+        arrays = [_parse_speed(t) for t in data]
+        counts = [len(a) for a in arrays]
+        v = np.concatenate(arrays) if arrays else \
+            np.zeros(0, dtype=SPEED_DTYPE)
+    # segment ids are small integers, so map them by a dense lookup table
+    # instead of sorting.
+    lut = np.zeros(int(v['id'].max()) + 1 if len(v) else 0, dtype=np.int64)
+    lut[v['id']] = 1
+    ids = np.flatnonzero(lut).astype(v.dtype['id'])
+    lut[ids] = np.arange(len(ids))
+    col = lut[v['id']]
+    row = np.repeat(np.arange(len(data)), counts)
+    speed, color = [np.full((len(data), len(ids)), MISSING, dtype=np.uint8)
+                    for _ in range(2)]
+    speed[row, col], color[row, col] = v['speed'], v['color']
+    return SPEED_MATRIX(date=np.array(dates, dtype='datetime64[s]'),
+                        id=ids, speed=speed, color=color)
 
 
 def save_instant_data(tkmd):
@@ -442,29 +810,282 @@ def save_instant_data(tkmd):
     :param tkmd:
     :rtype: None
     """
-    f = joinp(DIR.data, tkmd.filename)
-    data = tkmd.date.strftime("%Y-%m-%d %H:%M:%S") + ';' + tkmd.data + '\r\n'
-    _write_to_file(f, data, tkmd.date)
+    with METRICS.timer('tkm_write_seconds', feed=_feed(tkmd.filename)):
+        _save_instant_data(tkmd)
+
+
+def _save_instant_data(tkmd):
+    global _delta_encoder  # pylint: disable=W0603
+    f = joinp(_mkdir(DIR.data), tkmd.filename)
+    feed = tkmd.filename.split('.')[0]
+    data = tkmd.data
+    if DEDUP:
+        if feed not in _dedup_encoders:
+            _dedup_encoders[feed] = de.DedupEncoder()
+        data = _dedup_encoders[feed].encode(data, tkmd.filename)
+        if data == de.SAME: METRICS.inc('tkm_dedup_total', feed=feed)
+    if data != de.SAME and DELTA_KEYFRAME > 0 and \
+            tkmd.filename.startswith('TrafficDataNew'):
+        if _delta_encoder is None or \
+                _delta_encoder.keyframe_interval != DELTA_KEYFRAME:
+            _delta_encoder = de.DeltaEncoder(DELTA_KEYFRAME)
+        data = _delta_encoder.encode(data, tkmd.filename)
+    data = tkmd.date.strftime("%Y-%m-%d %H:%M:%S") + ';' + data + '\r\n'
+    appenders().write(f, data, tkmd.date, key=feed)
+    if (COLUMNAR or AGGREGATE_WINDOWS) and tkmd.data != 'NA' and \
+            tkmd.filename.startswith('TrafficDataNew'):
+        save_speed_data(tkmd)
+
+
+def appenders():
+    """Appenders of data files (See appender.py).
+
+    Created on first use and closed at exit.
+
+    :rtype: ap.Appenders
+    """
+    global _appenders  # pylint: disable=W0603
+    if _appenders is None:
+        _appenders = ap.Appenders(FLUSH_INTERVAL, FLUSH_BYTES)
+        atexit.register(_appenders.close)
+    return _appenders
+
+
+def flush_files():
+    """Write buffered data to data files."""
+    if _appenders is not None: _appenders.flush()
+
+
+def close_files():
+    """Flush and close data files and write unfinished aggregates."""
+    if _appenders is not None: _appenders.close()
+    if _aggregator is not None: _aggregator.close()
+
+
+def save_speed_data(tkmd):
+    """Save traffic data to columnar store and aggregates.
+
+    Columnar store (See speedstore.py) is used if COLUMNAR and aggregates
+    (See aggregate.py) if AGGREGATE_WINDOWS. Data is parsed once for both.
+
+    :type tkmd: TKM_DATA
+    :param tkmd: TKM_DATA object of traffic data
+    :rtype: None
+    """
+    with METRICS.timer('tkm_parse_seconds', feed=_feed(tkmd.filename)):
+        v = _parse_speed(tkmd.data)
+    if COLUMNAR:
+        speed_store().append(tkmd.date, v['id'], v['speed'], v['color'])
+    if AGGREGATE_WINDOWS:
+        aggregator().update(tkmd.date, v['id'], v['speed'], v['color'])
+
+
+def segment_history(seg_id, start, end, update=False):
+    """History of a segment from columnar store (See segindex.py).
+
+    Index is updated by compress_files(); rows appended later are only
+    seen if update is True.
+
+    :param seg_id: Segment id
+    :param start: Start date (local time)
+    :param end: End date (local time)
+    :param update: Index new rows before query
+    :type start: datetime.datetime
+    :type end: datetime.datetime
+    :return: Records of (date, speed, color) where date is seconds since
+             epoch
+    :rtype: np.ndarray
+    """
+    return segment_index().segment_history(seg_id, start, end, update)
+
+
+def segment_index():
+    """Per-segment index of columnar store.
+
+    :rtype: si.SegmentIndex
+    """
+    global _segment_index  # pylint: disable=W0603
+    if _segment_index is None:
+        _segment_index = si.SegmentIndex(speed_store())
+    return _segment_index
+
+
+def speed_store():
+    """Columnar binary store of traffic data in data directory.
+
+    :rtype: ss.SpeedStore
+    """
+    global _speed_store  # pylint: disable=W0603
+    if _speed_store is None: _speed_store = ss.SpeedStore(_mkdir(DIR.data))
+    return _speed_store
+
+
+def aggregator():
+    """Online aggregates of traffic data (See aggregate.py).
+
+    Created on first use for AGGREGATE_WINDOWS.
+
+    :rtype: ag.Aggregator
+    """
+    global _aggregator  # pylint: disable=W0603
+    if _aggregator is None:
+        _aggregator = ag.Aggregator(_mkdir(DIR.data), AGGREGATE_WINDOWS)
+    return _aggregator
+
+
+def segment_aggregates(seg_id, window, start, end):
+    """Aggregates of a segment from aggregate files (See aggregate.py).
+
+    :param seg_id: Segment id
+    :param window: Window length in seconds (one of AGGREGATE_WINDOWS)
+    :param start: Start date (local time)
+    :param end: End date (local time)
+    :type start: datetime.datetime
+    :type end: datetime.datetime
+    :return: Records of (start, id, count, sum, min, max, congested) of
+             finished windows. Mean speed is sum / count.
+    :rtype: np.ndarray
+    """
+    return aggregator().segment(seg_id, window, start, end)
+
+
+def _compress_file(args):
+    """Compress a file and remove it. Runs in a worker process.
+
+    :param args: (full path to file, compressed file type)
+    :return: (file name, error message or None)
+    :rtype: tuple
+    """
+    ff, f_type = args
+    try:
+        if f_type == 'blk':
+            ar.build(ff)
+        else:
+            c.compress(ff, f_type=f_type)
+        os.remove(ff)
+        return os.path.basename(ff), None
+    except Exception as e:  # pylint: disable=W0703
+        return os.path.basename(ff), str(e)
+
 
+def compress_files(processes=None, f_type=None):
+    """Compresses downloaded data files.
 
-def compress_files():
-    """Compresses downloaded data files."""
-    lcsv = [f for f in os.listdir(DIR.data) if f.endswith('.csv')]
+    Each file is compressed by a separate worker process.
+
+    :param processes: Number of worker processes. Default is number of CPUs.
+    :param f_type: Compressed file type (See compression.compress).
+                   Default is COMPRESS_TYPE.
+    """
     today_e_tag = _now().strftime('%Y%m%d')
-    for f in lcsv:
-        ff = os.path.join(DIR.data, f)
-        if today_e_tag not in ff:
-            c.compress(ff)
-            log.info('%s compressed.', os.path.basename(ff))
-            os.remove(ff)
+    f_type = f_type or COMPRESS_TYPE
+    close_files()
+    lcsv = [(joinp(DIR.data, f), f_type)
+            for f in os.listdir(_mkdir(DIR.data))
+            if f.endswith('.csv') and today_e_tag not in f]
+    if len(lcsv) > 1 and processes != 1:
+        from multiprocessing import Pool, cpu_count
+        pool = Pool(min(processes or cpu_count(), len(lcsv)))
+        try:
+            results = list(pool.imap_unordered(_compress_file, lcsv))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_compress_file(a) for a in lcsv]
+    for f, e in results:
+        if e is None:
+            log.info('%s compressed.', f)
+        else:
+            log.error('%s -> %s', f, e)
+    if COLUMNAR:
+        n = segment_index().update_all()
+        if n > 0: log.info('%d rows added to segment index.', n)
+
+
+def _data_file(t, date):
+    """Name of data file of a type of instant data for a day."""
+    f = _add_e_tag(path.basename(getattr(URL, _INSTANT[t][0])),
+                   date.strftime('%Y%m%d'))
+    return path.splitext(f)[0] + '.csv'
+
+
+def read_speed_matrix(date):
+    """Read traffic data of a day as a speed matrix.
+
+    Data file of the day is read as is or from its block archive (blk).
+
+    :param date: Day of data
+    :type date: datetime.datetime
+    :return: SPEED_MATRIX (See parse_speed_lines()) or None if not found
+    :rtype: SPEED_MATRIX
+    """
+    flush_files()
+    ff = joinp(DIR.data, _data_file('traffic_data', date))
+    if path.exists(ff + ar.EXT):
+        return parse_speed_lines(ar.read_lines(ff + ar.EXT))
+    if path.exists(ff):
+        with open(ff, 'rb') as fl: return parse_speed_lines(fl)
+    return None
+
+
+def read_snapshot(t, date):
+    """Read a saved snapshot of instant data.
+
+    Returns the latest snapshot at or before date. Only the block of the
+    snapshot is decompressed if the day is archived as a block archive
+    (blk), otherwise data file of the day is scanned.
+
+    :param t: type of data (See get())
+    :param date: Date of snapshot as local time
+    :type date: datetime.datetime
+    :return: TKM_DATA object or None if not found
+    :rtype: TKM_DATA
+    """
+    if t not in _INSTANT:
+        raise ValueError('read_snapshot(t) -> t is not proper option')
+    flush_files()
+    f = _data_file(t, date)
+    ff = joinp(DIR.data, f)
+    if path.exists(ff + ar.EXT):
+        snapshot = ar.read_snapshot(ff + ar.EXT, date)
+    elif path.exists(ff):
+        snapshot, d = None, date.strftime("%Y-%m-%d %H:%M:%S")
+        decoder = de.DeltaDecoder()
+        with open(ff, 'rb') as fl:
+            for l in fl:
+                if l[:19] > d: break
+                snapshot = ar.SNAPSHOT(
+                    l[:19], decoder.decode(l[20:].rstrip('\r\n')))
+    else:
+        return None
+    if snapshot is None: return None
+    d = snapshot.date
+    d = dt.strptime(d, "%Y-%m-%d %H:%M:%S") if isinstance(d, str) \
+        else dt.fromtimestamp(d)
+    return TKM_DATA(date=d, e_tag=None, filename=f, data=snapshot.data)
 
 
 def run_action(a):
-    """ Run specified action. """
+    """ Run specified action.
+
+    :param a: An action name or a list of instant data types. Data of a list
+              is downloaded concurrently by get_many().
+    :type a: str or list
+    """
     actions = ['traffic_data', 'traffic_index', 'parking_data',
                'announcements', 'weather_data', 'static_files',
                'compress']
-    if a in actions:
+    if isinstance(a, (list, tuple)):
+        for t in a:
+            if t not in _INSTANT:
+                raise ValueError('%s is not an instant data type' % t)
+        for t, tkmd in zip(a, get_many(a)):
+            try:
+                save_instant_data(tkmd)
+            except Exception as e:  # pylint: disable=W0703
+                log.error(t + ' -> ' + str(e))
+    elif a in actions:
         try:
             if a == "static_files":
                 download_static_files()
@@ -481,45 +1102,90 @@ def run_action(a):
         raise ValueError('selected action must be one of %s' % str(actions))
 
 
-def worker(action, rep_sec, run_on, stop_event):
-    """ Thread worker """
-    fmt = '%Y-%m-%d %H:%M:%S'
-
-    def _calc_run_on(run_on, delta=0):
-        if isinstance(run_on, str):
-            l = len(run_on)
-            t = _now().strftime(fmt)
-            run_on = t[:-l] + run_on
-            run_on = dt.strptime(run_on, fmt).replace(tzinfo=tz.tzlocal())
-        while run_on < _now():
-            run_on = run_on + datetime.timedelta(0, delta)
-            log.debug("run_on=%s" % run_on)
-        return run_on.strftime(fmt)
-
-    global _run_time  # pylint: disable=W0603
-    a, b = (_now(), 1) if run_on == 'immediate' else (run_on, 60)
-    run_on = _calc_run_on(a, b)
-    if rep_sec > 0: log.info("Thread " + action + " started")
-    while not stop_event.is_set():
-        if _now().strftime(fmt) == run_on:
-            _run_time = dt.strptime(run_on, fmt)
-            run_action(action)
-            if rep_sec <= 0: break
-            time.sleep(rep_sec * 0.9)
-        run_on = _calc_run_on(run_on, rep_sec)
-        time.sleep(0.2)
-    if rep_sec > 0: log.info("Thread " + action + " stopped")
+def job(action):
+    """Create a scheduler job function of an action.
+
+    Job function sets planned run time as the date of instant data and runs
+    the action.
+
+    :param action: See run_action()
+    :rtype: function
+    """
+    name = action if isinstance(action, str) else ','.join(action)
+
+    def _job(planned):
+        global _run_time  # pylint: disable=W0603
+        METRICS.observe('tkm_tick_lateness_seconds', max(0, time.time() - (
+            time.mktime(planned.timetuple()) + planned.microsecond / 1e6)),
+                        job=name)
+        _run_time = planned.replace(microsecond=0)
+        run_action(action)
+    return _job
+
+
+def _collect_metrics(scheduler):
+    """Create a metrics collector of scheduler jobs and circuit breakers."""
+    def _collect(m):
+        for j in scheduler.jobs:
+            m.set_total('tkm_job_runs_total', j.runs, job=j.name)
+            m.set_total('tkm_job_dropped_total', j.dropped, job=j.name)
+        for url, b in BREAKERS.items():
+            m.set('tkm_circuit_open', int(b.state != b.CLOSED),
+                  feed=_feed(url))
+    return _collect
+
+
+def settings():
+    """Current settings as parameters of configure().
+
+    :rtype: dict
+    """
+    return {'tick_budget': TICK_BUDGET, 'columnar': COLUMNAR,
+            'compress_type': COMPRESS_TYPE, 'delta': DELTA_KEYFRAME,
+            'dedup': DEDUP, 'aggregate': list(AGGREGATE_WINDOWS),
+            'flush_interval': FLUSH_INTERVAL, 'metrics_port': METRICS_PORT,
+            'metrics_json': METRICS_JSON or '', 'base_url': BASE_URL}
+
+
+def configure(tick_budget=None, columnar=None, compress_type=None,
+              delta=None, dedup=None, aggregate=None, flush_interval=None,
+              metrics_port=None, metrics_json=None, base_url=None):
+    """Change settings. A setting given as None is not changed.
+
+    See the settings at the top of the module for parameters.
+    """
+    # pylint: disable=W0603
+    global TICK_BUDGET, COLUMNAR, COMPRESS_TYPE, DELTA_KEYFRAME, DEDUP, \
+        AGGREGATE_WINDOWS, FLUSH_INTERVAL, METRICS_PORT, METRICS_JSON, \
+        _aggregator
+    if tick_budget is not None: TICK_BUDGET = tick_budget
+    if columnar is not None: COLUMNAR = columnar
+    if compress_type is not None: COMPRESS_TYPE = compress_type
+    if delta is not None: DELTA_KEYFRAME = delta
+    if dedup is not None: DEDUP = dedup
+    if aggregate is not None and tuple(aggregate) != AGGREGATE_WINDOWS:
+        AGGREGATE_WINDOWS = tuple(aggregate)
+        if _aggregator is not None: _aggregator.close()
+        _aggregator = None
+    if flush_interval is not None:
+        FLUSH_INTERVAL = flush_interval
+        # files opened later use the new interval
+        if _appenders is not None: _appenders.flush_interval = flush_interval
+    if metrics_port is not None: METRICS_PORT = metrics_port
+    if metrics_json is not None: METRICS_JSON = metrics_json or None
+    if base_url is not None and base_url != BASE_URL: set_base_url(base_url)
 
 
 def main():
     """Entry point."""
+    import argparse
+    setup_logging()
+    scheduler = sc.Scheduler()
+
     def signal_handler(*args):  # pylint: disable=W0613
         """ Handle signals from system."""
-        # Stop threads
-        for se in _stop_events: se.set()
-        log.info("Terminating threads...")
-        global _terminate  # pylint: disable=W0603
-        _terminate = True
+        log.info("Terminating jobs...")
+        scheduler.stop()
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGTSTP, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
@@ -542,31 +1208,74 @@ def main():
     p.add_argument('-r', '--repeat', default=0, type=int, dest='rep',
                    help='repeat every n seconds after start ' +
                    '{default: Do not repeat}')
+    p.add_argument('--columnar', action='store_true',
+                   help='also store traffic data in columnar binary files')
+    p.add_argument('--delta', default=DELTA_KEYFRAME, type=int,
+                   dest='delta', metavar='N',
+                   help='store traffic data delta encoded with a keyframe ' +
+                   'every N snapshots {default: 0 (disabled)}')
+    p.add_argument('--dedup', action='store_true',
+                   help="store a snapshot same as the previous one as '='")
+    p.add_argument('--aggregate', default='', metavar='SECONDS',
+                   help='keep per-segment aggregates of traffic data for ' +
+                   'comma separated window lengths such as 900,3600')
+    p.add_argument('--compress-type', default=COMPRESS_TYPE,
+                   choices=['7z', 'zip', 'xz', 'blk'],
+                   help='file type of compressed files ' +
+                   '{default: %s}' % COMPRESS_TYPE)
+    p.add_argument('--flush-interval', default=FLUSH_INTERVAL, type=int,
+                   dest='flush', metavar='N',
+                   help='write buffered data to files at least every N ' +
+                   'seconds {default: %d}' % FLUSH_INTERVAL)
+    p.add_argument('--metrics-port', default=METRICS_PORT, type=int,
+                   metavar='PORT',
+                   help='serve metrics in Prometheus text format on ' +
+                   'localhost:PORT {default: 0 (disabled)}')
+    p.add_argument('--metrics-json', default=METRICS_JSON, metavar='FILE',
+                   help='dump metrics to FILE every %d seconds' %
+                   METRICS_INTERVAL)
+    p.add_argument('--base-url', default=BASE_URL, metavar='URL',
+                   help='base url of web site such as a replay server ' +
+                   '{default: %s}' % BASE_URL)
+    p.add_argument('--overrun', default=sc.SKIP,
+                   choices=sc.OVERRUN_POLICIES,
+                   help='what to do if a run is not finished on next tick ' +
+                   '{default: %s}' % sc.SKIP)
 
     args = p.parse_args()
-
-    threads = []
-    for a, v in sorted(vars(args).items()):
-        if v == 'func':
-            te = threading.Event()
-            threads.append(threading.Thread(target=worker,
-                                            args=[a, args.rep, args.on, te]))
-            _stop_events.append(te)
+    # retries must not pass the next tick
+    configure(tick_budget=args.rep * 0.8 if args.rep > 0 else None,
+              columnar=args.columnar, compress_type=args.compress_type,
+              delta=args.delta, dedup=args.dedup,
+              aggregate=[int(w) for w in args.aggregate.split(',') if w],
+              flush_interval=args.flush,
+              metrics_port=args.metrics_port,
+              metrics_json=args.metrics_json, base_url=args.base_url)
+
+    # instant data are downloaded together by one job, others have
+    # their own job.
+    actions = [a for a, v in sorted(vars(args).items()) if v == 'func']
+    instant = [a for a in actions if a in _INSTANT]
+    actions = [a for a in actions if a not in _INSTANT]
+    if instant: actions.insert(0, instant)
+    start = sc.next_time(args.on)
+    for a in actions:
+        scheduler.add(a if isinstance(a, str) else ','.join(a), job(a),
+                      start, max(args.rep, 0), args.overrun)
+    METRICS.collector(_collect_metrics(scheduler))
+    server = mt.serve(METRICS, METRICS_PORT) if METRICS_PORT > 0 else None
+    if METRICS_JSON and args.rep > 0:
+        scheduler.add('metrics', lambda _: METRICS.dump(METRICS_JSON),
+                      start, METRICS_INTERVAL)
 
     if args.rep > 0:
         log.info('----------------------------------------------------------')
         log.info('Module started in continuous mode')
 
-    # try to start each thread in same time as far as possible
-    for t in threads:
-        # t.daemon = True
-        t.start()
-
-    # do not let main thread end soon
-    # this line helps to keep it alive and
-    # catch signals to exit properly.
-    while not _terminate or all([t.isAlive() for t in threads]):
-        time.sleep(10)
+    scheduler.run()
+    close_files()
+    if server is not None: server.shutdown()
+    if METRICS_JSON: METRICS.dump(METRICS_JSON)
 
     if args.rep > 0: log.info('Module terminated gracefully')
 
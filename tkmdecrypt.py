@@ -4,6 +4,7 @@
 """This is decryption module for tkm.py"""
 
 from array import array
+from binascii import unhexlify
 import numpy as np
 
 # region Constants
@@ -53,6 +54,21 @@ _INT_TO_CHAR_TABLE = '\x00ZN\xc3\x87V bCK\xc4\xb1Ut01\xc3\x9cL\xc5\x9f' + \
                      'g?*-\xc3\xb6f_\xc4\xb0{l}[]#$@<>;.:"\'WwQqXx\\\n\r' + \
                      ',|~\xc3\xa9^\x01\x02\x03\x04\x05\x06\x07\x08\t\x0b' + \
                      '\x0c\x0e\x0f\x10\x11\x12\x13\x14'
+# utf-8 encoded characters of _INT_TO_CHAR_TABLE indexed by int
+_INT_TO_UTF8 = np.array(
+    [i.encode('utf-8') for i in _INT_TO_CHAR_TABLE.decode('utf-8')],
+    dtype=object)
+# decrypt2 tables
+_DECRYPT2_KEY, _DECRYPT2_OFFSET, _DECRYPT2_COUNTER = 3, 6, 3
+_DECRYPT2_CHUNK = 1 << 16  # must be a multiple of 16
+# hex char (byte) -> nibble
+_HEX_LUT = np.array([(i - 55 if i > 57 else i - 48) & 255
+                     for i in range(256)], dtype=np.uint8)
+_REF_1 = np.array(_REF_TABLE_1, dtype=np.uint8)
+_REF_2 = np.array(_REF_TABLE_2, dtype=np.uint8)
+# xor mask of a chunk. It repeats every 16 bytes.
+_DECRYPT2_MASK = _REF_1[
+    ((np.arange(_DECRYPT2_CHUNK) + _DECRYPT2_COUNTER) & 15) + _DECRYPT2_KEY]
 # endregion
 
 
@@ -80,6 +96,38 @@ def _de_shuffle_hex_str(p1, p2, p3, p4):
 
     return ''.join([chr(i) for i in l8])
 
+
+def _de_option(encrypted_text, key):
+    """Return clear text container of encrypted_text.
+
+    Last char of encrypted_text is the option; 0: plain, 1: hex,
+    2: shuffled hex.
+    :rtype: str
+    """
+    l8 = int(encrypted_text[-1])
+    if l8 == 0:
+        return encrypted_text
+    elif l8 == 1:
+        return unhexlify(encrypted_text[:-1])
+    elif l8 == 2:
+        p3 = int(encrypted_text[-2])
+        l7 = [int(key[(i - p3) % _KEY_SIZE]) for i in range(_KEY_SIZE)]
+        h = np.frombuffer(bytearray(encrypted_text[:-2]), dtype=np.uint8)
+        blocks = h[:len(h) - len(h) % _KEY_SIZE].reshape(-1, _KEY_SIZE)
+        blocks[:, l7] = blocks.copy()
+        return unhexlify(h.tostring())
+
+
+def _as_uint8(buf):
+    """Return uint8 array view of a buffer without copying it.
+
+    :type buf: str or bytearray or memoryview
+    :rtype: np.ndarray
+    """
+    if isinstance(buf, memoryview):
+        return np.asarray(buf).view(np.uint8).reshape(-1)
+    return np.frombuffer(buf, dtype=np.uint8)
+
 # endregion
 
 
@@ -88,7 +136,36 @@ def _de_shuffle_hex_str(p1, p2, p3, p4):
 def decrypt0(encrypted_text, key):
     """Decrypt an encrypted text by a key.
 
-    This function is used to decrypt instant data.
+    This function is used to decrypt instant data. Rotate/subtract/map step
+    is done for the whole payload at once by NumPy.
+    :type key: str
+    :type encrypted_text: str
+    :param encrypted_text: Encrypted text
+    :param key: Key string
+    :return:
+    """
+    l6 = _de_option(encrypted_text, key)
+    l9 = [ord(l6[25 + _KEY_SIZE + (ord(l6[(20 + i)]) - 90)]) - 90
+          for i in range(0, _KEY_SIZE)]
+
+    l10 = sum(l9) % l9[0] + 1
+
+    l5 = int(''.join([chr((ord(l6[(20 + _KEY_SIZE + i)]) - (60 + i)))
+                      for i in range(5)]))
+
+    l4 = np.frombuffer(l6, dtype=np.uint8, count=l5,
+                       offset=55 + _KEY_SIZE).astype(np.int16)
+    l20 = np.resize(np.array(l9, dtype=np.int16), l5)
+    l19 = ((l4 >> l20) | ((l4 << (8 - l20)) & 255)) & 255
+    l19 -= l10
+    return ''.join(_INT_TO_UTF8[l19])
+
+
+def decrypt0_old(encrypted_text, key):
+    """Decrypt an encrypted text by a key.
+
+    This function is used to decrypt instant data. Reference
+    implementation of decrypt0.
     :type key: str
     :type encrypted_text: str
     :param encrypted_text: Encrypted text
@@ -141,6 +218,51 @@ def decrypt0(encrypted_text, key):
     return l3.encode('utf-8')
 
 
+def decrypt2_length(encrypted_text):
+    """Return length of decrypted text of an encrypted text.
+
+    :type encrypted_text: str
+    :param encrypted_text: Encrypted text or its length
+    :rtype: int
+    """
+    l = encrypted_text if isinstance(encrypted_text, (int, long)) \
+        else len(encrypted_text)
+    return max(0, (l - _DECRYPT2_OFFSET) // 2)
+
+
+def decrypt2_into(src, out):
+    """Decrypt an encrypted text into a caller supplied buffer.
+
+    This function is used to decrypt static files. src is processed in
+    fixed size chunks, so no copy of whole src is made.
+    :type src: str or bytearray or memoryview
+    :type out: bytearray or memoryview
+    :param src: Encrypted text
+    :param out: Writable buffer at least decrypt2_length(src) bytes long
+    :return: Number of bytes written to out
+    :rtype: int
+    """
+    n = decrypt2_length(src)
+    if n == 0: return 0
+    ibyte, obyte = _as_uint8(src), _as_uint8(out)
+    if len(obyte) < n:
+        raise ValueError('out must be at least %d bytes' % n)
+    hi = ibyte[_DECRYPT2_OFFSET:_DECRYPT2_OFFSET + 2 * n:2]
+    lo = ibyte[_DECRYPT2_OFFSET + 1:_DECRYPT2_OFFSET + 2 * n:2]
+    tmp = np.empty(min(n, _DECRYPT2_CHUNK), dtype=np.uint8)
+    for i in range(0, n, _DECRYPT2_CHUNK):
+        j = min(i + _DECRYPT2_CHUNK, n)
+        o, t = obyte[i:j], tmp[:j - i]
+        np.take(_HEX_LUT, hi[i:j], out=o)
+        o <<= 4
+        np.take(_HEX_LUT, lo[i:j], out=t)
+        o |= t
+        o ^= _DECRYPT2_MASK[:j - i]
+        np.take(_REF_2, o, out=t)
+        o[:] = t
+    return n
+
+
 def decrypt2(encrypted_text):
     """Decrypt an encrypted text.
 
@@ -149,17 +271,9 @@ def decrypt2(encrypted_text):
     :param encrypted_text: Encrypted text
     :return: Decrypted Text
     """
-    # this function is faster for big encrypted_text
-    def f(x): return x - 55 if x > 57 else x - 48
-    f = np.vectorize(f, otypes=[np.uint8])
-
-    ibyte = np.fromstring(encrypted_text, dtype='uint8')
-    key, c1, c2, l = 3, 6, 3, len(ibyte)
-    ii1 = (f(ibyte[c1:l:2]) << 4) + f(ibyte[(c1+1):l:2])
-    cc2 = (np.arange(c2, len(ii1)+c2) & 15) + key
-    rt1 = np.array(_REF_TABLE_1, dtype='int8')
-    rt2 = np.array(_REF_TABLE_2, dtype='int8')
-    return rt2[ii1 ^ rt1[cc2]].tostring()
+    out = bytearray(decrypt2_length(encrypted_text))
+    decrypt2_into(encrypted_text, out)
+    return bytes(out)
 
 
 def decrypt2_old(encrypted_text):